@@ -0,0 +1,385 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+# pomiary nie mogą trafiać do prawdziwych metryk ani czekać w kolejce działającego io_scheduler.py,
+# więc środowisko ustawiamy przed importem skryptów
+os.environ["ARRRRRR_METRICS_LOG"] = ""
+os.environ.pop("ARRRRRR_METRICS_TEXTFILE", None)
+os.environ["RT_IO_SOCKET"] = "/nonexistent/arrrrrr-io.sock"
+
+SCRIPTS = Path(__file__).resolve().parent.parent
+for folder in ("common", "organise", "process", "fetch"):
+    sys.path.insert(0, str(SCRIPTS / folder))
+
+import organise_by_filename as organiser  # noqa: E402
+import simple_remux  # noqa: E402
+from bench_link_extractor import FIXTURES as PAGE_FIXTURES, load_fixtures  # noqa: E402
+from bench_release_parser import (  # noqa: E402
+    CODEC, EPISODE_FORMATS, EXTRA, GROUP, MOVIE_FORMATS, QUALITY, SOURCE, TITLES,
+)
+from library_index import LibraryIndex  # noqa: E402
+from probe_cache import ProbeCache  # noqa: E402
+from release_parser import parse_episode_name, parse_movie_name  # noqa: E402
+from simple_remux import RemuxInputs, SilenceGap, build_ffmpeg_cmd, remux  # noqa: E402
+from vider import extract_mp4_from_html  # noqa: E402
+
+BENCH_DIR = Path(os.environ.get("ARRRRRR_BENCH_DIR", str(Path.home() / ".cache" / "arrrrrr" / "bench")))
+DEFAULT_SIZES = [10, 1000, 100000]
+GROUPS = ("media", "tree", "pages")
+
+SHOW_WORDS = [
+    "Origins", "Legacy", "Reborn", "Chronicles", "Returns", "Rising", "Academy", "Files", "Stories", "Nights", "Kingdom",
+    "Empire", "Frontier", "Odyssey", "Saga", "Tales", "Secrets", "Legends", "Diaries", "Code", "Zero", "Beyond",
+]
+EPISODES_PER_SEASON = 20
+SEASONS_PER_SHOW = 10
+MOVIES_PER_COLLECTION = 50
+PAGE_CALLS = 200  # wywołań na jeden pomiar strony - pojedyncze trwa mikrosekundy
+
+
+@contextlib.contextmanager
+def quiet() -> Iterator[None]:
+    """Silence prints of benchmarked code and of ffmpeg/ffprobe it starts (on file descriptor level)."""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        for fd in (*saved, devnull):
+            os.close(fd)
+
+
+def measure(func: Callable[[], Any], repeat: int, setup: Callable[[], Any] | None = None, number: int = 1) -> float:
+    """Median seconds per call of `func` over `repeat` rounds; `setup` runs before every round and is not timed."""
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with quiet():
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            timings.append((time.perf_counter() - start) / number)
+    return statistics.median(timings)
+
+
+def touch(path: Path) -> None:
+    os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o644))
+
+
+def show_titles() -> list[str]:
+    return [title if not word else f"{title} {word}" for word in ["", *SHOW_WORDS] for title in TITLES]
+
+
+def release_fields(rng: random.Random, title: str, **fields: Any) -> dict[str, Any]:
+    return dict(
+        title=title, dots=title.replace(" ", "."), q=rng.choice(QUALITY), src=rng.choice(SOURCE),
+        extra=rng.choice(EXTRA) or "PL", codec=rng.choice(CODEC), grp=rng.choice(GROUP), **fields,
+    )
+
+
+def tree_entries(root: Path, files: int) -> tuple[Path, Path]:
+    """Series and filmography entries (what rTorrent hands to the organiser) of the tree with `files` videos."""
+    return root / "Seriale" / f"Series.Pack.{files}", root / "Filmografia" / f"Movie.Pack.{files}"
+
+
+def generate_tree(root: Path, files: int, seed: int = 0) -> None:
+    """
+    Torrent-like folders with `files` episodes and `files` movies under realistic release names.
+
+    Files are empty - only names and the directory walk matter. Every season folder also has a sample,
+    an .nfo and subtitles next to each episode, every movie collection an extras folder, like real releases.
+    """
+    rng = random.Random(seed)
+    titles = show_titles()
+    series, films = tree_entries(root, files)
+    season_dir = series
+    for i in range(files):
+        show, n = divmod(i, EPISODES_PER_SEASON * SEASONS_PER_SHOW)
+        season, episode = divmod(n, EPISODES_PER_SEASON)
+        fields = release_fields(rng, titles[show % len(titles)], year=2000 + show % 25, s=season + 1, e=episode + 1)
+        if episode == 0:
+            season_dir = series / "{dots}.S{s:02d}.{q}.{src}-{grp}".format(**fields)
+            (season_dir / "Sample").mkdir(parents=True)
+            touch(season_dir / "Sample" / f"{fields['dots'].lower()}-sample.mkv")
+            touch(season_dir / f"{fields['dots']}.S{fields['s']:02d}.nfo")
+        name = rng.choice(EPISODE_FORMATS).format(**fields)
+        touch(season_dir / name)
+        touch(season_dir / f"{Path(name).stem}.srt")
+
+    collection_dir = films
+    for i in range(files):
+        collection, n = divmod(i, MOVIES_PER_COLLECTION)
+        title = titles[i % len(titles)]
+        fields = release_fields(rng, title, year=1950 + (i // len(titles)) % 76)
+        if n == 0:
+            collection_dir = films / f"Collection.{collection:05d}"
+            (collection_dir / "Extras").mkdir(parents=True)
+            touch(collection_dir / "Extras" / "Behind.The.Scenes.mkv")
+            touch(collection_dir / "collection.nfo")
+        touch(collection_dir / rng.choice(MOVIE_FORMATS).format(**fields))
+
+
+def ensure_tree(fixtures: Path, files: int) -> Path:
+    root = fixtures / "trees" / str(files)
+    if (root / ".complete").exists():
+        return root
+    print(f"Generating torrent tree with {files} episodes and {files} movies in {root}", file=sys.stderr)
+    shutil.rmtree(root, ignore_errors=True)
+    generate_tree(root, files)
+    touch(root / ".complete")
+    return root
+
+
+def generate_media(folder: Path, duration: float) -> tuple[Path, Path, Path]:
+    """
+    Video with English audio, separate audio with Polish and English tracks and SRT subtitles,
+    all generated by ffmpeg `lavfi` sources (no downloads).
+    """
+    video, audio, subs = folder / "video.mkv", folder / "audio.mka", folder / "subs.srt"
+    if all(p.exists() for p in (video, audio, subs)):
+        return video, audio, subs
+    print(f"Generating {duration:g}s of synthetic media in {folder}", file=sys.stderr)
+    folder.mkdir(parents=True, exist_ok=True)
+    ffmpeg = ["ffmpeg", "-v", "error", "-y"]
+    subprocess.run([
+        *ffmpeg,
+        "-f", "lavfi", "-i", f"testsrc2=size=1280x720:rate=25:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+        "-map", "0:v", "-map", "1:a", "-c:a", "aac", "-metadata:s:a:0", "language=eng", str(video),
+    ], check=True)
+    subprocess.run([
+        *ffmpeg,
+        "-f", "lavfi", "-i", f"sine=frequency=523:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=659:duration={duration}",
+        "-map", "0:a", "-map", "1:a", "-c:a", "aac",
+        "-metadata:s:a:0", "language=pol", "-metadata:s:a:1", "language=eng", str(audio),
+    ], check=True)
+    cues = []
+    for i, start in enumerate(range(0, int(duration), 2), start=1):
+        cues.append(f"{i}\n00:00:{start:02d},000 --> 00:00:{start + 1:02d},500\nNapis numer {i}\n")
+    subs.write_text("\n".join(cues), encoding="utf-8")
+    return video, audio, subs
+
+
+@contextlib.contextmanager
+def library_in(media: Path, fixtures_root: Path) -> Iterator[None]:
+    """Point organiser's /media folders at `media` for the duration of the block."""
+    saved = organiser.LINK_FILE_DIR, organiser.MOVIES_FILE_DIR, organiser.SERIES_FILE_DIR, organiser.HOST_PATH
+    organiser.LINK_FILE_DIR = media
+    organiser.MOVIES_FILE_DIR = media / "movies"
+    organiser.SERIES_FILE_DIR = media / "series"
+    # host_path to /downloads + ścieżka bez pierwszego katalogu - tu pierwszy katalog fixtures, żeby pliki istniały
+    organiser.HOST_PATH = Path(*fixtures_root.resolve().parts[:2])
+    try:
+        yield
+    finally:
+        organiser.LINK_FILE_DIR, organiser.MOVIES_FILE_DIR, organiser.SERIES_FILE_DIR, organiser.HOST_PATH = saved
+
+
+def bench_tree(fixtures: Path, files: int, repeat: int, results: dict[str, float], notes: list[str]) -> None:
+    root = ensure_tree(fixtures, files)
+    series, films = tree_entries(root, files)
+
+    def clear_parser_caches() -> None:
+        parse_episode_name.cache_clear()
+        parse_movie_name.cache_clear()
+
+    with library_in(root / "media", fixtures):
+        results[f"tree/{files}/parse_series_dir"] = measure(
+            lambda: organiser.parse_series_dir(series), repeat, clear_parser_caches
+        )
+        results[f"tree/{files}/parse_filmography"] = measure(
+            lambda: organiser.parse_filmography(films), repeat, clear_parser_caches
+        )
+        with quiet():
+            episodes = organiser.parse_series_dir(series)
+            movies = organiser.parse_filmography(films)
+    if len(episodes) != files:
+        notes.append(f"tree/{files}: only {len(episodes)} of {files} episodes parsed")
+
+    # link: pusty katalog biblioteki, link_current: ponowne uruchomienie, gdy wszystko jest już podlinkowane
+    linked, current = [], []
+    scratch = Path(tempfile.mkdtemp(prefix=".links-", dir=fixtures))
+    try:
+        for round_no in range(repeat):
+            media = scratch / str(round_no)
+            media.mkdir()
+            with library_in(media, fixtures), LibraryIndex(media / ".library.sqlite") as index:
+                series_targets = [(e.media_episode_file, e.host_path) for e in episodes]
+                movie_targets = [(m.media_link, m.host_path) for m in movies]
+                for timings in (linked, current):
+                    with quiet():
+                        start = time.perf_counter()
+                        organiser.link_media(index, series_targets, "noop", "Seriale")
+                        organiser.link_media(index, movie_targets, "noop", "Filmografia")
+                        timings.append(time.perf_counter() - start)
+            shutil.rmtree(media)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    results[f"tree/{files}/link"] = statistics.median(linked)
+    results[f"tree/{files}/link_current"] = statistics.median(current)
+
+
+def bench_media(fixtures: Path, duration: float, repeat: int, results: dict[str, float], notes: list[str]) -> None:
+    if not (shutil.which("ffmpeg") and shutil.which("ffprobe")):
+        notes.append("media: ffmpeg/ffprobe not found, skipped")
+        return
+    video, audio, subs = generate_media(fixtures / f"media-{duration:g}s", duration)
+    scratch = Path(tempfile.mkdtemp(prefix=".remux-", dir=fixtures))
+    saved_cache = simple_remux.PROBE_CACHE
+    try:
+        inputs = RemuxInputs(
+            audio_input=audio, video_input=video, output_folder=scratch, audio_lang="pol", sub_lang="pol",
+            audio_title="lektor", sub_title="napisy", subtitle_input=subs,
+        )
+        silence = RemuxInputs(
+            audio_input=audio, video_input=video, output_folder=scratch, audio_lang="pol", sub_lang="pol",
+            audio_title="lektor", sub_title="napisy", subtitle_input=subs,
+            silence_gaps=[SilenceGap(int(duration // 4), 1.0), SilenceGap(int(duration // 2), 2.5)],
+        )
+
+        def clean_output() -> None:
+            inputs.output_file.unlink(missing_ok=True)
+
+        simple_remux.PROBE_CACHE = None
+        results["media/build_ffmpeg_cmd"] = measure(lambda: build_ffmpeg_cmd(inputs), repeat)
+        simple_remux.PROBE_CACHE = ProbeCache(scratch / "probe.sqlite")
+        with quiet():
+            build_ffmpeg_cmd(inputs)
+        results["media/build_ffmpeg_cmd_cached"] = measure(lambda: build_ffmpeg_cmd(inputs), repeat)
+        # remux z gotowym cache ffprobe - mierzy samo ffmpeg i publikowanie pliku
+        results["media/remux"] = measure(lambda: remux(inputs), repeat, clean_output)
+        results["media/remux_silence"] = measure(lambda: remux(silence), repeat, clean_output)
+    finally:
+        simple_remux.PROBE_CACHE = saved_cache
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def bench_pages(folder: Path, repeat: int, results: dict[str, float], notes: list[str]) -> None:
+    for name, page, expected_mp4, _ in load_fixtures(folder):
+        text = page.decode("utf-8")
+        if (found := extract_mp4_from_html(text)) != expected_mp4:
+            notes.append(f"pages/{name}: expected {expected_mp4}, got {found}")
+        results[f"pages/{name}"] = measure(lambda: extract_mp4_from_html(text), repeat, number=PAGE_CALLS)
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} µs"
+    if seconds < 1:
+        return f"{seconds * 1e3:.1f} ms"
+    return f"{seconds:.2f} s"
+
+
+def machine() -> dict[str, Any]:
+    return {"host": platform.node(), "python": platform.python_version(), "cpus": os.cpu_count()}
+
+
+def report(results: dict[str, float], baseline: dict[str, Any] | None, tolerance: float) -> list[str]:
+    """Print results next to the baseline; returns names of benchmarks slower than `tolerance` percent."""
+    stored = baseline["results"] if baseline else {}
+    if baseline and baseline.get("machine") != machine():
+        print(f"Note: baseline was recorded on {baseline.get('machine')}, comparison is only indicative")
+    regressions = []
+    print(f"{'benchmark':<42} {'current':>11} {'baseline':>11} {'change':>8}")
+    for name, seconds in results.items():
+        if name not in stored:
+            print(f"{name:<42} {format_seconds(seconds):>11} {'-':>11} {'':>8}")
+            continue
+        change = (seconds / stored[name] - 1) * 100 if stored[name] else 0.0
+        flag = ""
+        if change > tolerance:
+            flag = "  SLOWER"
+            regressions.append(name)
+        elif change < -tolerance:
+            flag = "  faster"
+        print(f"{name:<42} {format_seconds(seconds):>11} {format_seconds(stored[name]):>11} {change:>+7.0f}%{flag}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline benchmarks of remux, organiser and link extraction.")
+    parser.add_argument(
+        "--fixtures", default=str(BENCH_DIR / "fixtures"),
+        help=f"Folder for generated media and trees, on the disk you want to measure (default: {BENCH_DIR / 'fixtures'})"
+    )
+    parser.add_argument(
+        "--baseline", default=str(BENCH_DIR / "baseline.json"),
+        help=f"Stored results to compare with (default: {BENCH_DIR / 'baseline.json'})"
+    )
+    parser.add_argument("--save-baseline", action="store_true", help="Store results of this run as the baseline")
+    parser.add_argument("--only", action="append", choices=GROUPS, help="Run only this group (can be repeated)")
+    parser.add_argument(
+        "--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+        help=f"Videos per category in generated trees (default: {','.join(map(str, DEFAULT_SIZES))})"
+    )
+    parser.add_argument("--media-duration", type=float, default=20, help="Length of generated media in s (default: 20)")
+    parser.add_argument("--pages", default=str(PAGE_FIXTURES), help=f"Saved vider pages (default: {PAGE_FIXTURES})")
+    parser.add_argument("--repeat", type=int, default=3, help="Rounds per benchmark, median is reported (default: 3)")
+    parser.add_argument("--tolerance", type=float, default=20, help="Allowed slowdown in %% (default: 20)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    fixtures = Path(args.fixtures)
+    fixtures.mkdir(parents=True, exist_ok=True)
+    groups = args.only or GROUPS
+    results: dict[str, float] = {}
+    notes: list[str] = []
+    if "media" in groups:
+        bench_media(fixtures, args.media_duration, args.repeat, results, notes)
+    if "tree" in groups:
+        for size in (int(s) for s in args.sizes.split(",") if s):
+            bench_tree(fixtures, size, args.repeat, results, notes)
+    if "pages" in groups:
+        bench_pages(Path(args.pages), args.repeat, results, notes)
+
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8")) if baseline_path.exists() else None
+    if args.json:
+        print(json.dumps({"machine": machine(), "results": results, "notes": notes}, indent=2))
+        regressions = []
+    else:
+        regressions = report(results, baseline, args.tolerance)
+        for note in notes:
+            print(f"Note: {note}")
+    if args.save_baseline:
+        # wyniki grup, których teraz nie uruchomiono, zostają z poprzedniego zapisu
+        stored = baseline["results"] if baseline else {}
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps({
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "machine": machine(),
+            "results": {**stored, **results},
+        }, indent=2), encoding="utf-8")
+        print(f"Baseline saved to {baseline_path}")
+    elif regressions:
+        print(f"{len(regressions)} benchmark(s) more than {args.tolerance:g}% slower than baseline")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import argparse
+import atexit
+import contextlib
+import fcntl
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Iterator
+
+# pusty ARRRRRR_METRICS_LOG wyłącza zapis
+METRICS_LOG = os.environ.get("ARRRRRR_METRICS_LOG", str(Path.home() / ".cache" / "arrrrrr" / "metrics.jsonl"))
+# katalog textfile collectora node_exportera, np. /var/lib/node_exporter/textfile
+TEXTFILE_DIR = os.environ.get("ARRRRRR_METRICS_TEXTFILE", "")
+FLUSH_INTERVAL = 15.0  # s, jak często długo działające procesy odświeżają plik .prom
+SCRIPT = Path(sys.argv[0]).stem or "python"
+
+
+@dataclass
+class Span:
+    stage: str
+    labels: dict[str, Any] = field(default_factory=dict)
+    bytes: int = 0
+    ok: bool = True
+    duration: float = 0.0
+
+    def add_bytes(self, count: int) -> None:
+        self.bytes += count
+
+
+@dataclass
+class StageTotals:
+    count: int = 0
+    failures: int = 0
+    seconds: float = 0.0
+    bytes: int = 0
+    last_seconds: float = 0.0
+
+
+class Recorder:
+    """
+    Writes finished spans as JSON lines and keeps per-stage totals for the Prometheus textfile.
+
+    Every line is a single `O_APPEND` write, so several scripts can share one log file.
+    Totals are merged into the textfile on exit (and every `FLUSH_INTERVAL` in long-running processes).
+    """
+
+    def __init__(self, log_path: str = METRICS_LOG, textfile_dir: str = TEXTFILE_DIR, script: str = SCRIPT) -> None:
+        self.log_path = Path(log_path) if log_path else None
+        self.textfile_dir = Path(textfile_dir) if textfile_dir else None
+        self.script = script
+        self._lock = threading.Lock()
+        self._pending: dict[str, StageTotals] = {}
+        self._last_flush = time.monotonic()
+        if self.textfile_dir is not None:
+            atexit.register(self.flush)
+
+    def record(self, span: Span) -> None:
+        if self.log_path is not None:
+            line = {
+                "ts": round(time.time(), 3), "script": self.script, "pid": os.getpid(), "stage": span.stage,
+                "seconds": round(span.duration, 4), "bytes": span.bytes, "ok": span.ok, **span.labels,
+            }
+            try:
+                self.log_path.parent.mkdir(parents=True, exist_ok=True)
+                fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, (json.dumps(line, default=str) + "\n").encode())
+                finally:
+                    os.close(fd)
+            except OSError:
+                # metryki nigdy nie przerywają właściwej pracy
+                pass
+        if self.textfile_dir is None:
+            return
+        with self._lock:
+            totals = self._pending.setdefault(span.stage, StageTotals())
+            totals.count += 1
+            totals.failures += not span.ok
+            totals.seconds += span.duration
+            totals.bytes += span.bytes
+            totals.last_seconds = span.duration
+            due = time.monotonic() - self._last_flush >= FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        """Add pending totals to the shared state and rewrite `arrrrrr.prom` atomically."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending or self.textfile_dir is None:
+            return
+        try:
+            self.textfile_dir.mkdir(parents=True, exist_ok=True)
+            state_path = self.textfile_dir / ".arrrrrr-metrics.json"
+            with open(state_path, "a+", encoding="utf-8") as state_file:
+                # wiele skryptów kończy się naraz - stan sumujemy pod blokadą
+                fcntl.flock(state_file, fcntl.LOCK_EX)
+                state_file.seek(0)
+                try:
+                    state = json.loads(state_file.read() or "{}")
+                except ValueError:
+                    state = {}
+                for stage, totals in pending.items():
+                    entry = state.setdefault(f"{self.script}/{stage}", asdict(StageTotals()))
+                    entry["count"] += totals.count
+                    entry["failures"] += totals.failures
+                    entry["seconds"] += totals.seconds
+                    entry["bytes"] += totals.bytes
+                    entry["last_seconds"] = totals.last_seconds
+                state_file.seek(0)
+                state_file.truncate()
+                state_file.write(json.dumps(state))
+                state_file.flush()
+                write_textfile(self.textfile_dir / "arrrrrr.prom", state)
+        except OSError as e:
+            print(f"Cannot write metrics textfile: {e}", file=sys.stderr)
+
+
+def write_textfile(path: Path, state: dict[str, dict[str, float]]) -> None:
+    metrics = (
+        ("arrrrrr_stage_runs_total", "counter", "Finished stage runs", "count"),
+        ("arrrrrr_stage_failures_total", "counter", "Stage runs that raised an error", "failures"),
+        ("arrrrrr_stage_seconds_total", "counter", "Time spent in stage", "seconds"),
+        ("arrrrrr_stage_bytes_total", "counter", "Bytes processed by stage", "bytes"),
+        ("arrrrrr_stage_last_seconds", "gauge", "Duration of the last stage run", "last_seconds"),
+    )
+    lines = []
+    for name, kind, help_text, key in metrics:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for series, entry in sorted(state.items()):
+            script, _, stage = series.partition("/")
+            lines.append(f'{name}{{script="{script}",stage="{stage}"}} {entry[key]:g}')
+    # textfile collector może czytać w trakcie zapisu - tylko tmp + rename
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    os.replace(tmp, path)
+
+
+_recorder: Recorder | None = None
+
+
+def recorder() -> Recorder:
+    """Shared recorder for the whole process."""
+    global _recorder
+    if _recorder is None:
+        _recorder = Recorder()
+    return _recorder
+
+
+@contextlib.contextmanager
+def span(stage: str, **labels: Any) -> Iterator[Span]:
+    """
+    Time the block as one `stage` run; `add_bytes()` on the yielded span counts processed data.
+
+    A span left by an exception is recorded with `ok: false` and the exception is re-raised.
+    """
+    current = Span(stage, labels)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException:
+        current.ok = False
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        recorder().record(current)
+
+
+def record(stage: str, seconds: float, bytes_count: int = 0, ok: bool = True, **labels: Any) -> None:
+    """Record a stage measured elsewhere (e.g. by a shell script)."""
+    recorder().record(Span(stage, labels, bytes_count, ok, seconds))
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def summary(log_path: Path, since: float | None = None) -> None:
+    """Print per-stage count, p50/p95/max duration and throughput from the JSON lines log."""
+    stages: dict[tuple[str, str], list[dict]] = {}
+    with open(log_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if since is None or entry.get("ts", 0) >= since:
+                stages.setdefault((entry.get("script", "?"), entry.get("stage", "?")), []).append(entry)
+    print(f"{'script':<22} {'stage':<10} {'runs':>5} {'fail':>5} {'p50 s':>8} {'p95 s':>8} {'max s':>8} {'MB/s':>8}")
+    for (script, stage), entries in sorted(stages.items()):
+        durations = [e.get("seconds", 0.0) for e in entries]
+        total_bytes = sum(e.get("bytes", 0) for e in entries)
+        rate = f"{total_bytes / max(sum(durations), 1e-6) / 1e6:.1f}" if total_bytes else "-"
+        print(f"{script:<22} {stage:<10} {len(entries):>5} {sum(not e.get('ok', True) for e in entries):>5} "
+              f"{statistics.median(durations):>8.2f} {percentile(durations, 0.95):>8.2f} {max(durations):>8.2f} {rate:>8}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stage timings shared by arrrrrr scripts.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record", help="Record one stage run (for shell scripts)")
+    rec.add_argument("stage")
+    rec.add_argument("--seconds", type=float, required=True)
+    rec.add_argument("--bytes", type=int, default=0)
+    rec.add_argument("--failed", action="store_true")
+    rec.add_argument("--script", default="shell", help="Script name stored with the record (default: shell)")
+    rec.add_argument("--label", action="append", default=[], help="Extra KEY=VALUE field (can be repeated)")
+    show = sub.add_parser("summary", help="Per-stage statistics from the log")
+    show.add_argument("--log", default=METRICS_LOG, help=f"JSON lines log (default: {METRICS_LOG})")
+    show.add_argument("--hours", type=float, help="Only records from the last N hours")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        global _recorder
+        _recorder = Recorder(script=args.script)
+        labels = dict(label.partition("=")[::2] for label in args.label)
+        record(args.stage, args.seconds, args.bytes, not args.failed, **labels)
+    elif args.command == "summary":
+        try:
+            summary(Path(args.log), time.time() - args.hours * 3600 if args.hours else None)
+        except FileNotFoundError:
+            print(f"No metrics recorded yet ({args.log})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import argparse
+import codecs
+import json
+import re
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+
+from vider import PAGE_CHUNK, RE_FILE_PARAM, RE_MP4, LinkExtractor, decode_multi, maybe_find_embed_url
+
+FIXTURES = Path(__file__).with_name("page_fixtures")
+
+
+def load_fixtures(folder: Path) -> list[tuple[str, bytes, str | None, str | None]]:
+    entries = []
+    for line in (folder / "expected.tsv").read_text(encoding="utf-8").splitlines():
+        if line and not line.startswith("#"):
+            name, mp4, embed = line.split("\t")
+            entries.append((name, (folder / name).read_bytes(), None if mp4 == "-" else mp4, None if embed == "-" else embed))
+    return entries
+
+
+def legacy_extract(page: bytes) -> tuple[str | None, str | None]:
+    """Previous implementation: whole page as text, three separate passes (reference for comparison)."""
+    html_text = page.decode("utf-8")
+    mp4 = None
+    if m := RE_MP4.search(html_text):
+        mp4 = m.group(0)
+    if not mp4:
+        for m in RE_FILE_PARAM.finditer(html_text):
+            if m2 := RE_MP4.search(decode_multi(m.group(1))):
+                mp4 = m2.group(0)
+                break
+    if not mp4 and (m := re.search(r'file\s*[:=]\s*["\']([^"\']+\.mp4\?uid=\d+)["\']', html_text, re.IGNORECASE)):
+        if m2 := RE_MP4.search(decode_multi(m.group(1))):
+            mp4 = m2.group(0)
+    embed = maybe_find_embed_url(html_text) if not mp4 else None
+    if not mp4:
+        for url in re.findall(r'https?://[^\s"\']+', html_text):
+            if m := RE_MP4.search(decode_multi(url)):
+                mp4 = m.group(0)
+                break
+    return mp4, embed
+
+
+def streaming_extract(page: bytes) -> tuple[str | None, str | None, int]:
+    """LinkExtractor fed the way `scan_page` feeds it (incrementally decoded chunks)."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    extractor = LinkExtractor()
+    for offset in range(0, len(page), PAGE_CHUNK):
+        if extractor.feed(decoder.decode(page[offset:offset + PAGE_CHUNK])) is not None:
+            break
+    else:
+        extractor.feed(decoder.decode(b"", final=True), final=True)
+    return extractor.mp4, extractor.embed if extractor.mp4 is None else None, extractor.scanned
+
+
+def measure(func, page: bytes, repeat: int) -> tuple[float, int]:
+    """Median latency (µs) and peak memory allocated by one call (bytes)."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(page)
+        timings.append((time.perf_counter() - start) * 1e6)
+    tracemalloc.start()
+    func(page)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(timings), peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark MP4 link extraction on saved pages.")
+    parser.add_argument("--fixtures", default=str(FIXTURES), help=f"Folder with pages and expected.tsv (default: {FIXTURES})")
+    parser.add_argument("--repeat", type=int, default=200, help="Runs per page for latency (default: 200)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    rows = []
+    for name, page, expected_mp4, expected_embed in load_fixtures(Path(args.fixtures)):
+        mp4, embed, scanned = streaming_extract(page)
+        legacy_us, legacy_peak = measure(legacy_extract, page, args.repeat)
+        stream_us, stream_peak = measure(streaming_extract, page, args.repeat)
+        rows.append(dict(
+            page=name, size=len(page), ok=(mp4, embed) == (expected_mp4, expected_embed),
+            legacy_ok=legacy_extract(page) == (expected_mp4, expected_embed),
+            scanned=scanned, legacy_us=legacy_us, stream_us=stream_us,
+            legacy_peak=legacy_peak, stream_peak=stream_peak,
+        ))
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    print(f"{'page':<24} {'ok':<4} {'scanned':>8} {'legacy µs':>10} {'stream µs':>10} {'legacy KiB':>11} {'stream KiB':>11}")
+    for r in rows:
+        status = "OK" if r["ok"] else "FAIL"
+        print(f"{r['page']:<24} {status:<4} {r['scanned'] * 100 // max(r['size'], 1):>7}% {r['legacy_us']:>10.0f} "
+              f"{r['stream_us']:>10.0f} {r['legacy_peak'] / 1024:>11.0f} {r['stream_peak'] / 1024:>11.0f}")
+    failed = [r["page"] for r in rows if not r["ok"]]
+    print(f"{len(rows) - len(failed)}/{len(rows)} pages extracted correctly" + (f", failed: {', '.join(failed)}" if failed else ""))
+
+
+if __name__ == "__main__":
+    main()
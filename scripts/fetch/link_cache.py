@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from http.cookiejar import CookieJar
+from pathlib import Path
+from typing import Any, Iterator
+
+import requests
+
+DEFAULT_LINK_CACHE_PATH = Path(
+    os.environ.get("VIDER_LINK_CACHE", Path.home() / ".cache" / "arrrrrr" / "vider-links.sqlite")
+)
+DEFAULT_TTL = 6 * 3600  # s, po tym czasie link z uid uznajemy za wygasły
+REJECTED_STATUSES = (403, 404, 410)
+
+
+@dataclass(frozen=True)
+class CachedLink:
+    page_url: str
+    mp4_url: str
+    referer: str
+    cookies: list[dict[str, Any]]
+    discovered_at: float
+
+
+def dump_cookies(jar: CookieJar) -> list[dict[str, Any]]:
+    return [
+        {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path, "expires": c.expires}
+        for c in jar
+    ]
+
+
+def restore_cookies(jar: CookieJar, cookies: list[dict[str, Any]]) -> None:
+    for c in cookies:
+        jar.set_cookie(requests.cookies.create_cookie(**c))
+
+
+def is_rejected(error: requests.HTTPError) -> bool:
+    """True when the server refused the link itself (expired uid, removed video), not a transient error."""
+    return error.response is not None and error.response.status_code in REJECTED_STATUSES
+
+
+class LinkCache:
+    """
+    Persistent cache of resolved direct links: page URL -> (MP4 URL, referer, cookies).
+
+    Entries older than `ttl` seconds are ignored and removed on the next write. Callers
+    invalidate an entry when the CDN rejects the cached link and resolve the page again.
+    """
+
+    def __init__(self, db_path: Path = DEFAULT_LINK_CACHE_PATH, ttl: float = DEFAULT_TTL) -> None:
+        self.db_path = db_path
+        self.ttl = ttl
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS links ("
+                " page_url TEXT PRIMARY KEY,"
+                " mp4_url TEXT NOT NULL,"
+                " referer TEXT NOT NULL,"
+                " cookies TEXT NOT NULL,"
+                " discovered_at REAL NOT NULL)"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # osobne połączenie na operację - bezpieczne przy wielu wątkach/procesach;
+        # samo "with conn" tylko commituje, więc zamykamy je jawnie
+        db = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, page_url: str) -> CachedLink | None:
+        """Return cached link, or None when missing or older than TTL."""
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT mp4_url, referer, cookies, discovered_at FROM links WHERE page_url = ? AND discovered_at >= ?",
+                (page_url, time.time() - self.ttl),
+            ).fetchone()
+        if row is None:
+            return None
+        return CachedLink(page_url, row[0], row[1], json.loads(row[2]), row[3])
+
+    def put(self, page_url: str, mp4_url: str, referer: str, cookies: list[dict[str, Any]]) -> None:
+        """Store resolved link and drop expired entries."""
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO links (page_url, mp4_url, referer, cookies, discovered_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (page_url, mp4_url, referer, json.dumps(cookies), now),
+            )
+            db.execute("DELETE FROM links WHERE discovered_at < ?", (now - self.ttl,))
+
+    def invalidate(self, page_url: str) -> None:
+        with self._connect() as db:
+            db.execute("DELETE FROM links WHERE page_url = ?", (page_url,))
@@ -0,0 +1,387 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+
+import requests
+
+CHUNK_SIZE = 256 * 1024
+MIN_SEGMENT = 2 * 1024 * 1024   # mniejszych kawałków nie dzielimy już między połączenia
+MAX_RETRIES = 5                 # nieudane próby jednego segmentu, zanim poddamy całe pobieranie
+ADJUST_INTERVAL = 2.0           # s, co ile sprawdzamy, czy warto dołożyć połączenie
+SCALE_THRESHOLD = 0.7           # dokładamy, dopóki prędkość na połączenie trzyma >= 70% początkowej
+STATE_INTERVAL = 5.0            # s, co ile utrwalamy postęp w pliku stanu
+MD5_ETAG = re.compile(r'^"?([0-9a-f]{32})"?$', re.IGNORECASE)
+
+
+@dataclass
+class Segment:
+    start: int
+    end: int        # pierwszy bajt za segmentem
+    pos: int        # następny bajt do zapisania
+    failures: int = 0
+    active: bool = False
+
+    @property
+    def remaining(self) -> int:
+        return self.end - self.pos
+
+
+@dataclass
+class RemoteFile:
+    size: int
+    etag: str | None = None
+    last_modified: str | None = None
+
+
+@dataclass
+class DownloadState:
+    """Sidecar of a `.part` file: what is being downloaded and which byte ranges are already on disk."""
+    url: str
+    size: int
+    etag: str | None = None
+    last_modified: str | None = None
+    ranges: list[list[int]] = field(default_factory=list)  # [start, end) zapisane i zsynchronizowane
+
+    def matches(self, remote: RemoteFile) -> bool:
+        """Same file on the server: size and any validator known on both sides agree."""
+        return (
+            self.size == remote.size
+            and (self.etag is None or remote.etag is None or self.etag == remote.etag)
+            and (self.last_modified is None or remote.last_modified is None or self.last_modified == remote.last_modified)
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "DownloadState | None":
+        try:
+            with open(path, encoding="utf-8") as f:
+                return cls(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def save(self, path: str) -> None:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(asdict(self), f)
+        os.replace(tmp, path)
+
+
+class SegmentScheduler:
+    """
+    Hands out byte ranges to download workers.
+
+    Missing parts of the file are split into at least `count` segments. When there is no idle
+    segment left, a new worker takes the second half of the largest segment still in progress,
+    so extra connections help until the very end and a slow connection never holds up the tail alone.
+    """
+
+    def __init__(self, total: int, count: int, done: list[list[int]] | None = None) -> None:
+        self.total = total
+        self.segments: list[Segment] = []
+        pos = 0
+        for start, end in sorted(done or []) + [[total, total]]:
+            if start > pos:
+                self.segments.append(Segment(pos, start, pos))
+            if end > start:
+                self.segments.append(Segment(start, end, end))  # już pobrane
+            pos = max(pos, end)
+        while sum(seg.remaining > 0 for seg in self.segments) < count:
+            largest = max(self.segments, key=lambda s: s.remaining)
+            if largest.remaining < 2 * MIN_SEGMENT:
+                break
+            self.segments.append(self._split(largest))
+        self.error: BaseException | None = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _split(seg: Segment) -> Segment:
+        middle = seg.pos + seg.remaining // 2
+        second = Segment(middle, seg.end, middle)
+        seg.end = middle
+        return second
+
+    @property
+    def downloaded(self) -> int:
+        with self._lock:
+            return sum(seg.pos - seg.start for seg in self.segments)
+
+    def done_ranges(self) -> list[list[int]]:
+        """Written ranges, merged and sorted."""
+        with self._lock:
+            ranges = sorted([seg.start, seg.pos] for seg in self.segments if seg.pos > seg.start)
+        merged: list[list[int]] = []
+        for start, end in ranges:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+    def take(self) -> Segment | None:
+        with self._lock:
+            if self.error is not None:
+                return None
+            for seg in self.segments:
+                if not seg.active and seg.remaining > 0:
+                    seg.active = True
+                    return seg
+            busiest = max((s for s in self.segments if s.active), key=lambda s: s.remaining, default=None)
+            if busiest is None or busiest.remaining < 2 * MIN_SEGMENT:
+                return None
+            stolen = self._split(busiest)
+            stolen.active = True
+            self.segments.append(stolen)
+            return stolen
+
+    def claim(self, seg: Segment, length: int) -> tuple[int, int]:
+        """Offset and number of bytes (up to `length`) to write at the segment position."""
+        with self._lock:
+            return seg.pos, min(length, seg.end - seg.pos)
+
+    def advance(self, seg: Segment, length: int) -> None:
+        """Mark `length` bytes as written (only after pwrite, so saved ranges never contain holes)."""
+        with self._lock:
+            seg.pos += length
+
+    def release(self, seg: Segment, error: BaseException | None = None) -> None:
+        with self._lock:
+            seg.active = False
+            if error is None:
+                return
+            seg.failures += 1
+            if seg.failures > MAX_RETRIES and self.error is None:
+                self.error = error
+
+    def fail(self, seg: Segment, error: BaseException) -> None:
+        """Stop the whole download (error that retrying will not fix, e.g. full disk)."""
+        with self._lock:
+            seg.active = False
+            if self.error is None:
+                self.error = error
+
+
+def clone_session(sess: requests.Session) -> requests.Session:
+    """Separate session (own connection) with the same cookies and headers."""
+    clone = requests.Session()
+    clone.headers.update(sess.headers)
+    clone.cookies.update(sess.cookies)
+    return clone
+
+
+def probe(sess: requests.Session, url: str, headers: dict[str, str]) -> RemoteFile | None:
+    """Size (from `Content-Range`) and validators, or None when the server does not support byte ranges."""
+    with sess.get(url, headers=dict(headers, Range="bytes=0-0"), timeout=30, stream=True, allow_redirects=True) as r:
+        r.raise_for_status()
+        if r.status_code != 206 or "/" not in r.headers.get("Content-Range", ""):
+            return None
+        try:
+            size = int(r.headers["Content-Range"].split("/")[-1])
+        except ValueError:
+            return None
+        return RemoteFile(size, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+
+
+def pwrite_all(fd: int, data: bytes | memoryview, offset: int) -> None:
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view, offset = view[written:], offset + written
+
+
+def fetch_segment(
+    sess: requests.Session, url: str, headers: dict[str, str], fd: int, scheduler: SegmentScheduler, seg: Segment
+) -> None:
+    range_headers = dict(headers, Range=f"bytes={seg.pos}-{seg.end - 1}")
+    with sess.get(url, headers=range_headers, timeout=30, stream=True, allow_redirects=True) as r:
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise requests.HTTPError(f"Serwer zignorował Range (HTTP {r.status_code})", response=r)
+        for part in r.iter_content(chunk_size=CHUNK_SIZE):
+            offset, length = scheduler.claim(seg, len(part))
+            if length:
+                pwrite_all(fd, memoryview(part)[:length], offset)
+                scheduler.advance(seg, length)
+            if seg.remaining == 0:
+                # koniec segmentu (mógł się skrócić, gdy inne połączenie przejęło jego drugą połowę)
+                return
+    if seg.remaining > 0:
+        raise requests.ConnectionError(f"Połączenie zerwane w bajcie {seg.pos}")
+
+
+def print_progress(written: int, total: int, connections: int) -> None:
+    pct = written * 100 // total if total else 100
+    print(f"\rPobrano: {written//1024//1024} MiB / {total//1024//1024} MiB ({pct}%), połączeń: {connections} ",
+          end="", file=sys.stderr)
+
+
+def part_paths(out_path: str) -> tuple[str, str]:
+    """Paths of the partial file and its state sidecar."""
+    return out_path + ".part", out_path + ".part.json"
+
+
+def fsync_dir(path: str) -> None:
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def verify(part_path: str, remote: RemoteFile) -> None:
+    """MD5 check when the server ETag is a plain MD5 digest (common for static CDN files)."""
+    if remote.etag and (m := MD5_ETAG.match(remote.etag)):
+        digest = hashlib.md5()
+        with open(part_path, "rb") as f:
+            while block := f.read(1 << 20):
+                digest.update(block)
+        if digest.hexdigest() != m.group(1).lower():
+            raise OSError(f"Suma MD5 {part_path} nie zgadza się z ETag {remote.etag}")
+
+
+def promote(part_path: str, state_path: str, out_path: str) -> None:
+    """Atomically move finished `.part` into place and drop its sidecar."""
+    os.replace(part_path, out_path)
+    fsync_dir(out_path)
+    try:
+        os.unlink(state_path)
+    except FileNotFoundError:
+        pass
+
+
+def download_segmented(
+    sess: requests.Session,
+    url: str,
+    out_path: str,
+    headers: dict[str, str],
+    connections: int = 4,
+    max_connections: int = 16,
+) -> bool:
+    """
+    Download `url` into `out_path` over several parallel byte-range connections.
+
+    Data goes to `<out_path>.part`; `<out_path>.part.json` keeps validators and ranges already
+    on disk, so an interrupted download continues where it stopped (also with a fresh URL, as
+    long as size, ETag and Last-Modified match). The file is verified and renamed into place at the end.
+
+    Starts with `connections` workers and adds one more every ADJUST_INTERVAL while speed per
+    connection stays close to the initial one (the CDN limits single connections, not the link).
+    Failed segments are retried on their own from the last written byte.
+    Returns False without writing anything when the server does not support ranges.
+    """
+    remote = probe(sess, url, headers)
+    if remote is None:
+        return False
+
+    part_path, state_path = part_paths(out_path)
+    state = DownloadState.load(state_path)
+    if state is None or not state.matches(remote) or not os.path.exists(part_path) \
+            or os.path.getsize(part_path) != remote.size:
+        state = DownloadState(url, remote.size, remote.etag, remote.last_modified)
+    elif state.ranges:
+        print(f"Wznawiam: {sum(end - start for start, end in state.ranges)//1024//1024} MiB już pobrane",
+              file=sys.stderr)
+    state.url = url
+    total = remote.size
+
+    scheduler = SegmentScheduler(total, connections, state.ranges)
+    fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | (0 if state.ranges else os.O_TRUNC), 0o644)
+    completed = False
+
+    def checkpoint() -> None:
+        # najpierw lista zakresów, potem fdatasync - zapisany stan nigdy nie wyprzedza danych na dysku
+        state.ranges = scheduler.done_ranges()
+        os.fdatasync(fd)
+        state.save(state_path)
+
+    try:
+        os.ftruncate(fd, total)
+        if hasattr(os, "posix_fallocate") and total:
+            try:
+                os.posix_fallocate(fd, 0, total)
+            except OSError:
+                pass
+        state.save(state_path)
+
+        alive = 0
+        alive_lock = threading.Lock()
+
+        def worker() -> None:
+            nonlocal alive
+            worker_sess = clone_session(sess)
+            try:
+                while (seg := scheduler.take()) is not None:
+                    try:
+                        fetch_segment(worker_sess, url, headers, fd, scheduler, seg)
+                    except requests.RequestException as e:
+                        scheduler.release(seg, e)
+                        time.sleep(min(2 ** seg.failures, 30))
+                    except BaseException as e:
+                        # np. OSError z pwrite przy pełnym dysku - bez tego pobieranie skończyłoby się "sukcesem"
+                        scheduler.fail(seg, e)
+                        return
+                    else:
+                        scheduler.release(seg)
+            finally:
+                worker_sess.close()
+                with alive_lock:
+                    alive -= 1
+
+        def spawn() -> None:
+            nonlocal alive
+            with alive_lock:
+                alive += 1
+            threading.Thread(target=worker, daemon=True).start()
+
+        for _ in range(min(connections, sum(seg.remaining > 0 for seg in scheduler.segments)) or 1):
+            spawn()
+        spawned = alive
+        baseline: float | None = None
+        last_bytes, last_time = scheduler.downloaded, time.monotonic()
+        last_checkpoint = last_time
+        while alive:
+            time.sleep(0.5)
+            written = scheduler.downloaded
+            print_progress(written, total, alive)
+            now = time.monotonic()
+            if now - last_checkpoint >= STATE_INTERVAL:
+                checkpoint()
+                last_checkpoint = now
+            if now - last_time < ADJUST_INTERVAL:
+                continue
+            per_connection = (written - last_bytes) / (now - last_time) / max(alive, 1)
+            last_bytes, last_time = written, now
+            if baseline is None:
+                baseline = per_connection
+            elif per_connection < baseline * SCALE_THRESHOLD:
+                max_connections = spawned  # łącze nasycone - więcej połączeń tylko by się przepychało
+            if spawned < max_connections and total - written > 2 * MIN_SEGMENT:
+                spawn()
+                spawned += 1
+
+        if scheduler.error is not None:
+            raise scheduler.error
+        # rozmiar .part to zawsze total (ftruncate na starcie) - o kompletności mówią tylko zapisane zakresy
+        if (done := scheduler.done_ranges()) != ([[0, total]] if total else []):
+            missing = total - sum(end - start for start, end in done)
+            raise OSError(f"Niepełny plik {part_path}: brakuje {missing} z {total} bajtów")
+        os.fsync(fd)
+        completed = True
+    finally:
+        if not completed:
+            checkpoint()
+        os.close(fd)
+
+    print(file=sys.stderr)
+    try:
+        verify(part_path, remote)
+    except OSError:
+        os.unlink(state_path)  # uszkodzony plik - następne uruchomienie zacznie od zera
+        raise
+    promote(part_path, state_path, out_path)
+    return True
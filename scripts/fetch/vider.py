@@ -1,13 +1,21 @@
 #!/usr/bin/env python3
 # my_script.py
 import argparse
+import contextlib
 import html
 import os
 import re
 import sys
 import urllib.parse
+from pathlib import Path
+from typing import Callable, ContextManager
+
 import requests
 
+from link_cache import DEFAULT_LINK_CACHE_PATH, DEFAULT_TTL, LinkCache, dump_cookies, is_rejected, restore_cookies
+from metrics import span
+from segmented_download import download_segmented, part_paths, promote
+
 UA = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
       "(KHTML, like Gecko) Chrome/124.0 Safari/537.36")
 
@@ -26,6 +34,20 @@ RE_FILE_PARAM = re.compile(
     re.IGNORECASE
 )
 
+# wszystkie rodzaje kandydatów w jednym wzorcu - strona jest skanowana raz, w kolejności dokumentu
+RE_CANDIDATE = re.compile(
+    r'(?P<mp4>' + RE_MP4.pattern + r')'
+    r'|src\s*=\s*["\'](?P<embed>https?://(?:www\.)?vider\.(?:pl|info)/embed[^"\']+)["\']'
+    r'|(?:[?&]|["\'])file=(?P<param>[^&"\'\s>]+)'
+    r'|file\s*[:=]\s*["\'](?P<js>[^"\']+\.mp4\?uid=\d+)["\']'
+    r'|(?P<url>https?://[^\s"\']+)',
+    re.IGNORECASE
+)
+PAGE_CHUNK = 16 * 1024
+
+# Globalny cache rozwiązanych linków (None = wyłączony), ustawiany w main()
+LINK_CACHE: LinkCache | None = None
+
 def decode_multi(s: str, rounds: int = 3) -> str:
     prev = None
     cur = s
@@ -37,44 +59,149 @@ def decode_multi(s: str, rounds: int = 3) -> str:
         cur = dec
     return cur
 
-def get(url: str, referer: str | None = None, session: requests.Session | None = None) -> requests.Response:
-    sess = session or requests.Session()
-    headers = {
+def page_headers(url: str, referer: str | None = None) -> dict[str, str]:
+    return {
         "User-Agent": UA,
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
         "Accept-Language": "pl-PL,pl;q=0.9,en-US;q=0.8,en;q=0.7",
         "Referer": referer or url,
         "Connection": "keep-alive",
     }
-    resp = sess.get(url, headers=headers, timeout=15, allow_redirects=True)
+
+def get(url: str, referer: str | None = None, session: requests.Session | None = None) -> requests.Response:
+    sess = session or requests.Session()
+    resp = sess.get(url, headers=page_headers(url, referer), timeout=15, allow_redirects=True)
     resp.raise_for_status()
     return resp
 
-def extract_mp4_from_html(html_text: str) -> str | None:
-    m = RE_MP4.search(html_text)
-    if m:
-        return m.group(0)
+class LinkExtractor:
+    """
+    Incremental search for the direct MP4 link in a page fed chunk by chunk.
 
-    for m in RE_FILE_PARAM.finditer(html_text):
-        candidate = decode_multi(m.group(1))
-        m2 = RE_MP4.search(candidate)
-        if m2:
-            return m2.group(0)
+    Direct links, `file=` parameters, player configs and any other URL are matched by a single
+    pattern in document order; each candidate string is decoded at most once. Scanning stops at
+    the first direct link. The first vider embed URL is remembered as a fallback.
+    """
 
-    m = re.search(r'file\s*[:=]\s*["\']([^"\']+\.mp4\?uid=\d+)["\']', html_text, re.IGNORECASE)
-    if m:
-        candidate = decode_multi(m.group(1))
-        m2 = RE_MP4.search(candidate)
-        if m2:
-            return m2.group(0)
+    OVERLAP = 4096  # znaki z końca bufora skanowane ponownie, żeby nie zgubić dopasowania na granicy kawałków
+    WINDOW = 2048   # jak daleko przed "mp4"/"/embed" może zaczynać się kandydat
+    HINTS = ("mp4", "/embed")  # szukane w buforze po lower(), jak IGNORECASE w wyrażeniach
 
-    return None
+    def __init__(self) -> None:
+        self.mp4: str | None = None
+        self.embed: str | None = None
+        self.scanned = 0  # liczba znaków przeczytanych do momentu znalezienia linku
+        self._buffer = ""
+        self._decoded: dict[str, str | None] = {}
+
+    def _decode_mp4(self, candidate: str) -> str | None:
+        if "mp4" not in candidate.lower():
+            return None  # obrazki, skrypty, linki do innych filmów - nie ma czego dekodować
+        if candidate not in self._decoded:
+            m = RE_MP4.search(decode_multi(candidate))
+            self._decoded[candidate] = m.group(0) if m else None
+        return self._decoded[candidate]
+
+    def feed(self, text: str, final: bool = False) -> str | None:
+        if self.mp4 is not None:
+            return self.mp4
+        self.scanned += len(text)
+        buf = self._buffer + text
+        keep = 0 if final else max(0, len(buf) - self.OVERLAP)
+        # każdy użyteczny kandydat zawiera "mp4" albo "/embed" - str.find jest wielokrotnie szybszy od wyrażenia,
+        # więc wyrażenie uruchamiamy dopiero tuż przed pierwszym takim miejscem
+        lowered = buf.lower()
+        hits = [i for i in map(lowered.find, self.HINTS) if i != -1]
+        if not hits:
+            self._buffer = "" if final else buf[keep:]
+            return None
+        # lower() potrafi zmienić długość tekstu (np. "İ") - wtedy indeksy nie pasują, skanujemy od początku
+        start = max(0, min(hits) - self.WINDOW) if len(lowered) == len(buf) else 0
+        for m in RE_CANDIDATE.finditer(buf, start):
+            if not final and m.end() == len(buf):
+                # dopasowanie może ciągnąć się w następnym kawałku
+                keep = min(keep, m.start())
+                break
+            kind = m.lastgroup
+            if kind == "mp4":
+                self.mp4 = m.group(kind)
+            else:
+                self.mp4 = self._decode_mp4(m.group(kind))
+            if self.mp4 is not None:
+                self.scanned -= len(buf) - m.end()
+                self._buffer = ""
+                return self.mp4
+            if kind == "embed" and self.embed is None:
+                self.embed = m.group(kind)
+        self._buffer = "" if final else buf[keep:]
+        return None
+
+def extract_mp4_from_html(html_text: str) -> str | None:
+    return LinkExtractor().feed(html_text, final=True)
 
 def maybe_find_embed_url(html_text: str) -> str | None:
     m = RE_EMBED.search(html_text)
     return m.group("u") if m else None
 
-def download_with_session(sess: requests.Session, mp4_url: str, out_path: str, referer: str):
+def scan_page(sess: requests.Session, url: str, referer: str | None = None) -> LinkExtractor:
+    """Stream page `url` through LinkExtractor, without reading the rest once the link is found."""
+    extractor = LinkExtractor()
+    with sess.get(url, headers=page_headers(url, referer), timeout=15, allow_redirects=True, stream=True) as r:
+        r.raise_for_status()
+        r.encoding = r.encoding or "utf-8"
+        for chunk in r.iter_content(chunk_size=PAGE_CHUNK, decode_unicode=True):
+            if extractor.feed(chunk) is not None:
+                break
+        else:
+            extractor.feed("", final=True)
+    return extractor
+
+def resolve_mp4(sess: requests.Session, page_url: str) -> tuple[str | None, str]:
+    """Znajdź direct-link MP4 dla strony `page_url`. Zwraca (link lub None, referer do pobierania)."""
+    # 1) strona wejściowa - link bezpośredni, zakodowany w parametrach albo w dowolnym URL-u
+    page = scan_page(sess, page_url)
+    if page.mp4:
+        return page.mp4, page_url
+
+    # 2) jeśli nie ma, spróbuj przez stronę osadzającą (embed)
+    if page.embed:
+        embed = scan_page(sess, page.embed, referer=page_url)
+        if embed.mp4:
+            return embed.mp4, page.embed
+
+    return None, page_url
+
+def resolve_link(
+    sess: requests.Session,
+    page_url: str,
+    use_cache: bool = True,
+    hold: Callable[[], ContextManager] = contextlib.nullcontext,
+) -> tuple[str | None, str, bool]:
+    """
+    Jak resolve_mp4, ale najpierw sprawdza LINK_CACHE (razem z cookies z chwili rozwiązania).
+    Zwraca (link lub None, referer, czy link pochodzi z cache). `hold` otacza tylko zapytania do strony.
+    """
+    if use_cache and LINK_CACHE is not None and (cached := LINK_CACHE.get(page_url)) is not None:
+        restore_cookies(sess.cookies, cached.cookies)
+        return cached.mp4_url, cached.referer, True
+    with hold(), span("resolve", found=False) as resolve_span:
+        mp4, referer = resolve_mp4(sess, page_url)
+        resolve_span.labels["found"] = mp4 is not None
+    if mp4 and LINK_CACHE is not None:
+        LINK_CACHE.put(page_url, mp4, referer, dump_cookies(sess.cookies))
+    return mp4, referer, False
+
+def download_with_session(
+    sess: requests.Session, mp4_url: str, out_path: str, referer: str, connections: int = 4, max_connections: int = 16
+) -> str:
+    with span("download", connections=connections) as download_span:
+        out_path = _download(sess, mp4_url, out_path, referer, connections, max_connections)
+        download_span.add_bytes(os.path.getsize(out_path))
+    return out_path
+
+def _download(
+    sess: requests.Session, mp4_url: str, out_path: str, referer: str, connections: int, max_connections: int
+) -> str:
     # jeśli out_path jest katalogiem – użyj nazwy z URL
     if os.path.isdir(out_path):
         filename = os.path.basename(urllib.parse.urlparse(mp4_url).path) or "video.mp4"
@@ -87,10 +214,18 @@ def download_with_session(sess: requests.Session, mp4_url: str, out_path: str, r
         "User-Agent": UA,
         "Accept": "*/*",
         "Referer": referer,
-        # Range wymusza 206 i zwykle przyspiesza start odtwarzania/pobierania
-        "Range": "bytes=0-",
     }
 
+    # CDN ogranicza prędkość pojedynczego połączenia - pobieramy kilka zakresów naraz,
+    # do pliku .part, który po przerwaniu da się wznowić
+    connections = min(connections, max_connections)
+    if download_segmented(sess, mp4_url, out_path, headers, connections, max_connections):
+        print(f"Zapisano do: {out_path}", file=sys.stderr)
+        return out_path
+
+    # serwer bez obsługi Range - jedno połączenie, jak dawniej (bez wznawiania)
+    # Range wymusza 206 i zwykle przyspiesza start odtwarzania/pobierania
+    headers["Range"] = "bytes=0-"
     with sess.get(mp4_url, headers=headers, timeout=30, stream=True, allow_redirects=True) as r:
         r.raise_for_status()
 
@@ -106,7 +241,8 @@ def download_with_session(sess: requests.Session, mp4_url: str, out_path: str, r
 
         written = 0
         chunk = 1 << 15  # 32 KiB
-        with open(out_path, "wb") as f:
+        part_path, state_path = part_paths(out_path)
+        with open(part_path, "wb") as f:
             for part in r.iter_content(chunk_size=chunk):
                 if part:
                     f.write(part)
@@ -115,55 +251,60 @@ def download_with_session(sess: requests.Session, mp4_url: str, out_path: str, r
                     if total and written % (1 << 20) < chunk:  # co ~1 MiB
                         pct = written * 100 // total
                         print(f"\rPobrano: {written//1024//1024} MiB / {total//1024//1024} MiB ({pct}%)", end="", file=sys.stderr)
+            os.fsync(f.fileno())
+        if total and written != total:
+            raise requests.ConnectionError(f"Pobrano {written} z {total} bajtów, plik zostaje jako {part_path}")
+        promote(part_path, state_path, out_path)
         if total:
             print(f"\rPobrano: {total//1024//1024} MiB (100%)", file=sys.stderr)
         print(f"Zapisano do: {out_path}", file=sys.stderr)
+    return out_path
 
 def main():
     ap = argparse.ArgumentParser(description="Wyciąga direct-link MP4 i pobiera go w tej samej sesji.")
     ap.add_argument("url", help="np. https://vider.info/vid/+fxnecxs albo https://vider.pl/embed/...")
     ap.add_argument("output_path", help="Ścieżka docelowa pliku lub katalog (gdy katalog, nazwa zostanie wzięta z URL).")
+    ap.add_argument("--connections", type=int, default=4, help="Początkowa liczba równoległych połączeń (domyślnie 4).")
+    ap.add_argument("--max-connections", type=int, default=16,
+                    help="Górny limit połączeń, dokładanych póki przyspieszają pobieranie (domyślnie 16, 1 = jedno połączenie).")
+    ap.add_argument("--link-cache", default=str(DEFAULT_LINK_CACHE_PATH),
+                    help=f"Baza rozwiązanych linków (domyślnie {DEFAULT_LINK_CACHE_PATH}).")
+    ap.add_argument("--link-ttl", type=float, default=DEFAULT_TTL / 3600,
+                    help=f"Ile godzin link z cache jest ważny (domyślnie {DEFAULT_TTL / 3600:g}).")
+    ap.add_argument("--no-link-cache", action="store_true", help="Zawsze rozwiązuj link ze strony.")
     args = ap.parse_args()
 
+    global LINK_CACHE
+    if not args.no_link_cache:
+        LINK_CACHE = LinkCache(Path(args.link_cache), args.link_ttl * 3600)
+
     sess = requests.Session()
 
     try:
-        # 1) pobierz stronę wejściową
-        r1 = get(args.url, session=sess)
-        html1 = r1.text
-
-        # spróbuj wyciągnąć link bezpośrednio
-        mp4 = extract_mp4_from_html(html1)
-        referer_for_mp4 = args.url
-
-        # 2) jeśli nie ma, spróbuj przez stronę osadzającą (embed)
-        if not mp4:
-            embed_url = maybe_find_embed_url(html1)
-            if embed_url:
-                r2 = get(embed_url, referer=args.url, session=sess)
-                html2 = r2.text
-                mp4 = extract_mp4_from_html(html2)
-                if mp4:
-                    referer_for_mp4 = embed_url
-
-        # 3) fallback – przeskanuj wszystkie URL-e w HTML
-        if not mp4:
-            for url in re.findall(r'https?://[^\s"\']+', html1):
-                url_dec = decode_multi(url)
-                m = RE_MP4.search(url_dec)
-                if m:
-                    mp4 = m.group(0)
-                    break
-
-        if not mp4:
-            print("Nie znalazłem linku MP4 w podanej stronie ani w osadzonym embedzie.", file=sys.stderr)
-            sys.exit(2)
-
-        # Wypisz link na stdout (zgodnie z wcześniejszym zachowaniem)
-        print(mp4)
-
-        # Pobieraj w tej samej sesji/cookies
-        download_with_session(sess, mp4, args.output_path, referer=referer_for_mp4)
+        for attempt in (1, 2):
+            mp4, referer_for_mp4, cached = resolve_link(sess, args.url, use_cache=attempt == 1)
+
+            if not mp4:
+                print("Nie znalazłem linku MP4 w podanej stronie ani w osadzonym embedzie.", file=sys.stderr)
+                sys.exit(2)
+
+            # Wypisz link na stdout (zgodnie z wcześniejszym zachowaniem)
+            print(mp4)
+
+            # Pobieraj w tej samej sesji/cookies
+            try:
+                download_with_session(
+                    sess, mp4, args.output_path, referer=referer_for_mp4,
+                    connections=args.connections, max_connections=args.max_connections,
+                )
+            except requests.HTTPError as e:
+                # link z cache wygasł albo wideo zniknęło - dopiero wtedy wracamy do strony
+                if not (cached and is_rejected(e)):
+                    raise
+                print(f"Link z cache odrzucony (HTTP {e.response.status_code}), szukam nowego.", file=sys.stderr)
+                LINK_CACHE.invalidate(args.url)
+                continue
+            break
 
     except requests.HTTPError as e:
         print(f"Błąd HTTP: {e}", file=sys.stderr)
@@ -171,6 +312,9 @@ def main():
     except requests.RequestException as e:
         print(f"Błąd sieci: {e}", file=sys.stderr)
         sys.exit(1)
+    except OSError as e:
+        print(f"Błąd pliku: {e}", file=sys.stderr)
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import contextlib
+import http.cookiejar
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+
+import requests
+
+import vider
+from link_cache import DEFAULT_LINK_CACHE_PATH, DEFAULT_TTL, LinkCache, is_rejected
+from vider import download_with_session, resolve_link
+
+COOKIES_PATH = Path(os.environ.get("VIDER_COOKIES", Path.home() / ".cache" / "arrrrrr" / "vider-cookies.txt"))
+RE_VIDEO_ID = re.compile(r'/video/(\d+)/')
+
+
+@dataclass
+class FetchItem:
+    url: str
+    name: str | None = None  # nazwa pliku wyjściowego, domyślnie <id wideo>.mp4
+
+
+@dataclass
+class FetchResult:
+    item: FetchItem
+    ok: bool
+    duration: float
+    output: str | None = None
+    error: str | None = None
+
+
+class SessionPool:
+    """
+    Sessions sharing one cookie jar, saved to disk between runs.
+
+    Every worker gets its own connection, but cookies set by the site (and the ones from previous
+    runs) are visible to all of them, so the site sees one returning client instead of many new ones.
+    """
+
+    def __init__(self, size: int, cookies_path: Path = COOKIES_PATH) -> None:
+        self.cookies_path = cookies_path
+        self.jar = http.cookiejar.LWPCookieJar(str(cookies_path))
+        with contextlib.suppress(OSError, http.cookiejar.LoadError):
+            self.jar.load(ignore_discard=True)
+        self._pool: queue.Queue[requests.Session] = queue.Queue()
+        for _ in range(size):
+            sess = requests.Session()
+            sess.cookies = self.jar
+            self._pool.put(sess)
+
+    @contextlib.contextmanager
+    def session(self):
+        sess = self._pool.get()
+        try:
+            yield sess
+        finally:
+            self._pool.put(sess)
+
+    def save(self) -> None:
+        self.cookies_path.parent.mkdir(parents=True, exist_ok=True)
+        self.jar.save(ignore_discard=True)
+
+
+class HostLimiter:
+    """Per-host limit of concurrent requests and of request rate (requests per second)."""
+
+    def __init__(self, per_host: int, rate: float | None = None) -> None:
+        self.per_host = per_host
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._semaphores: dict[str, threading.BoundedSemaphore] = {}
+        self._next_slot: dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def hold(self, url: str):
+        host = urllib.parse.urlparse(url).hostname or ""
+        with self._lock:
+            semaphore = self._semaphores.setdefault(host, threading.BoundedSemaphore(self.per_host))
+        with semaphore:
+            with self._lock:
+                now = time.monotonic()
+                slot = max(now, self._next_slot.get(host, now))
+                self._next_slot[host] = slot + self.interval
+            time.sleep(slot - now)
+            yield
+
+
+def read_items(source: str) -> list[FetchItem]:
+    """One `URL [file name]` per line (from file or `-` for stdin); empty lines and `#` comments are skipped."""
+    lines = sys.stdin.read().splitlines() if source == "-" else Path(source).read_text(encoding="utf-8").splitlines()
+    items: list[FetchItem] = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        url, _, name = line.partition(" ")
+        items.append(FetchItem(url, name.strip() or None))
+    return items
+
+
+def output_path(item: FetchItem, mp4_url: str, output_dir: Path) -> Path:
+    if item.name:
+        return output_dir / item.name
+    # każdy plik na CDN nazywa się v.mp4 - rozróżnia je tylko id w ścieżce
+    if (m := RE_VIDEO_ID.search(mp4_url)) is not None:
+        return output_dir / f"{m.group(1)}.mp4"
+    return output_dir / (item.url.rstrip("/").rsplit("/", 1)[-1].lstrip("+") + ".mp4")
+
+
+def resolve(item: FetchItem, sessions: SessionPool, pages: HostLimiter, use_cache: bool = True) -> tuple[str, str, bool]:
+    # z cache bez limitu - strona w ogóle nie jest odpytywana
+    with sessions.session() as sess:
+        mp4, referer, cached = resolve_link(sess, item.url, use_cache, hold=lambda: pages.hold(item.url))
+    if not mp4:
+        raise LookupError("Nie znalazłem linku MP4 w podanej stronie ani w osadzonym embedzie.")
+    return mp4, referer, cached
+
+
+def run_download(
+    item: FetchItem,
+    link: tuple[str, str, bool],
+    since: float,
+    args: argparse.Namespace,
+    sessions: SessionPool,
+    pages: HostLimiter,
+    streams: HostLimiter,
+) -> FetchResult:
+    mp4, referer, cached = link
+    try:
+        while True:
+            out = output_path(item, mp4, Path(args.output_dir))
+            try:
+                with streams.hold(mp4), sessions.session() as sess:
+                    output = download_with_session(
+                        sess, mp4, str(out), referer=referer,
+                        connections=args.connections, max_connections=args.max_connections,
+                    )
+                break
+            except requests.HTTPError as e:
+                # link z cache odrzucony - jedna próba z linkiem świeżo wyciągniętym ze strony
+                if not (cached and is_rejected(e)):
+                    raise
+                print(f"Cached link for {item.url} rejected (HTTP {e.response.status_code}), resolving again")
+                vider.LINK_CACHE.invalidate(item.url)
+                mp4, referer, cached = resolve(item, sessions, pages, use_cache=False)
+    except (requests.RequestException, LookupError, OSError) as e:
+        return FetchResult(item, ok=False, duration=time.monotonic() - since, error=str(e))
+    return FetchResult(item, ok=True, duration=time.monotonic() - since, output=output)
+
+
+def print_summary(results: list[FetchResult], wall_time: float) -> None:
+    print()
+    print("Batch summary:")
+    for r in results:
+        status = "OK  " if r.ok else "FAIL"
+        line = f"  [{status}] {r.item.url} ({r.duration:.1f}s)"
+        if r.output:
+            line += f" -> {r.output}"
+        if r.error:
+            line += f": {r.error}"
+        print(line)
+    failed = sum(not r.ok for r in results)
+    print(f"{len(results) - failed}/{len(results)} downloads succeeded in {wall_time:.1f}s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Fetch many vider videos: resolve links concurrently while earlier videos download."
+    )
+    parser.add_argument("source", help="File with one `URL [file name]` per line, or `-` for stdin")
+    parser.add_argument("output_dir", help="Output folder")
+    parser.add_argument(
+        "--resolvers", type=int, default=2, help="Pages resolved at once (default: 2)"
+    )
+    parser.add_argument(
+        "--downloads", type=int, default=2, help="Videos downloaded at once (default: 2)"
+    )
+    parser.add_argument(
+        "--per-host", type=int, default=2, help="Maximum concurrent page requests and downloads per host (default: 2)"
+    )
+    parser.add_argument(
+        "--rate", type=float, default=0.5,
+        help="Page requests per second per host, keeps crawling below ban threshold (default: 0.5)"
+    )
+    parser.add_argument(
+        "--connections", type=int, default=4, help="Initial connections per download (default: 4)"
+    )
+    parser.add_argument(
+        "--max-connections", type=int, default=8, help="Maximum connections per download (default: 8)"
+    )
+    parser.add_argument(
+        "--cookies", type=str, default=str(COOKIES_PATH), help=f"Cookie jar kept between runs (default: {COOKIES_PATH})"
+    )
+    parser.add_argument(
+        "--link-cache", type=str, default=str(DEFAULT_LINK_CACHE_PATH),
+        help=f"Cache of resolved links (default: {DEFAULT_LINK_CACHE_PATH})"
+    )
+    parser.add_argument(
+        "--link-ttl", type=float, default=DEFAULT_TTL / 3600,
+        help=f"Hours a cached link is trusted (default: {DEFAULT_TTL / 3600:g})"
+    )
+    parser.add_argument("--no-link-cache", action="store_true", help="Always resolve links from pages")
+    args = parser.parse_args()
+    if not args.no_link_cache:
+        vider.LINK_CACHE = LinkCache(Path(args.link_cache), args.link_ttl * 3600)
+
+    items = read_items(args.source)
+    if not items:
+        print("No URLs to fetch.")
+        return
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    sessions = SessionPool(args.resolvers + args.downloads, Path(args.cookies))
+    pages = HostLimiter(args.per_host, args.rate)
+    streams = HostLimiter(args.per_host)
+    start = time.monotonic()
+    downloads: list[Future] = []
+    results: list[FetchResult] = []
+
+    # strony rozwiązujemy w osobnej puli - link do kolejnego wideo jest gotowy, zanim skończy się bieżące pobieranie
+    with ThreadPoolExecutor(max_workers=args.resolvers) as resolvers, \
+            ThreadPoolExecutor(max_workers=args.downloads) as downloaders:
+        resolving = {resolvers.submit(resolve, item, sessions, pages): (item, time.monotonic()) for item in items}
+        for future in as_completed(resolving):
+            item, since = resolving[future]
+            try:
+                link = future.result()
+            except (requests.RequestException, LookupError) as e:
+                results.append(FetchResult(item, ok=False, duration=time.monotonic() - since, error=str(e)))
+                continue
+            print(f"Resolved {item.url} -> {link[0]}" + (" (cached)" if link[2] else ""))
+            downloads.append(downloaders.submit(run_download, item, link, since, args, sessions, pages, streams))
+
+        results.extend(future.result() for future in downloads)
+
+    sessions.save()
+    order = {item.url: i for i, item in enumerate(items)}
+    results.sort(key=lambda r: order[r.item.url])
+    print_summary(results, time.monotonic() - start)
+    if not all(r.ok for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
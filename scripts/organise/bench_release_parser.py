@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+
+from organise_by_filename import EpisodeInfo, MovieInfo
+from release_parser import parse_episode_name, parse_movie_name
+
+CORPUS = Path(__file__).with_name("release_corpus.tsv")
+
+TITLES = [
+    "Breaking Bad", "The Office", "Ranczo", "Ojciec Mateusz", "Dark", "The Wire", "Wiedzmin", "Rojst",
+    "Attack on Titan", "One Piece", "Blade Runner", "Dune Part Two", "Seksmisja", "Kiler", "Heat",
+    "Interstellar", "The Matrix", "Boze Cialo", "Psy", "Rejs", "Full Metal Jacket", "1917",
+]
+QUALITY = ["720p", "1080p", "2160p"]
+SOURCE = ["WEB-DL", "BluRay", "HDTV", "NF.WEB-DL", "AMZN.WEB-DL", "DVDRip"]
+EXTRA = ["", "PL", "MULTI", "REMASTERED", "PL.DUB", "Lektor.PL"]
+CODEC = ["x264", "x265", "H.264", "HEVC", "DDP5.1.H.264"]
+GROUP = ["PTTrG", "ROVERS", "NTb", "FLUX", "KiNGS", "SPARKS"]
+EPISODE_FORMATS = [
+    "{dots}.S{s:02d}E{e:02d}.{extra}.{q}.{src}.{codec}-{grp}.mkv",
+    "{title} S{s:02d}E{e:02d} {q}.mkv",
+    "{dots}.{year}.S{s:02d}E{e:02d}.{q}.{src}.mkv",
+    "{dots}.s{s:02d}e{e:02d}.{q}.{codec}.mp4",
+    "{title} - S{s:02d} E{e:02d} - {q}.mkv",
+]
+MOVIE_FORMATS = [
+    "{dots}.{year}.{extra}.{q}.{src}.{codec}-{grp}.mkv",
+    "{title} ({year}) [{q}].mkv",
+    "{dots}.{year}.{q}.{src}.mkv",
+]
+
+
+def load_corpus(path: Path) -> list[tuple[str, str, str]]:
+    entries = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if line and not line.startswith("#"):
+            kind, file_path, expected = line.split("\t")
+            entries.append((kind, file_path, expected))
+    return entries
+
+
+def synthetic_corpus(count: int, seed: int = 0) -> list[tuple[str, str, str]]:
+    """
+    Generate release names from templates (deterministic for given seed).
+
+    Only a throughput workload: names follow the same few patterns the parser was written for,
+    so hit rate on them says nothing about real releases.
+    """
+    rng = random.Random(seed)
+    entries = []
+    for i in range(count):
+        title = rng.choice(TITLES)
+        fields = dict(
+            title=title, dots=title.replace(" ", "."), year=rng.randint(1950, 2025),
+            s=rng.randint(1, 30), e=rng.randint(1, 150), q=rng.choice(QUALITY), src=rng.choice(SOURCE),
+            extra=rng.choice(EXTRA) or "PL", codec=rng.choice(CODEC), grp=rng.choice(GROUP),
+        )
+        if i % 2:
+            name = rng.choice(EPISODE_FORMATS).format(**fields)
+            path = f"/downloads/complete/Seriale/{fields['dots']}.S{fields['s']:02d}/{name}"
+            entries.append(("episode", path, f"{title}|{fields['s']}|{fields['e']:02d}"))
+        else:
+            name = rng.choice(MOVIE_FORMATS).format(**fields)
+            path = f"/downloads/complete/Filmy/{fields['dots']}.{fields['year']}/{name}"
+            entries.append(("movie", path, f"{title}|{fields['year']}"))
+    return entries
+
+
+def parse(kind: str, path: str) -> str:
+    """Parse like organise_by_filename does (including name normalisation) and format as corpus value."""
+    if kind == "episode":
+        if (episode := parse_episode_name(path)) is None:
+            return "-"
+        info = EpisodeInfo(episode.episode_num, episode.season_num, episode.series_name, Path(path), "")
+        return f"{info.series_name}|{info.season_num}|{info.episode_num}"
+    if (movie := parse_movie_name(path)) is None:
+        return "-"
+    info = MovieInfo(movie.name, movie.year, Path(path), Path(path), "")
+    return f"{info.name}|{info.year}"
+
+
+def accuracy(entries: list[tuple[str, str, str]], verbose: bool) -> dict[str, float]:
+    result: dict[str, float] = {}
+    for kind in ("episode", "movie"):
+        subset = [e for e in entries if e[0] == kind]
+        hits = 0
+        for _, path, expected in subset:
+            if (got := parse(kind, path)) == expected:
+                hits += 1
+            elif verbose:
+                print(f"  MISS {kind}: {path}\n       expected `{expected}`, got `{got}`")
+        result[kind] = hits / len(subset) * 100 if subset else 0.0
+    return result
+
+
+def throughput(entries: list[tuple[str, str, str]], rounds: int) -> dict[str, float]:
+    """Parses per second without memoization (cold) and with it (warm)."""
+    def run() -> float:
+        start = time.perf_counter()
+        for kind, path, _ in entries:
+            (parse_episode_name if kind == "episode" else parse_movie_name)(path)
+        return len(entries) / (time.perf_counter() - start)
+
+    cold = []
+    for _ in range(rounds):
+        parse_episode_name.cache_clear()
+        parse_movie_name.cache_clear()
+        cold.append(run())
+    warm = run()
+    return {"cold_parses_per_sec": max(cold), "warm_parses_per_sec": warm}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark and regression check of release name parsing.")
+    parser.add_argument("--corpus", default=str(CORPUS), help=f"Corpus TSV (default: {CORPUS.name})")
+    parser.add_argument(
+        "--synthetic", type=int, default=5000, help="Generated names added to the throughput workload (default: 5000)"
+    )
+    parser.add_argument("--rounds", type=int, default=5, help="Benchmark rounds (default: 5)")
+    parser.add_argument("--verbose", action="store_true", help="Print every miss from the corpus file")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    corpus = load_corpus(Path(args.corpus))
+    synthetic = synthetic_corpus(args.synthetic)
+    results = {
+        "corpus_size": len(corpus),
+        "corpus_accuracy": accuracy(corpus, args.verbose),
+        "synthetic_size": len(synthetic),
+        **throughput(corpus + synthetic, args.rounds),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"Corpus ({results['corpus_size']} names): "
+          + ", ".join(f"{k} {v:.1f}%" for k, v in results["corpus_accuracy"].items()))
+    print(f"Throughput ({results['corpus_size'] + results['synthetic_size']} names, "
+          f"{results['synthetic_size']} generated): {results['cold_parses_per_sec']:.0f} parses/s cold, "
+          f"{results['warm_parses_per_sec']:.0f} parses/s memoized")
+
+
+if __name__ == "__main__":
+    main()
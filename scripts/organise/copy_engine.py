@@ -0,0 +1,317 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import stat
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+CHUNK_SIZE = 8 * 1024 * 1024              # wyrównane do stron i bloków dysku
+JOURNAL_INTERVAL = 256 * 1024 * 1024      # co ile bajtów utrwalamy postęp
+PRESSURE_FILE = Path("/proc/pressure/io")
+PRESSURE_HIGH = 40.0                      # % czasu, gdy zadania czekają na I/O (avg10)
+PRESSURE_LOW = 10.0
+
+
+@dataclass
+class CopyItem:
+    src: Path
+    dest: Path
+    size: int
+    link: str | None = None  # cel dowiązania - kopiujemy sam link, nie plik, na który wskazuje
+    hardlink: Path | None = None  # kolejna nazwa tego samego i-węzła - link do już skopiowanego `dest`
+
+
+class Journal:
+    """
+    Per-torrent copy journal (JSON next to destination).
+
+    Stores number of bytes durably written for every destination file, so interrupted copy
+    continues from the last fsync'ed offset.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self.done: dict[str, int] = {}
+        if path.exists():
+            with contextlib.suppress(ValueError):
+                self.done = json.loads(path.read_text(encoding="utf-8"))
+
+    def offset(self, item: CopyItem) -> int:
+        offset = self.done.get(str(item.dest), 0)
+        # plik docelowy krótszy niż w dzienniku - nie ufamy, zaczynamy od nowa
+        if not item.dest.exists() or item.dest.stat().st_size < offset:
+            return 0
+        return offset
+
+    def update(self, item: CopyItem, offset: int) -> None:
+        with self._lock:
+            self.done[str(item.dest)] = offset
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            tmp.write_text(json.dumps(self.done), encoding="utf-8")
+            os.replace(tmp, self.path)
+
+    def remove(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+class Throttle:
+    """
+    Bandwidth limiter driven by I/O pressure (PSI) instead of a fixed cap.
+
+    Rate is halved when `some avg10` of /proc/pressure/io is above PRESSURE_HIGH and grows
+    by 10% when below PRESSURE_LOW. Without PSI only the static `max_rate` applies.
+    """
+
+    def __init__(self, max_rate: float | None, min_rate: float = 5e6) -> None:
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate = max_rate
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        self._allowance_at = time.monotonic()
+
+    @staticmethod
+    def pressure() -> float | None:
+        try:
+            line = PRESSURE_FILE.read_text().splitlines()[0]
+        except (OSError, IndexError):
+            return None
+        fields = dict(part.split("=") for part in line.split()[1:])
+        return float(fields["avg10"])
+
+    def _adjust(self, now: float, observed_rate: float) -> None:
+        if now < self._next_check:
+            return
+        # przed odczytem - bez PSI nie otwieramy pliku przy każdym kawałku
+        self._next_check = now + 2.0
+        if (pressure := self.pressure()) is None:
+            return
+        current = self.rate or observed_rate
+        if pressure > PRESSURE_HIGH:
+            self.rate = max(self.min_rate, current / 2)
+            print(f"I/O pressure {pressure:.0f}%, limiting to {self.rate / 1e6:.0f} MB/s", file=sys.stderr)
+        elif pressure < PRESSURE_LOW and self.rate is not None:
+            self.rate = current * 1.1
+            if self.max_rate is None and self.rate > observed_rate * 2:
+                self.rate = None  # bez limitu, dopóki dysk nie zacznie się dławić
+            elif self.max_rate is not None:
+                self.rate = min(self.rate, self.max_rate)
+
+    def consume(self, nbytes: int, observed_rate: float) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._adjust(now, observed_rate)
+            if self.rate is None:
+                return
+            self._allowance_at = max(self._allowance_at, now) + nbytes / self.rate
+            delay = self._allowance_at - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def fadvise(fd: int, offset: int, length: int, advice: int) -> None:
+    if hasattr(os, "posix_fadvise"):
+        with contextlib.suppress(OSError):
+            os.posix_fadvise(fd, offset, length, advice)
+
+
+def transfer(src_fd: int, dest_fd: int, offset: int, count: int) -> int:
+    """Zero-copy transfer of up to `count` bytes at `offset`, with fallbacks."""
+    if hasattr(os, "copy_file_range"):
+        with contextlib.suppress(OSError):
+            return os.copy_file_range(src_fd, dest_fd, count, offset, offset)
+    os.lseek(dest_fd, offset, os.SEEK_SET)
+    with contextlib.suppress(OSError):
+        return os.sendfile(dest_fd, src_fd, offset, count)
+    return os.pwrite(dest_fd, os.pread(src_fd, count, offset), offset)
+
+
+def copy_owner(src: Path, dest: Path, follow_symlinks: bool = True) -> None:
+    """Copy owner and group like `rsync -a`: only possible as root, silently skipped otherwise."""
+    st = os.stat(src, follow_symlinks=follow_symlinks)
+    with contextlib.suppress(PermissionError):
+        os.chown(dest, st.st_uid, st.st_gid, follow_symlinks=follow_symlinks)
+
+
+def copy_link(item: CopyItem) -> int:
+    """Recreate symlink `item.src` at `item.dest` with the same (unresolved) target, like `cp -a`."""
+    with contextlib.suppress(OSError):
+        if os.readlink(item.dest) == item.link:
+            return 0
+    item.dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = item.dest.with_name(f".{item.dest.name}.link-tmp")
+    tmp.unlink(missing_ok=True)
+    os.symlink(item.link, tmp)
+    os.replace(tmp, item.dest)
+    copy_owner(item.src, item.dest, follow_symlinks=False)
+    shutil.copystat(item.src, item.dest, follow_symlinks=False)
+    return 0
+
+
+def copy_hardlink(item: CopyItem) -> None:
+    """Link `item.dest` to the already copied first name of the same source inode, like `rsync -H`."""
+    with contextlib.suppress(OSError):
+        if item.dest.samefile(item.hardlink):
+            return
+    item.dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = item.dest.with_name(f".{item.dest.name}.link-tmp")
+    tmp.unlink(missing_ok=True)
+    os.link(item.hardlink, tmp)
+    os.replace(tmp, item.dest)
+
+
+def copy_file(item: CopyItem, journal: Journal, throttle: Throttle) -> int:
+    if item.link is not None:
+        return copy_link(item)
+    offset = journal.offset(item)
+    if offset == item.size and item.dest.exists():
+        return 0
+    if offset == 0 and item.dest.exists():
+        # skopiowany wcześniej (np. przez rsync) - ta sama szybka kontrola co w rsync
+        src_st, dest_st = item.src.stat(), item.dest.stat()
+        if src_st.st_size == dest_st.st_size and src_st.st_mtime_ns == dest_st.st_mtime_ns:
+            return 0
+
+    item.dest.parent.mkdir(parents=True, exist_ok=True)
+    start, copied, last_sync = time.monotonic(), 0, offset
+    src_fd = os.open(item.src, os.O_RDONLY)
+    dest_fd = os.open(item.dest, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        fadvise(src_fd, 0, 0, getattr(os, "POSIX_FADV_SEQUENTIAL", 2))
+        if offset == 0 and item.size and hasattr(os, "posix_fallocate"):
+            with contextlib.suppress(OSError):
+                os.posix_fallocate(dest_fd, 0, item.size)
+        while offset < item.size:
+            sent = transfer(src_fd, dest_fd, offset, min(CHUNK_SIZE, item.size - offset))
+            if sent == 0:
+                raise OSError(f"Unexpected end of file: {item.src}")
+            # nie zaśmiecaj page cache danymi, których nikt zaraz nie przeczyta
+            fadvise(src_fd, offset, sent, getattr(os, "POSIX_FADV_DONTNEED", 4))
+            offset += sent
+            copied += sent
+            if offset - last_sync >= JOURNAL_INTERVAL:
+                os.fdatasync(dest_fd)
+                fadvise(dest_fd, last_sync, offset - last_sync, getattr(os, "POSIX_FADV_DONTNEED", 4))
+                journal.update(item, offset)
+                last_sync = offset
+            throttle.consume(sent, copied / max(time.monotonic() - start, 1e-3))
+        os.ftruncate(dest_fd, item.size)
+        os.fsync(dest_fd)
+    finally:
+        os.close(src_fd)
+        os.close(dest_fd)
+    copy_owner(item.src, item.dest)
+    # copystat kopiuje też xattr, a z nimi ACL (system.posix_acl_*), jak rsync -AX
+    shutil.copystat(item.src, item.dest)
+    journal.update(item, item.size)
+    return copied
+
+
+def plan_item(path: Path, dest: Path, inodes: dict[tuple[int, int], Path]) -> CopyItem:
+    st = path.lstat()
+    if stat.S_ISLNK(st.st_mode):
+        return CopyItem(path, dest, 0, os.readlink(path))
+    if st.st_nlink > 1:
+        key = (st.st_dev, st.st_ino)
+        if key in inodes:
+            return CopyItem(path, dest, 0, hardlink=inodes[key])
+        inodes[key] = dest
+    return CopyItem(path, dest, st.st_size)
+
+
+def plan(src: Path, dest: Path) -> tuple[list[CopyItem], list[tuple[Path, Path]]]:
+    """Files and symlinks to copy, and (src, dest) pairs of all directories, empty ones included (like `cp -a`)."""
+    inodes: dict[tuple[int, int], Path] = {}
+    if not src.is_dir():
+        return [plan_item(src, dest, inodes)], []
+    items: list[CopyItem] = []
+    dirs = [(src, dest)]
+    for root, subdirs, files in os.walk(src):
+        for name in subdirs:
+            path = Path(root) / name
+            # os.walk nie wchodzi w linki do katalogów, ale zwraca je razem z katalogami
+            if path.is_symlink():
+                items.append(plan_item(path, dest / path.relative_to(src), inodes))
+            else:
+                dirs.append((path, dest / path.relative_to(src)))
+        for name in files:
+            path = Path(root) / name
+            items.append(plan_item(path, dest / path.relative_to(src), inodes))
+    return items, dirs
+
+
+def remove_sources(src: Path, items: list[CopyItem]) -> None:
+    for item in items:
+        item.src.unlink()
+    if src.is_dir():
+        for root, _, _ in sorted(os.walk(src), key=lambda entry: len(entry[0]), reverse=True):
+            with contextlib.suppress(OSError):
+                os.rmdir(root)
+
+
+def copy_tree(
+    src: Path, dest: Path, *, workers: int = 2, max_rate: float | None = None, remove_source: bool = True
+) -> int:
+    """Copy file or directory `src` into `dest` (contents, like `rsync src/ dest`), resumable."""
+    items, dirs = plan(src, dest)
+    journal = Journal(dest.parent / f".{dest.name}.copy-journal")
+    throttle = Throttle(max_rate)
+    total = sum(item.size for item in items)
+    start = time.monotonic()
+
+    for _, dest_dir in dirs:
+        dest_dir.mkdir(parents=True, exist_ok=True)
+    hardlinks = [item for item in items if item.hardlink is not None]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # największe pliki najpierw - krótszy ogon na końcu
+        copied = sum(pool.map(lambda item: copy_file(item, journal, throttle),
+                              sorted((item for item in items if item.hardlink is None),
+                                     key=lambda item: item.size, reverse=True)))
+    # dopiero gdy pierwsza nazwa i-węzła jest skopiowana
+    for item in hardlinks:
+        copy_hardlink(item)
+    # czasy katalogów na końcu - tworzenie plików w środku je zmienia
+    for src_dir, dest_dir in dirs:
+        copy_owner(src_dir, dest_dir)
+        shutil.copystat(src_dir, dest_dir)
+    if remove_source:
+        remove_sources(src, items)
+    journal.remove()
+
+    elapsed = max(time.monotonic() - start, 1e-6)
+    print(f"Copied {copied / 1e6:.0f} MB ({total / 1e6:.0f} MB total, {len(items)} files) "
+          f"in {elapsed:.1f}s, {copied / elapsed / 1e6:.1f} MB/s")
+    return copied
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Parallel, resumable copy of finished torrent data (zero-copy, I/O pressure aware)."
+    )
+    parser.add_argument("src", help="Source file or directory")
+    parser.add_argument("dest", help="Destination file or directory (directory contents are copied into it)")
+    parser.add_argument("--workers", type=int, default=2, help="Files copied at once (default: 2)")
+    parser.add_argument("--max-rate", type=float, help="Upper bandwidth limit in MB/s (default: none)")
+    parser.add_argument("--keep-source", action="store_true", help="Do not remove source files after copy")
+    args = parser.parse_args()
+
+    copy_tree(
+        Path(args.src.rstrip("/")),
+        Path(args.dest),
+        workers=args.workers,
+        max_rate=args.max_rate * 1e6 if args.max_rate else None,
+        remove_source=not args.keep_source,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import select
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterator
+
+SOCKET_PATH = Path(os.environ.get("RT_IO_SOCKET", "/tmp/arrrrrr-io.sock"))
+# mniejsza liczba = wcześniej w kolejce; drobne operacje na metadanych nie czekają za kopiowaniem
+PRIORITIES = {"meta": 0, "hash": 1, "remux": 2, "copy": 3}
+META_LANES = 1  # dodatkowe miejsca na urządzeniu tylko dla "meta", żeby linki nie czekały na koniec kopiowania
+
+
+def existing_parent(path: Path) -> Path:
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return path
+
+
+def device_of(path: Path) -> str:
+    """
+    Name of the disk holding `path` (e.g. `sda`), partitions of one disk share it.
+
+    Filesystems without a block device in sysfs (btrfs subvolumes, overlay, NFS) are keyed by `major:minor`.
+    """
+    st_dev = existing_parent(path).stat().st_dev
+    major, minor = os.major(st_dev), os.minor(st_dev)
+    try:
+        device = Path(f"/sys/dev/block/{major}:{minor}").resolve(strict=True)
+    except OSError:
+        return f"{major}:{minor}"
+    # partycja - głowica jest jedna na cały dysk
+    if (device / "partition").exists():
+        device = device.parent
+    return device.name
+
+
+@dataclass
+class Ticket:
+    seq: int
+    kind: str
+    label: str
+    devices: tuple[str, ...]
+    queued_at: float = field(default_factory=time.monotonic)
+    admitted_at: float | None = None
+
+    @property
+    def order(self) -> tuple[int, int]:
+        return PRIORITIES[self.kind], self.seq
+
+    @property
+    def waited(self) -> float:
+        return (self.admitted_at or time.monotonic()) - self.queued_at
+
+
+@dataclass
+class KindStats:
+    admitted: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+
+class Scheduler:
+    """
+    Admits at most `per_device` heavy I/O jobs per disk, the rest wait in priority order.
+
+    A job touching several disks (copy between them) needs a free slot on all of them at once.
+    A waiting job blocks its disks for jobs behind it in the queue, so big copies are not starved
+    by a stream of later, smaller ones. "meta" jobs may use `META_LANES` extra slots.
+    """
+
+    def __init__(self, per_device: int = 1, limits: dict[str, int] | None = None) -> None:
+        self.per_device = per_device
+        self.limits = limits or {}
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self.waiting: list[Ticket] = []
+        self.running: list[Ticket] = []
+        self.stats: dict[str, KindStats] = {kind: KindStats() for kind in PRIORITIES}
+
+    def limit(self, device: str, kind: str) -> int:
+        limit = self.limits.get(device, self.per_device)
+        return limit + META_LANES if kind == "meta" else limit
+
+    def _admit_ready(self) -> None:
+        blocked: set[str] = set()
+        for ticket in sorted(self.waiting, key=lambda t: t.order):
+            if blocked.intersection(ticket.devices):
+                continue
+            if all(sum(d in t.devices for t in self.running) < self.limit(d, ticket.kind) for d in ticket.devices):
+                ticket.admitted_at = time.monotonic()
+                self.waiting.remove(ticket)
+                self.running.append(ticket)
+                stats = self.stats[ticket.kind]
+                stats.admitted += 1
+                stats.total_wait += ticket.waited
+                stats.max_wait = max(stats.max_wait, ticket.waited)
+            else:
+                blocked.update(ticket.devices)
+        self._cond.notify_all()
+
+    def acquire(self, kind: str, label: str, devices: list[str], alive: Callable[[], bool]) -> Ticket | None:
+        """Wait for a slot; returns None when the client went away while queued."""
+        with self._cond:
+            ticket = Ticket(next(self._seq), kind, label, tuple(sorted(set(devices))))
+            self.waiting.append(ticket)
+            self._admit_ready()
+            while ticket.admitted_at is None:
+                self._cond.wait(1.0)
+                if ticket.admitted_at is None and not alive():
+                    self.waiting.remove(ticket)
+                    self._admit_ready()
+                    return None
+            return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        with self._cond:
+            self.running.remove(ticket)
+            self._admit_ready()
+
+    def status(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            devices = sorted({d for t in self.running + self.waiting for d in t.devices})
+
+            def describe(t: Ticket, since: float) -> dict:
+                return {"kind": t.kind, "label": t.label, "devices": list(t.devices), "seconds": round(now - since, 1)}
+
+            return {
+                "devices": {
+                    d: {
+                        "limit": self.limits.get(d, self.per_device),
+                        "running": [describe(t, t.admitted_at) for t in self.running if d in t.devices],
+                        "queued": [describe(t, t.queued_at) for t in sorted(self.waiting, key=lambda t: t.order)
+                                   if d in t.devices],
+                    }
+                    for d in devices
+                },
+                "queue_depth": len(self.waiting),
+                "stats": {
+                    kind: {
+                        "admitted": s.admitted,
+                        "avg_wait": round(s.total_wait / s.admitted, 2) if s.admitted else 0.0,
+                        "max_wait": round(s.max_wait, 2),
+                    }
+                    for kind, s in self.stats.items()
+                },
+            }
+
+
+def peer_alive(sock: socket.socket) -> bool:
+    readable, _, _ = select.select([sock], [], [], 0)
+    if not readable:
+        return True
+    try:
+        return sock.recv(1, socket.MSG_PEEK) != b""
+    except OSError:
+        return False
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """
+    One JSON line per connection: `{"op": "acquire", ...}` or `{"op": "status"}`.
+
+    An admitted slot is held until the client closes the connection, so a crashed client
+    never keeps a disk reserved.
+    """
+
+    server: "SchedulerServer"
+
+    def reply(self, message: dict) -> None:
+        self.wfile.write(json.dumps(message).encode() + b"\n")
+        self.wfile.flush()
+
+    def handle(self) -> None:
+        try:
+            request = json.loads(self.rfile.readline() or b"null")
+        except ValueError:
+            request = None
+        if not isinstance(request, dict):
+            return
+        scheduler = self.server.scheduler
+        if request.get("op") == "status":
+            self.reply(scheduler.status())
+            return
+        if request.get("op") != "acquire" or request.get("kind") not in PRIORITIES or not request.get("devices"):
+            self.reply({"error": f"invalid request: {request}"})
+            return
+        ticket = scheduler.acquire(
+            request["kind"], str(request.get("label", "")), list(request["devices"]), lambda: peer_alive(self.connection)
+        )
+        if ticket is None:
+            return
+        try:
+            self.reply({"granted": True, "waited": round(ticket.waited, 2)})
+            # czekamy, aż klient skończy (zamknie połączenie)
+            self.rfile.readline()
+        except OSError:
+            pass
+        finally:
+            scheduler.release(ticket)
+
+
+class SchedulerServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: Path, scheduler: Scheduler) -> None:
+        self.scheduler = scheduler
+        with contextlib.suppress(FileNotFoundError):
+            path.unlink()
+        super().__init__(str(path), Handler)
+        os.chmod(path, 0o666)
+
+
+def request(message: dict, socket_path: Path = SOCKET_PATH) -> tuple[socket.socket, dict] | None:
+    """Send `message`, return open connection and the reply (None when scheduler is not running)."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(socket_path))
+    except OSError:
+        sock.close()
+        return None
+    sock.sendall(json.dumps(message).encode() + b"\n")
+    reply = sock.makefile("rb").readline()
+    if not reply:
+        sock.close()
+        return None
+    return sock, json.loads(reply)
+
+
+@contextlib.contextmanager
+def admitted(
+    paths: list[Path], kind: str, label: str = "", socket_path: Path = SOCKET_PATH
+) -> Iterator[dict | None]:
+    """
+    Hold an I/O slot on every disk of `paths` for the duration of the block.
+
+    Yields the grant (with `waited` seconds), or None when the scheduler is not running -
+    the work then starts right away, as without it.
+    """
+    devices = sorted({device_of(Path(p)) for p in paths})
+    response = request({"op": "acquire", "kind": kind, "label": label, "devices": devices}, socket_path)
+    if response is None:
+        yield None
+        return
+    sock, grant = response
+    with sock:
+        if "error" in grant:
+            raise ValueError(grant["error"])
+        if grant["waited"] >= 1:
+            print(f"I/O slot for {kind} {label} on {', '.join(devices)} after {grant['waited']:.1f}s", file=sys.stderr)
+        yield grant
+
+
+def print_status(status: dict) -> None:
+    print(f"Queue depth: {status['queue_depth']}")
+    for device, info in status["devices"].items():
+        print(f"{device} (limit {info['limit']}):")
+        for state in ("running", "queued"):
+            for job in info[state]:
+                print(f"  {state:<8} {job['kind']:<6} {job['label']} ({job['seconds']:.0f}s)")
+    print("Waits:")
+    for kind, s in status["stats"].items():
+        print(f"  {kind:<6} admitted {s['admitted']}, avg {s['avg_wait']:.1f}s, max {s['max_wait']:.1f}s")
+
+
+def parse_limits(values: list[str]) -> dict[str, int]:
+    limits = {}
+    for value in values:
+        device, _, count = value.partition("=")
+        if not count.isdigit():
+            raise argparse.ArgumentTypeError(f"Invalid limit '{value}', expected DEVICE=N")
+        limits[device] = int(count)
+    return limits
+
+
+def main() -> None:
+    # run <kind> <ścieżka>... -- <polecenie>: polecenie po "--" nie przechodzi przez argparse
+    argv = sys.argv[1:]
+    command = argv[argv.index("--") + 1:] if "--" in argv else []
+    argv = argv[:argv.index("--")] if "--" in argv else argv
+
+    parser = argparse.ArgumentParser(description="Per-disk admission of heavy I/O jobs (copy, rehash, remux).")
+    parser.add_argument("--socket", default=str(SOCKET_PATH), help=f"Scheduler socket (default: {SOCKET_PATH})")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="Run the scheduler")
+    serve.add_argument("--per-device", type=int, default=1, help="Heavy jobs at once per disk (default: 1)")
+    serve.add_argument(
+        "--limit", action="append", default=[], help="Different limit for one disk, e.g. nvme0n1=4 (can be repeated)"
+    )
+    status = sub.add_parser("status", help="Show running and queued jobs and wait times")
+    status.add_argument("--json", action="store_true", help="Print status as JSON")
+    run = sub.add_parser("run", help="Run command after admission: run KIND PATH... -- COMMAND")
+    run.add_argument("kind", choices=list(PRIORITIES))
+    run.add_argument("paths", nargs="+", help="Paths the command reads or writes")
+    run.add_argument("--label", default="", help="Name shown in status")
+    devices = sub.add_parser("devices", help="Show which disk each path belongs to")
+    devices.add_argument("paths", nargs="+")
+    args = parser.parse_args(argv)
+    socket_path = Path(args.socket)
+
+    if args.command == "serve":
+        sys.stdout.reconfigure(line_buffering=True)
+        scheduler = Scheduler(args.per_device, parse_limits(args.limit))
+        with SchedulerServer(socket_path, scheduler) as server:
+            print(f"I/O scheduler listening on {socket_path} ({args.per_device} per disk)")
+            with contextlib.suppress(KeyboardInterrupt):
+                server.serve_forever()
+    elif args.command == "status":
+        if (response := request({"op": "status"}, socket_path)) is None:
+            print(f"Scheduler is not running ({socket_path})")
+            sys.exit(1)
+        sock, state = response
+        sock.close()
+        if args.json:
+            print(json.dumps(state, indent=2))
+        else:
+            print_status(state)
+    elif args.command == "run":
+        if not command:
+            parser.error("run needs a command after --")
+        with admitted([Path(p) for p in args.paths], args.kind, args.label or Path(command[0]).name, socket_path):
+            sys.exit(subprocess.run(command).returncode)
+    elif args.command == "devices":
+        for path in args.paths:
+            print(f"{path}\t{device_of(Path(path))}")
+
+
+if __name__ == "__main__":
+    main()
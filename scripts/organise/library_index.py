@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import argparse
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+INDEX_PATH = Path(os.environ.get("RT_LIBRARY_INDEX", "/media/.library.sqlite"))
+
+
+@dataclass(frozen=True)
+class LinkEntry:
+    host_path: Path
+    media_link: Path
+    torrent_hash: str | None
+    mtime_ns: int
+    category: str
+
+
+class LibraryIndex:
+    """
+    Persistent map of torrent files (host_path) to links created for Jellyfin.
+
+    Lets organiser skip files that are already linked, answer which links belong to a torrent
+    and find dangling links without walking /media.
+    """
+
+    def __init__(self, db_path: Path = INDEX_PATH, read_only: bool = False) -> None:
+        """With `read_only` (dry runs) nothing is written: a missing index is replaced by an empty one in memory."""
+        self.db_path = db_path
+        if read_only and db_path.exists():
+            # bez otwartego -wal nic nie czeka na checkpoint - immutable nie tworzy -wal/-shm obok bazy
+            wal_open = db_path.with_name(db_path.name + "-wal").exists()
+            uri = f"{db_path.resolve().as_uri()}?mode=ro" + ("" if wal_open else "&immutable=1")
+            self.db = sqlite3.connect(uri, uri=True, timeout=30, check_same_thread=False)
+            return
+        # brak indeksu w dry run - pusty w pamięci, plan jak przy pierwszym uruchomieniu
+        self.db = sqlite3.connect(":memory:" if read_only else db_path, timeout=30, check_same_thread=False)
+        if not read_only:
+            self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS links ("
+            " host_path TEXT PRIMARY KEY,"
+            " media_link TEXT NOT NULL,"
+            " torrent_hash TEXT,"
+            " mtime_ns INTEGER NOT NULL,"
+            " category TEXT NOT NULL,"
+            " linked_at REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS links_hash ON links(torrent_hash)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS links_media ON links(media_link)")
+        self.db.commit()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> "LibraryIndex":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    @staticmethod
+    def _entry(row: tuple) -> LinkEntry:
+        return LinkEntry(Path(row[0]), Path(row[1]), row[2], row[3], row[4])
+
+    def is_current(self, host_path: Path, media_link: Path) -> bool:
+        """True when `host_path` is unchanged since it was linked to `media_link` and the link still points to it."""
+        row = self.db.execute(
+            "SELECT media_link, mtime_ns FROM links WHERE host_path = ?", (str(host_path),)
+        ).fetchone()
+        if row is None or row[0] != str(media_link):
+            return False
+        try:
+            # sam is_symlink() przepuściłby link podmieniony ręcznie albo przez inny torrent
+            return host_path.stat().st_mtime_ns == row[1] and os.readlink(media_link) == str(host_path)
+        except OSError:
+            return False
+
+    def record(self, host_path: Path, media_link: Path, torrent_hash: str | None, category: str) -> None:
+        self.record_many([(host_path, media_link)], torrent_hash, category)
+
+    def record_many(self, links: list[tuple[Path, Path]], torrent_hash: str | None, category: str) -> None:
+        """Record (host_path, media_link) pairs in a single transaction."""
+        rows = []
+        for host_path, media_link in links:
+            try:
+                mtime_ns = host_path.stat().st_mtime_ns
+            except OSError:
+                mtime_ns = 0
+            rows.append((str(host_path), str(media_link), torrent_hash, mtime_ns, category, time.time()))
+        # link założony bez hasha (ręcznie, watcher) nie kasuje hasha zapisanego wcześniej przez hook rTorrenta
+        self.db.executemany(
+            "INSERT INTO links (host_path, media_link, torrent_hash, mtime_ns, category, linked_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(host_path) DO UPDATE SET media_link = excluded.media_link,"
+            " torrent_hash = COALESCE(excluded.torrent_hash, links.torrent_hash),"
+            " mtime_ns = excluded.mtime_ns, category = excluded.category, linked_at = excluded.linked_at",
+            rows,
+        )
+        self.db.commit()
+
+    def assign_torrent(self, media_links: list[Path], torrent_hash: str) -> None:
+        """Attach `torrent_hash` to already indexed links that were created without one."""
+        self.db.executemany(
+            "UPDATE links SET torrent_hash = ? WHERE media_link = ? AND torrent_hash IS NULL",
+            [(torrent_hash, str(media_link)) for media_link in media_links],
+        )
+        self.db.commit()
+
+    def forget(self, host_path: Path) -> None:
+        self.db.execute("DELETE FROM links WHERE host_path = ?", (str(host_path),))
+        self.db.commit()
+
+    def links_for_torrent(self, torrent_hash: str) -> list[LinkEntry]:
+        rows = self.db.execute(
+            "SELECT host_path, media_link, torrent_hash, mtime_ns, category FROM links WHERE torrent_hash = ?",
+            (torrent_hash.lower(),),
+        )
+        return [self._entry(r) for r in rows]
+
+    def entries(self) -> list[LinkEntry]:
+        rows = self.db.execute("SELECT host_path, media_link, torrent_hash, mtime_ns, category FROM links")
+        return [self._entry(r) for r in rows]
+
+    def reconcile(self, prune: bool = False) -> tuple[list[LinkEntry], list[LinkEntry]]:
+        """
+        Check every indexed link with two stat calls (no directory walks).
+
+        Returns (dangling, missing): links whose torrent file is gone, and indexed links that
+        no longer exist in /media. With `prune` dangling links are removed and both are forgotten.
+        """
+        dangling: list[LinkEntry] = []
+        missing: list[LinkEntry] = []
+        for entry in self.entries():
+            if not entry.media_link.is_symlink():
+                missing.append(entry)
+            elif not entry.host_path.exists():
+                dangling.append(entry)
+        if prune:
+            for entry in dangling:
+                entry.media_link.unlink(missing_ok=True)
+            for entry in dangling + missing:
+                self.forget(entry.host_path)
+        return dangling, missing
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Query and reconcile index of media links.")
+    parser.add_argument("--index", default=str(INDEX_PATH), help=f"Index database (default: {INDEX_PATH})")
+    sub = parser.add_subparsers(dest="command", required=True)
+    links = sub.add_parser("links", help="List links created for torrent")
+    links.add_argument("infohash")
+    reconcile = sub.add_parser("reconcile", help="Find dangling and missing links")
+    reconcile.add_argument("--prune", action="store_true", help="Remove dangling links and stale entries")
+    args = parser.parse_args()
+
+    with LibraryIndex(Path(args.index)) as index:
+        if args.command == "links":
+            for entry in index.links_for_torrent(args.infohash):
+                print(f"{entry.media_link} -> {entry.host_path}")
+        elif args.command == "reconcile":
+            dangling, missing = index.reconcile(prune=args.prune)
+            for entry in dangling:
+                print(f"dangling: {entry.media_link} -> {entry.host_path}")
+            for entry in missing:
+                print(f"missing:  {entry.media_link} -> {entry.host_path}")
+            print(f"{len(dangling)} dangling, {len(missing)} missing" + (" (pruned)" if args.prune else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+import traceback
+from pathlib import Path
+
+from organise_by_filename import SKIPPED_DIRS, SUPPORTED_CATEGORIES, VIDEO_EXTENSIONS, organise, scan_videos
+
+WATCH_ROOT = Path(os.environ.get("RT_WATCH_ROOT", "/downloads/complete"))
+DEBOUNCE = float(os.environ.get("RT_WATCH_DEBOUNCE", "5"))  # s ciszy, zanim wpis zostanie zorganizowany
+POLL_INTERVAL = 30.0  # s, tylko gdy inotify jest niedostępne
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """
+    Minimal inotify binding (ctypes, no dependencies) watching whole directory trees.
+
+    inotify is not recursive, so every directory gets its own watch; directories created
+    or moved in later are added as their events arrive.
+    """
+
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1: {os.strerror(err)}")
+        self.watches: dict[int, Path] = {}
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+    def add(self, path: Path) -> None:
+        wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):  # zniknął, zanim zdążyliśmy go obserwować
+                return
+            raise OSError(err, f"inotify_add_watch: {os.strerror(err)}", str(path))
+        self.watches[wd] = path
+
+    def add_tree(self, root: Path) -> None:
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            self.add(directory)
+            try:
+                with os.scandir(directory) as entries:
+                    stack.extend(
+                        Path(e.path) for e in entries
+                        if e.is_dir(follow_symlinks=False) and e.name.casefold() not in SKIPPED_DIRS
+                    )
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+    def read(self) -> list[tuple[Path | None, str, int]]:
+        """Read pending events as (directory, name, mask); directory is None on queue overflow."""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+            elif mask & IN_Q_OVERFLOW:
+                events.append((None, "", mask))
+            elif wd in self.watches:
+                events.append((self.watches[wd], name, mask))
+        return events
+
+
+class Debouncer:
+    """Releases each touched path after `delay` seconds without new events."""
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self._due: dict[Path, float] = {}
+
+    def touch(self, path: Path) -> None:
+        self._due[path] = time.monotonic() + self.delay
+
+    def ready(self) -> list[Path]:
+        now = time.monotonic()
+        paths = [path for path, due in self._due.items() if due <= now]
+        for path in paths:
+            del self._due[path]
+        return paths
+
+    def timeout(self) -> float | None:
+        if not self._due:
+            return None
+        return max(min(self._due.values()) - time.monotonic(), 0.0)
+
+
+class LibraryWatcher:
+    """
+    Organises new content in `/downloads/complete/<Category>` as it appears.
+
+    Events are reduced to the top-level entry they belong to (torrent folder or single file),
+    and only that entry is parsed and linked once it stays quiet for `debounce` seconds and its
+    video sizes stop changing. Links that are already up to date are skipped by the library index.
+    """
+
+    def __init__(self, root: Path = WATCH_ROOT, debounce: float = DEBOUNCE, dry_run: bool = False) -> None:
+        self.roots = {root / category: category for category in SUPPORTED_CATEGORIES if (root / category).is_dir()}
+        self.debouncer = Debouncer(debounce)
+        self.dry_run = dry_run
+        self._sizes: dict[Path, tuple[tuple[Path, int], ...]] = {}
+
+    def entry_for(self, path: Path) -> Path | None:
+        """Top-level entry of a category folder containing `path` (None for hidden and unrelated paths)."""
+        for root in self.roots:
+            if path.is_relative_to(root) and path != root:
+                name = path.relative_to(root).parts[0]
+                # ukryte pliki to m.in. dzienniki copy_engine.py (.<nazwa>.copy-journal)
+                return None if name.startswith(".") else root / name
+        return None
+
+    def entries(self) -> list[Path]:
+        return [entry for root in self.roots for entry in root.iterdir() if not entry.name.startswith(".")]
+
+    def settled(self, entry: Path) -> bool:
+        """True when `entry` is not being copied and its videos kept their sizes since the last check."""
+        if (entry.parent / f".{entry.name}.copy-journal").exists():
+            return False
+        sizes = tuple(sorted((v.path, v.size) for v in scan_videos(entry, sizes=True)))
+        previous = self._sizes.get(entry)
+        self._sizes[entry] = sizes
+        return sizes == previous
+
+    def process_ready(self) -> None:
+        for entry in self.debouncer.ready():
+            if not entry.exists():
+                self._sizes.pop(entry, None)
+                continue
+            if not self.settled(entry):
+                # wciąż kopiowany albo pierwsze sprawdzenie - jeszcze jedno okno ciszy
+                self.debouncer.touch(entry)
+                continue
+            del self._sizes[entry]
+            category = self.roots[entry.parent]
+            try:
+                organise(category, "noop", entry, dry_run=self.dry_run)
+            except Exception:
+                traceback.print_exc()
+                print(f"Failed to organise {entry}")
+
+    def watch_inotify(self, inotify: Inotify) -> None:
+        print(f"Watching {', '.join(map(str, self.roots))} with inotify ({len(inotify.watches)} directories)")
+        while True:
+            readable, _, _ = select.select([inotify.fd], [], [], self.debouncer.timeout())
+            if readable:
+                for directory, name, mask in inotify.read():
+                    if directory is None:
+                        # kolejka zdarzeń przepełniona - nie wiadomo, co przegapiliśmy
+                        print("inotify queue overflow, checking all entries")
+                        for entry in self.entries():
+                            self.debouncer.touch(entry)
+                        continue
+                    path = directory / name
+                    if (entry := self.entry_for(path)) is None:
+                        continue
+                    if mask & IN_ISDIR:
+                        if name.casefold() in SKIPPED_DIRS:
+                            continue
+                        inotify.add_tree(path)
+                    elif mask & IN_CREATE or path.suffix not in VIDEO_EXTENSIONS:
+                        # plik dopiero powstaje - czekamy na IN_CLOSE_WRITE
+                        continue
+                    self.debouncer.touch(entry)
+            self.process_ready()
+
+    def watch_polling(self, interval: float = POLL_INTERVAL) -> None:
+        """
+        Fallback without inotify: stat top-level entries every `interval` seconds.
+
+        Only changes visible on the entry itself are noticed (new torrent folder or file,
+        files added directly to the folder), nested folders are not walked.
+        """
+        print(f"Watching {', '.join(map(str, self.roots))} by polling every {interval:g}s")
+
+        def snapshot() -> dict[Path, int]:
+            stats = {}
+            for entry in self.entries():
+                try:
+                    stats[entry] = entry.stat().st_mtime_ns
+                except FileNotFoundError:
+                    continue
+            return stats
+
+        known = snapshot()
+        next_poll = time.monotonic() + interval
+        while True:
+            timeout = self.debouncer.timeout()
+            time.sleep(max(min(next_poll - time.monotonic(), timeout if timeout is not None else interval), 0.0))
+            if time.monotonic() >= next_poll:
+                current = snapshot()
+                for entry, mtime_ns in current.items():
+                    if known.get(entry) != mtime_ns:
+                        self.debouncer.touch(entry)
+                known = current
+                next_poll = time.monotonic() + interval
+            self.process_ready()
+
+    def run(self, initial_scan: bool = False, force_polling: bool = False, interval: float = POLL_INTERVAL) -> None:
+        if not self.roots:
+            raise FileNotFoundError(f"None of category folders exist: {', '.join(SUPPORTED_CATEGORIES)}")
+        if initial_scan:
+            for entry in self.entries():
+                self.debouncer.touch(entry)
+        inotify = None
+        if not force_polling:
+            try:
+                inotify = Inotify()
+                for root in self.roots:
+                    inotify.add_tree(root)
+            except (OSError, AttributeError) as e:
+                # brak inotify (inny system, FUSE/NFS) albo wyczerpany fs.inotify.max_user_watches
+                print(f"inotify unavailable ({e}), falling back to polling")
+                if inotify is not None:
+                    inotify.close()
+                inotify = None
+        if inotify is None:
+            self.watch_polling(interval)
+        else:
+            self.watch_inotify(inotify)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Watch category folders and create media links for new content as soon as it is complete."
+    )
+    parser.add_argument("--root", default=str(WATCH_ROOT), help=f"Folder with category folders (default: {WATCH_ROOT})")
+    parser.add_argument(
+        "--debounce", type=float, default=DEBOUNCE,
+        help=f"Seconds without changes before entry is organised (default: {DEBOUNCE:g})"
+    )
+    parser.add_argument("--initial-scan", action="store_true", help="Also check all existing entries on start")
+    parser.add_argument("--poll", action="store_true", help="Do not use inotify, poll for changes")
+    parser.add_argument(
+        "--poll-interval", type=float, default=POLL_INTERVAL,
+        help=f"Seconds between polls (default: {POLL_INTERVAL:g})"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Only print links that would be created")
+    args = parser.parse_args()
+
+    sys.stdout.reconfigure(line_buffering=True)
+    watcher = LibraryWatcher(Path(args.root), args.debounce, args.dry_run)
+    try:
+        watcher.run(args.initial_scan, args.poll, args.poll_interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
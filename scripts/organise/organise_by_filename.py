@@ -1,10 +1,20 @@
 from __future__ import annotations
-import contextlib
-import sys
+import os
 import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from dataclasses import dataclass
-import xmlrpc.client
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from io_scheduler import admitted
+from library_index import LibraryIndex
+from metrics import span
+from release_parser import parse_episode_name, parse_movie_name
+from rtorrent_client import BatchingClient, RTorrentClient, get_client, unwrapped, validate_infohash
+from torrent_verify import HASH_CHECK, relocation_verified
 
 
 SUPPORTED_CATEGORIES = [
@@ -19,6 +29,15 @@ LINK_FILE_DIR = Path("/media/")
 MOVIES_FILE_DIR = LINK_FILE_DIR / "movies"
 SERIES_FILE_DIR = LINK_FILE_DIR / "series"
 HOST_PATH = Path("/downloads")
+# katalogi z dodatkami w torrentach - nie są odcinkami ani filmem
+SKIPPED_DIRS = frozenset({
+    "sample", "samples", "extras", "extra", "bonus", "featurettes", "trailers", "behind the scenes", "deleted scenes"
+})
+SAMPLE_FILE_PATTERN = re.compile(r'(?:^|[.\-_ ])sample$', re.IGNORECASE)
+LINK_WORKERS = int(os.environ.get("RT_LINK_WORKERS", "8"))  # równoległe mkdir/symlink, ważne przy sieciowym /media
+HASH_POLL_INTERVAL = 5.0  # s, jak często pytamy rTorrenta, czy skończył sprawdzać dane
+# s, po takim czasie przestajemy czekać na rehash i zwalniamy miejsce "hash" w io_scheduler.py
+HASH_TIMEOUT = float(os.environ.get("RT_HASH_TIMEOUT", str(6 * 3600)))
 
 @dataclass
 class MovieInfo:
@@ -78,21 +97,28 @@ def remove_psig_prefix(name: str) -> str:
         return name[len(prefix):]
     return name
 
-def update_directory_and_save(infohash: str, basedir: str):
+def update_directory_and_save(
+    infohash: str,
+    basedir: str,
+    client: RTorrentClient | BatchingClient | None = None,
+    hash_check: str = HASH_CHECK,
+):
     """
     Ustaw katalog torrenta i zapisz całą sesję w jednym multicall.
     Zwraca listę odpowiedzi metod XML-RPC.
 
-    :param infohash: 40-znakowy hash (hex)
-    :param basedir:  docelowy katalog (istniejący lub do utworzenia przez rTorrent/Twoje procesy)
+    :param infohash:   40-znakowy hash (hex)
+    :param basedir:    docelowy katalog (istniejący lub do utworzenia przez rTorrent/Twoje procesy)
+    :param client:     klient XML-RPC (domyślnie współdzielony, z pulą połączeń)
+    :param hash_check: "full" - zawsze d.check_hash, "sample" - d.check_hash tylko gdy szybka weryfikacja
+                       kopii (rozmiary, mtime, próbka kawałków) się nie powiedzie
     """
     if infohash == "noop":
         return None
-    ih = infohash.strip().lower()
-    if not (len(ih) == 40 and all(c in "0123456789abcdef" for c in ih)):
-        raise ValueError("infohash musi być 40-znakowym ciągiem hex.")
+    ih = validate_infohash(infohash)
+    client = client or get_client()
+    skip_check = hash_check == "sample" and relocation_verified(ih, Path(basedir), client)
 
-    server = xmlrpc.client.ServerProxy("http://127.0.0.1:8000/RPC2", allow_none=True)
     calls = [
         {"methodName": "d.open",       "params": [ih]},
         {"methodName": "d.check_hash", "params": [ih]},
@@ -103,147 +129,241 @@ def update_directory_and_save(infohash: str, basedir: str):
         {"methodName": "d.start", "params": [ih]},
         {"methodName": "session.save",    "params": []},
     ]
-    print("sending:", calls)
-    return server.system.multicall(calls)
+    if skip_check:
+        return client.multicall([c for c in calls if c["methodName"] != "d.check_hash"])
+    # rehash czyta cały torrent z dysku - czeka w kolejce io_scheduler.py jak kopiowanie
+    with admitted([Path(basedir)], "hash", ih) as slot:
+        results = client.multicall(calls)
+        if slot is not None:
+            wait_for_hashing(ih, client)
+    return results
+
+
+def wait_for_hashing(infohash: str, client: RTorrentClient | BatchingClient, timeout: float = HASH_TIMEOUT) -> None:
+    """Block until rTorrent finishes checking `infohash` (d.hashing drops to 0) or `timeout` seconds pass."""
+    # pytamy od razu, bez okna BatchingClient i bez dokładania session.save co kilka sekund
+    rpc = unwrapped(client)
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        time.sleep(HASH_POLL_INTERVAL)
+        if int(rpc.call("d.hashing", infohash)) == 0:
+            print(f"Hash check of {infohash} finished in {time.monotonic() - start:.0f}s")
+            return
+    print(f"Hash check of {infohash} still running after {timeout:.0f}s, releasing hash slot")
+
+
+@dataclass(frozen=True)
+class VideoFile:
+    path: Path
+    size: int | None = None  # tylko z sizes=True
 
 
-def parse_movie(file_path: Path) -> MovieInfo:
-    if not file_path.is_file():
-        for path in file_path.rglob('*'):
-            if path.suffix in VIDEO_EXTENSIONS:
-                file_path = path
-                break
-
-    assert file_path.is_file(), "No valid video file found."
-    year_pattern: re.Pattern = re.compile(r'([\(\.]?((?:19|20)\d{2})(?!p)[\)\.]?)')
-    if (result := (year_pattern.search(file_path.name) or year_pattern.search(file_path.parent.name))) is None:
-        raise ValueError(f"Year not found in filename: `{file_path.name}`")
+def scan_videos(root: Path, sizes: bool = False) -> Iterator[VideoFile]:
+    """
+    Yield video files under `root` in a single `os.scandir` walk.
 
-    year: str = result.group(2)
-    name: str = file_path.name[:result.start(1)].replace('.', ' ').strip(" ([")
-    extension: str = file_path.suffix
-    host_path = HOST_PATH.joinpath(*file_path.parts[2:])
+    File type comes from cached `DirEntry` info, so files are stat'ed only when `sizes` is requested.
+    Sample and extras folders and `*-sample` files are skipped. A file passed as `root` is yielded
+    whatever its extension, like before.
+    """
+    if not root.is_dir():
+        if root.is_file():
+            yield VideoFile(root, root.stat().st_size if sizes else None)
+        return
+    stack = [root.as_posix()]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name.casefold() not in SKIPPED_DIRS:
+                        stack.append(entry.path)
+                    continue
+                stem, extension = os.path.splitext(entry.name)
+                if (extension.lower() in VIDEO_EXTENSIONS and not SAMPLE_FILE_PATTERN.search(stem)
+                        and entry.is_file()):
+                    yield VideoFile(Path(entry.path), entry.stat().st_size if sizes else None)
+
+
+def movie_from_file(file_path: Path) -> MovieInfo:
+    if (parsed := parse_movie_name(file_path.as_posix())) is None:
+        raise ValueError(f"Year not found in filename: `{file_path.name}`")
 
     return MovieInfo(
-        name=name,
-        year=year,
-        host_path=host_path,
+        name=parsed.name,
+        year=parsed.year,
+        host_path=HOST_PATH.joinpath(*file_path.parts[2:]),
         path=file_path,
-        extension=extension
+        extension=file_path.suffix,
     )
 
+def parse_movie(file_path: Path) -> MovieInfo:
+    # kilka kandydatów (np. film + dodatki poza folderem extras) - film jest zwykle największy
+    video = max(scan_videos(file_path, sizes=True), key=lambda v: v.size, default=None)
+    assert video is not None, "No valid video file found."
+    return movie_from_file(video.path)
+
 def parse_filmography(file_path: Path) -> list[MovieInfo]:
-    result: list[MovieInfo] = []
-    for path in file_path.rglob('*'):
-        if path.suffix in VIDEO_EXTENSIONS:
-            result.append(parse_movie(path))
-    return result
+    return [movie_from_file(video.path) for video in scan_videos(file_path)]
 
 def process_episode(file: Path) -> EpisodeInfo | None:
-    assert file.is_file(), f"path {file.as_posix()} should be file!"
-    episode_pattern: re.Pattern = re.compile(r'([sS](\d{1,2})\s*[eE](\d{1,3}[abcdefgh]?))')
-    backup_episode_pattern: re.Pattern = re.compile(
-        r'(?:[sS](?:(?:[eE][aA][sS][oO][nN])|(?:[eE][zZ][oO][nN]))?\s?(\d{1,2})(?!-)).*'
-        r'(?:[eE](?:(?:[pP][iI][zZ][oO][dD])|(?:[pP][iI][sS][oO][dD][eE]))?\s?(\d{1,3}[abcdefgh]?)(?!-)).*'
-    )
-    year_pattern: re.Pattern = re.compile(r'([\(\.]?((?:19|20)\d{2})(?!p)[\)\.]?)')
-    episodes: list[EpisodeInfo] = []
-
-    if file.suffix not in VIDEO_EXTENSIONS:
+    if file.suffix.lower() not in VIDEO_EXTENSIONS:
+        return None
+    if (parsed := parse_episode_name(file.as_posix())) is None:
+        print(f"Skipping file (no episode info found): {file}")
         return None
-    if (result := episode_pattern.search(file.name)) is None:
-        full_path = file.as_posix()
-        if (result_back := backup_episode_pattern.search(full_path)) is None:
-            print(f"Skipping file (no episode info found): {file}")
-            return None
-        season_num = int(result_back.group(1))
-        episode_num = result_back.group(2)
-        series_name = (" ".join(full_path[0:min(result_back.start(1), len(full_path))].split('/')[-1].split('.')[:-1])).strip()
-    else:
-        year_pos = len(file.name)
-        year_match = year_pattern.search(file.name)
-        if year_match:
-            year_pos = year_match.start(1)
-        season_num: int = int(result.group(2))
-        episode_num: int = result.group(3)
-        series_name: str = file.name[:min(result.start(1), year_pos)].replace('.', ' ').strip()
 
     extension: str = file.suffix
     host_path = HOST_PATH.joinpath(*file.parts[2:])
 
     return EpisodeInfo(
-        episode_num=episode_num,
-        season_num=season_num,
-        series_name=series_name,
+        episode_num=parsed.episode_num,
+        season_num=parsed.season_num,
+        series_name=parsed.series_name,
         host_path=host_path,
         extension=extension
     )
 
 def parse_series_dir(path: Path) -> list[EpisodeInfo]:
-    episode_pattern: re.Pattern = re.compile(r'([sS](\d{1,2})\s*[eE](\d{1,3}[abcdefgh]?))')
-    backup_episode_pattern: re.Pattern = re.compile(
-        r'(?:[sS](?:(?:[eE][aA][sS][oO][nN])|(?:[eE][zZ][oO][nN]))?\s?(\d{1,2})(?!-)).*'
-        r'(?:[eE](?:(?:[pP][iI][zZ][oO][dD])|(?:[pP][iI][sS][oO][dD][eE]))?\s?(\d{1,3}[abcdefgh]?)(?!-)).*'
-    )
-    year_pattern: re.Pattern = re.compile(r'([\(\.]?((?:19|20)\d{2})(?!p)[\)\.]?)')
     episodes: list[EpisodeInfo] = []
-
-    if path.is_file():
-        if (res := process_episode(path)) is not None:
-            return [res]
-        return []
-
-    for file in path.rglob('*'):
-        result = process_episode(file)
-        if result is None:
-            continue
-        episodes.append(result)
-
+    for video in scan_videos(path):
+        if (result := process_episode(video.path)) is not None:
+            episodes.append(result)
     return episodes
 
-def main():
-    category = sys.argv[1]
-    info_hash = sys.argv[2]
-    file_path = Path(" ".join(sys.argv[3:]))
+@dataclass
+class LinkPlan:
+    """All directories and links needed for one torrent, computed before touching /media."""
+    dirs: list[Path] = field(default_factory=list)
+    links: list[tuple[Path, Path]] = field(default_factory=list)  # (media_link, host_path)
+    current: list[Path] = field(default_factory=list)              # already linked, unchanged
+
+    def print(self) -> None:
+        for directory in self.dirs:
+            print(f"mkdir   {directory}")
+        for media_link, host_path in self.links:
+            print(f"link    {media_link} -> {host_path}")
+        for media_link in self.current:
+            print(f"current {media_link}")
+
+
+def plan_links(index: LibraryIndex, targets: list[tuple[Path, Path]]) -> LinkPlan:
+    """Skip links the index knows are up to date and collect each missing directory only once."""
+    plan = LinkPlan()
+    dirs: set[Path] = set()
+    for media_link, host_path in targets:
+        if index.is_current(host_path, media_link):
+            plan.current.append(media_link)
+            continue
+        plan.links.append((media_link, host_path))
+        dirs.add(media_link.parent)
+    # katalog sezonu tworzy też katalog serialu - nie ma sensu wołać mkdir dwa razy
+    parents = {parent for d in dirs for parent in d.parents}
+    plan.dirs = sorted(dirs - parents)
+    return plan
+
+
+def link_one(media_link: Path, host_path: Path) -> None:
+    """Point `media_link` at `host_path`, atomically replacing a link that points elsewhere."""
+    try:
+        media_link.symlink_to(host_path)
+        return
+    except FileExistsError:
+        if not media_link.is_symlink():
+            # prawdziwy plik albo katalog w /media - nie nadpisujemy cudzych danych
+            print(f"{media_link} exists and is not a link, skipping", file=sys.stderr)
+            return
+        if os.readlink(media_link) == str(host_path):
+            return
+    # stary link wskazuje inny plik - nowy link obok i rename, żeby Jellyfin nie trafił na brak pliku
+    tmp_link = media_link.with_name(f".{media_link.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_link.unlink(missing_ok=True)
+    tmp_link.symlink_to(host_path)
+    try:
+        os.replace(tmp_link, media_link)
+    except OSError:
+        tmp_link.unlink(missing_ok=True)
+        raise
+
+
+def apply_plan(plan: LinkPlan, index: LibraryIndex, info_hash: str, category: str, workers: int = LINK_WORKERS) -> None:
+    """Create planned directories, then links, each stage on a thread pool, and record links in index."""
+    with admitted([LINK_FILE_DIR], "meta", category), ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda d: d.mkdir(exist_ok=True, parents=True), plan.dirs))
+        list(pool.map(lambda link: link_one(*link), plan.links))
+    torrent_hash = None if info_hash == "noop" else info_hash.lower()
+    index.record_many([(host_path, media_link) for media_link, host_path in plan.links], torrent_hash, category)
+    if torrent_hash is not None and plan.current:
+        # linki mógł już założyć watcher (bez hasha) - przypisz je do torrenta
+        index.assign_torrent(plan.current, torrent_hash)
+
+
+def link_media(
+    index: LibraryIndex, targets: list[tuple[Path, Path]], info_hash: str, category: str, dry_run: bool = False
+) -> LinkPlan:
+    """Create `media_link` -> `host_path` for all `targets`, skipping those already linked and unchanged."""
+    start = time.monotonic()
+    with span("link", category=category, dry_run=dry_run) as link_span:
+        plan = plan_links(index, targets)
+        if dry_run:
+            plan.print()
+        else:
+            apply_plan(plan, index, info_hash, category)
+        link_span.labels.update(links=len(plan.links), current=len(plan.current))
+    print(f"{category}: {len(plan.links)} linked, {len(plan.current)} already linked, "
+          f"{len(plan.dirs)} dirs in {time.monotonic() - start:.2f}s" + (" (dry run)" if dry_run else ""))
+    return plan
+
+
+def organise(
+    category: str,
+    info_hash: str,
+    file_path: Path,
+    client: RTorrentClient | BatchingClient | None = None,
+    dry_run: bool = False,
+) -> None:
+    """Create media links for `file_path` and point torrent `info_hash` at its new location."""
     basepath = file_path.parent
 
     print(f"Category: {category}, Path: {file_path}, Basepath: {basepath}")
-    is_update_required = info_hash != "noop"
+    is_update_required = info_hash != "noop" and not dry_run
 
     if category not in SUPPORTED_CATEGORIES:
         print(f"Category '{category}' is not supported.")
-        print("Updating torrent basedir", info_hash, update_directory_and_save(info_hash, basepath.as_posix()))
+        if dry_run:
+            return
+        print("Updating torrent basedir", info_hash, update_directory_and_save(info_hash, basepath.as_posix(), client))
         return
 
-    elif category == "Filmy":
-        info = parse_movie(file_path)
-        print(f"Linking movie: {info.media_link} -> {info.host_path}")
-        info.media_folder.mkdir(exist_ok=True, parents=True)
-        with contextlib.suppress(FileExistsError):
-            info.media_link.symlink_to(info.host_path)
-        if is_update_required:
-            print("Updating torrent basedir", info_hash, update_directory_and_save(info_hash, basepath.as_posix()))
-
-    elif category == "Filmografia":
-        for movie in parse_filmography(file_path):
-            print(f"Linking movie: {movie.media_link} -> {movie.host_path}")
-            movie.media_folder.mkdir(exist_ok=True, parents=True)
-            with contextlib.suppress(FileExistsError):
-                movie.media_link.symlink_to(movie.host_path)
-        if is_update_required:
-            print("Updating torrent basedir", info_hash, update_directory_and_save(info_hash, basepath.as_posix()))
-
-    elif category in ["Seriale", "Anime"]:
-        episodes = parse_series_dir(file_path)
-        assert len(episodes) > 0, "No valid episodes found."
-        episodes[0].media_series_dir.mkdir(exist_ok=True, parents=True)
-        for episode in episodes:
-            episode.media_season_dir.mkdir(exist_ok=True, parents=True)
-            print(f"Linking series: {episode.media_episode_file} -> {episode.host_path}")
-            with contextlib.suppress(FileExistsError):
-                episode.media_episode_file.symlink_to(episode.host_path)
-        if is_update_required:
-            print("Updating torrent basedir", info_hash, update_directory_and_save(info_hash, basepath.as_posix()))
+    # dry run niczego nie zapisuje - także indeksu w /media
+    with LibraryIndex(read_only=dry_run) as index:
+        with span("parse", category=category) as parse_span:
+            if category == "Filmy":
+                info = parse_movie(file_path)
+                targets = [(info.media_link, info.host_path)]
+
+            elif category == "Filmografia":
+                targets = [(movie.media_link, movie.host_path) for movie in parse_filmography(file_path)]
+
+            elif category in ["Seriale", "Anime"]:
+                episodes = parse_series_dir(file_path)
+                assert len(episodes) > 0, "No valid episodes found."
+                targets = [(episode.media_episode_file, episode.host_path) for episode in episodes]
+            parse_span.labels["files"] = len(targets)
+
+        link_media(index, targets, info_hash, category, dry_run)
+
+    if is_update_required:
+        print("Updating torrent basedir", info_hash, update_directory_and_save(info_hash, basepath.as_posix(), client))
+
+
+def main():
+    # --dry-run: wypisz plan katalogów i linków, nic nie twórz i nie ruszaj rTorrenta
+    dry_run = "--dry-run" in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != "--dry-run"]
+    category = args[0]
+    info_hash = args[1]
+    file_path = Path(" ".join(args[2:]))
+    organise(category, info_hash, file_path, dry_run=dry_run)
 
 
 if __name__ == "__main__":
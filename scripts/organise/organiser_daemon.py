@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import os
+import select
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from organise_by_filename import SUPPORTED_CATEGORIES, organise
+from rtorrent_client import BatchingClient, get_client
+
+try:
+    from stop_torrent import update_directory_and_save as stop_torrent
+except ImportError:  # w kontenerze skrypt leży jako stop.py
+    from stop import update_directory_and_save as stop_torrent
+
+SPOOL_DIR = Path(os.environ.get("RT_ORGANISER_SPOOL", "/media/.organiser"))
+COPY_SCRIPT = Path(os.environ.get("RT_COPY_SCRIPT", Path(__file__).with_name("rt_atomic_copy.sh")))
+POLL_INTERVAL = 5.0  # s, zapasowe skanowanie kolejki, gdyby powiadomienie przez FIFO nie dotarło
+
+
+@dataclass
+class Job:
+    path: Path
+    label: str
+    info_hash: str
+    src: Path
+    destdir: Path
+
+    @property
+    def dest(self) -> Path:
+        return self.destdir / self.src.name
+
+    @classmethod
+    def load(cls, path: Path) -> "Job":
+        label, info_hash, src, destdir = path.read_text(encoding="utf-8").split("\n")[:4]
+        return cls(path=path, label=label, info_hash=info_hash, src=Path(src), destdir=Path(destdir))
+
+
+class Spool:
+    """
+    Crash-safe job queue on disk.
+
+    Hook writes job file into `queue/` (write to *.tmp + rename). Daemon claims it by renaming
+    into `running/`, removes it when done or moves it to `failed/`. Jobs left in `running/`
+    after crash are moved back to `queue/` on start.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.queue = root / "queue"
+        self.running = root / "running"
+        self.failed = root / "failed"
+        self.wake = root / "wake"
+        self.pid_file = root / "daemon.pid"
+        for directory in (self.queue, self.running, self.failed):
+            directory.mkdir(parents=True, exist_ok=True)
+        if not self.wake.exists():
+            os.mkfifo(self.wake)
+
+    def recover(self) -> None:
+        for path in sorted(self.running.iterdir()):
+            print(f"Recovering interrupted job: {path.name}")
+            path.rename(self.queue / path.name)
+
+    def pending(self) -> list[Path]:
+        return sorted(p for p in self.queue.iterdir() if p.suffix == ".job")
+
+    def claim(self, path: Path) -> Job | None:
+        target = self.running / path.name
+        try:
+            path.rename(target)
+        except FileNotFoundError:
+            return None
+        try:
+            return Job.load(target)
+        except ValueError:
+            print(f"Malformed job file: {path.name}")
+            target.rename(self.failed / path.name)
+            return None
+
+    def done(self, job: Job) -> None:
+        job.path.unlink(missing_ok=True)
+
+    def fail(self, job: Job) -> None:
+        job.path.rename(self.failed / job.path.name)
+
+
+class DeviceLocks:
+    """One lock per block device, so bulk copies to the same disk run one at a time."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._locks: dict[int, threading.Lock] = {}
+
+    @contextlib.contextmanager
+    def hold(self, *paths: Path):
+        devices = sorted({existing_parent(p).stat().st_dev for p in paths})
+        with self._lock:
+            locks = [self._locks.setdefault(d, threading.Lock()) for d in devices]
+        with contextlib.ExitStack() as stack:
+            for lock in locks:
+                stack.enter_context(lock)
+            yield
+
+
+def existing_parent(path: Path) -> Path:
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return path
+
+
+def copy_data(job: Job) -> None:
+    """Run copy stage of rt_atomic_copy.sh (same copy logic as per-torrent hook)."""
+    env = dict(os.environ, RT_DAEMONIZED="1", RT_COPY_ONLY="1")
+    subprocess.run(
+        ["sh", str(COPY_SCRIPT), str(job.src), str(job.destdir), job.label, job.info_hash],
+        env=env, check=True,
+    )
+
+
+def run_job(job: Job, spool: Spool, locks: DeviceLocks, rpc: BatchingClient) -> None:
+    start = time.monotonic()
+    print(f"[{job.info_hash}] started: {job.label} {job.src} -> {job.destdir}")
+    try:
+        if job.label not in SUPPORTED_CATEGORIES:
+            print(f"[{job.info_hash}] category '{job.label}' is not supported, skipping")
+            spool.done(job)
+            return
+        if job.src.exists():
+            print(f"[{job.info_hash}] stopping torrent:", stop_torrent(job.info_hash, rpc))
+            with locks.hold(job.src, job.destdir):
+                copy_data(job)
+        elif not job.dest.exists():
+            raise FileNotFoundError(f"Neither source nor destination exists: {job.src}")
+        organise(job.label, job.info_hash, job.dest, rpc)
+    except Exception:
+        traceback.print_exc()
+        print(f"[{job.info_hash}] failed after {time.monotonic() - start:.1f}s")
+        spool.fail(job)
+        return
+    spool.done(job)
+    print(f"[{job.info_hash}] finished in {time.monotonic() - start:.1f}s")
+
+
+def serve(spool: Spool, workers: int) -> None:
+    spool.pid_file.write_text(str(os.getpid()))
+    spool.recover()
+    # O_RDWR - FIFO nigdy nie ma EOF i zapis z hooka nie blokuje, dopóki demon żyje
+    wake_fd = os.open(spool.wake, os.O_RDWR | os.O_NONBLOCK)
+    locks = DeviceLocks()
+    # wywołania XML-RPC z równoległych zadań idą jednym multicallem z jednym session.save
+    rpc = BatchingClient(get_client())
+    in_flight: set[str] = set()
+    in_flight_lock = threading.Lock()
+
+    def finished(name: str) -> None:
+        with in_flight_lock:
+            in_flight.discard(name)
+        os.write(wake_fd, b"\n")
+
+    print(f"Organiser daemon listening on {spool.root} (pid {os.getpid()}, {workers} workers)")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            for path in spool.pending():
+                with in_flight_lock:
+                    if len(in_flight) >= workers:
+                        break
+                if (job := spool.claim(path)) is None:
+                    continue
+                with in_flight_lock:
+                    in_flight.add(path.name)
+                future = pool.submit(run_job, job, spool, locks, rpc)
+                future.add_done_callback(lambda _, name=path.name: finished(name))
+            select.select([wake_fd], [], [], POLL_INTERVAL)
+            with contextlib.suppress(BlockingIOError):
+                os.read(wake_fd, 4096)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Resident organiser: copies finished torrents and creates media links from a job queue."
+    )
+    parser.add_argument("--spool", default=str(SPOOL_DIR), help=f"Queue directory (default: {SPOOL_DIR})")
+    parser.add_argument("--workers", type=int, default=2, help="Maximum number of jobs in progress (default: 2)")
+    args = parser.parse_args()
+
+    sys.stdout.reconfigure(line_buffering=True)
+    serve(Spool(Path(args.spool)), args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import PurePosixPath
+
+# Wszystkie wzorce kompilowane raz, przy imporcie modułu
+YEAR_PATTERN = re.compile(r'([\(\.]?((?:19|20)\d{2})(?!p)[\)\.]?)')
+BACKUP_EPISODE_PATTERN = re.compile(
+    r'(?:[sS](?:(?:[eE][aA][sS][oO][nN])|(?:[eE][zZ][oO][nN]))?\s?(\d{1,2})(?!-)).*'
+    r'(?:[eE](?:(?:[pP][iI][zZ][oO][dD])|(?:[pP][iI][sS][oO][dD][eE]))?\s?(\d{1,3}[abcdefgh]?)(?!-)).*'
+)
+# SxxEyy i rok w jednym przebiegu po nazwie pliku
+EPISODE_OR_YEAR_PATTERN = re.compile(
+    r'(?P<episode>[sS](?P<season_num>\d{1,2})\s*[eE](?P<episode_num>\d{1,3}[abcdefgh]?))'
+    r'|(?P<year>[\(\.]?(?P<year_num>(?:19|20)\d{2})(?!p)[\)\.]?)'
+)
+CACHE_SIZE = 1 << 16
+
+
+@dataclass(frozen=True)
+class EpisodeName:
+    series_name: str
+    season_num: int
+    episode_num: str  # może mieć sufiks, np. "12a"
+
+
+@dataclass(frozen=True)
+class MovieName:
+    name: str
+    year: str
+
+
+def scan_episode_and_year(name: str) -> tuple[re.Match | None, re.Match | None]:
+    """Return first SxxEyy match and first year match from a single scan of `name`."""
+    episode = year = None
+    for match in EPISODE_OR_YEAR_PATTERN.finditer(name):
+        if match.group("episode") is not None:
+            episode = episode or match
+        else:
+            year = year or match
+        if episode is not None and year is not None:
+            break
+    return episode, year
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_episode_name(path: str) -> EpisodeName | None:
+    """Parse series name, season and episode from posix `path` (file name first, then whole path)."""
+    name = PurePosixPath(path).name
+    episode, year = scan_episode_and_year(name)
+    if episode is not None:
+        year_pos = year.start() if year is not None else len(name)
+        return EpisodeName(
+            series_name=name[:min(episode.start(), year_pos)].replace('.', ' ').strip(),
+            season_num=int(episode.group("season_num")),
+            episode_num=episode.group("episode_num"),
+        )
+
+    if (result := BACKUP_EPISODE_PATTERN.search(path)) is None:
+        return None
+    return EpisodeName(
+        series_name=(" ".join(path[0:min(result.start(1), len(path))].split('/')[-1].split('.')[:-1])).strip(),
+        season_num=int(result.group(1)),
+        episode_num=result.group(2),
+    )
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_movie_name(path: str) -> MovieName | None:
+    """Parse movie title and year from posix `path` (file name, or parent directory for the year)."""
+    file_path = PurePosixPath(path)
+    if (result := (YEAR_PATTERN.search(file_path.name) or YEAR_PATTERN.search(file_path.parent.name))) is None:
+        return None
+    return MovieName(
+        name=file_path.name[:result.start(1)].replace('.', ' ').strip(" (["),
+        year=result.group(2),
+    )
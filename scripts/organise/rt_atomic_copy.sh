@@ -5,6 +5,10 @@ LOG_PATH="${RT_ATOMIC_LOG:-/media/logs}"   # zmień lub ustaw RT_ATOMIC_LOG w en
 LOG_FILE="$LOG_PATH/core.log"
 USER_SCRIPT="${RT_USER_SCRIPT:-/user-scripts/organise_by_filename.py}"     # Twój skrypt (label, dest, hash)
 USER_STOP_SCRIPT="${RT_USER_SCRIPT:-/user-scripts/stop.py}"     # Twój skrypt (label, dest, hash)
+SPOOL="${RT_ORGANISER_SPOOL:-/media/.organiser}"   # kolejka organiser_daemon.py
+COPY_ENGINE="${RT_COPY_ENGINE:-/user-scripts/copy_engine.py}"   # równoległe, wznawialne kopiowanie
+IO_SCHEDULER="${RT_IO_SCHEDULER:-/user-scripts/io_scheduler.py}"   # limit ciężkich operacji na dysk
+METRICS="${RT_METRICS_SCRIPT:-/user-scripts/metrics.py}"   # czasy etapów (JSON lines / Prometheus)
 # -------------------------------
 
 daemonize() {
@@ -13,6 +17,80 @@ daemonize() {
   exec setsid nohup bash -c "$1" > "$LOG_PATH/$2.log" 2>&1 < /dev/null &
 }
 
+daemon_alive() {
+  [ -f "$SPOOL/daemon.pid" ] && kill -0 "$(cat "$SPOOL/daemon.pid")" 2>/dev/null
+}
+
+enqueue_job() {
+  # zapis atomowy (tmp + mv), demon nigdy nie zobaczy niepełnego pliku
+  local JOB="$SPOOL/queue/$(date +%s)-$$-$4.job"
+  printf '%s\n%s\n%s\n%s\n' "$3" "$4" "$1" "$2" > "$JOB.tmp"
+  mv "$JOB.tmp" "$JOB"
+  # obudź demona (trzyma FIFO otwarte, więc zapis nie blokuje; timeout na wypadek jego śmierci)
+  timeout 2 sh -c 'echo > "$1"' _ "$SPOOL/wake" 2>/dev/null || true
+}
+
+io_slot() {
+  # io_slot <ścieżka>... -- <polecenie>: uruchom, gdy io_scheduler.py wpuści kopiowanie na te dyski
+  # (bez schedulera albo gdy go nie ma - od razu, jak dawniej)
+  if [ -f "$IO_SCHEDULER" ]; then
+    python3 "$IO_SCHEDULER" run copy --label "$(basename -- "$1")" "$@"
+  else
+    while [ "$1" != "--" ]; do shift; done
+    shift
+    "$@"
+  fi
+}
+
+uptime_s() {
+  # czas z dokładnością do setnych sekundy (busybox date nie zawsze ma %N)
+  awk '{print $1}' /proc/uptime
+}
+
+tree_bytes() {
+  find "$1" -type f -exec stat -c %s {} + 2>/dev/null | awk '{s += $1} END {print s + 0}'
+}
+
+copy_data() {
+  local SRC="${1%/}" DEST="$2" METHOD BYTES START ELAPSED
+
+  BYTES="$(tree_bytes "$SRC")"
+  START="$(uptime_s)"
+
+  if [ -e "$DEST" ]; then
+    # cel już istnieje (ponowne uruchomienie) - tylko rsync umie go uzupełnić
+    METHOD="rsync"
+  elif [ "$(stat -c %d -- "$SRC")" = "$(stat -c %d -- "$(dirname -- "$DEST")")" ]; then
+    # ten sam system plików - rename(2), natychmiastowy i atomowy
+    METHOD="rename"
+    mv -- "$SRC" "$DEST"
+  elif cp -a --reflink=always -- "$SRC" "$DEST" 2>/dev/null; then
+    # btrfs/XFS (np. inny subvolume tego samego dysku) - klon bez kopiowania danych
+    METHOD="reflink"
+    rm -rf -- "$SRC"
+  else
+    rm -rf -- "$DEST"   # pozostałości po nieudanym reflinku
+    METHOD="rsync"
+  fi
+
+  if [ "$METHOD" = "rsync" ] && [ -f "$COPY_ENGINE" ]; then
+    # kopiowanie z dziennikiem (wznowienie po awarii) i dławieniem wg obciążenia dysku
+    METHOD="copy_engine"
+    io_slot "$SRC" "$DEST" -- ionice -c2 -n0 python3 "$COPY_ENGINE" "$SRC" "$DEST"
+  elif [ "$METHOD" = "rsync" ]; then
+    [ -d "$SRC" ] && SRC="$SRC/"
+    io_slot "$SRC" "$DEST" -- ionice -c2 -n0 rsync -aHAX --delete --inplace --remove-source-files --preallocate --fsync --bwlimit=20M --info=progress2 "$SRC" "$DEST"
+  fi
+
+  ELAPSED="$(awk -v a="$START" -v b="$(uptime_s)" 'BEGIN {print b - a}')"
+  awk -v m="$METHOD" -v n="$BYTES" -v t="$ELAPSED" \
+    'BEGIN {printf "COPY DONE method=%s bytes=%d time=%.2fs rate=%.1f MB/s\n", m, n, t, (t > 0 ? n / t / 1000000 : 0)}' \
+    | tee -a "$LOG_FILE"
+  if [ -f "$METRICS" ]; then
+    python3 "$METRICS" record copy --script rt_atomic_copy --seconds "$ELAPSED" --bytes "$BYTES" --label "method=$METHOD" || true
+  fi
+}
+
 main_job() {
   local SRC="$1" DESTDIR="$2" LABEL="${3:-}" HASH="${4:-}"
 
@@ -31,7 +109,7 @@ main_job() {
 #   Pause torrent before copy
   python3 "$USER_STOP_SCRIPT" "$HASH" || true
 
-  ionice -c2 -n0 rsync -aHAX --delete --inplace --remove-source-files --preallocate --fsync --bwlimit=20M --info=progress2 "$SRC" "$DEST"
+  copy_data "$SRC" "$DEST"
 #   ionice -c2 -n0 mv "$SRC" "$DEST"
 
   # 5) Twój skrypt użytkownika (jeśli istnieje)
@@ -51,6 +129,19 @@ HASH="${4:-}"
 
 echo "ARGUMENTS PARSED...." | tee -a $LOG_FILE
 
+# wywołanie z organiser_daemon.py - tylko kopiowanie
+if [ -n "${RT_COPY_ONLY:-}" ]; then
+  copy_data "$SRC" "$DESTDIR/$(basename -- "$SRC")"
+  exit 0
+fi
+
+# działa organiser_daemon.py - tylko dodaj zadanie do kolejki
+if [ -z "${RT_DAEMONIZED:-}" ] && daemon_alive; then
+  enqueue_job "$SRC" "$DESTDIR" "$LABEL" "$HASH"
+  echo "JOB QUEUED...." | tee -a $LOG_FILE
+  exit 0
+fi
+
 # jeśli nie jesteśmy jeszcze w tle – odpal właściwą robotę asynchronicznie i od razu wyjdź
 if [ -z "${RT_DAEMONIZED:-}" ]; then
   echo "STARTING DAEMON...." | tee -a $LOG_FILE
@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import argparse
+import http.client
+import os
+import queue
+import threading
+import time
+import xmlrpc.client
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+from metrics import span
+
+RPC_URL = os.environ.get("RT_XMLRPC_URL", "http://127.0.0.1:8000/RPC2")
+SESSION_SAVE = {"methodName": "session.save", "params": []}
+# odczyty (i zapis sesji) - można bezpiecznie wysłać drugi raz; d.check_hash, d.start itp. już nie
+SAFE_METHODS = frozenset({
+    "d.hashing", "d.session_file", "d.directory", "d.base_path", "d.name", "d.complete", "d.is_open", "d.is_active",
+    "d.state", "system.client_version", "session.save",
+})
+
+Call = dict[str, Any]
+
+
+def validate_infohash(infohash: str) -> str:
+    ih = infohash.strip().lower()
+    if not (len(ih) == 40 and all(c in "0123456789abcdef" for c in ih)):
+        raise ValueError("infohash musi być 40-znakowym ciągiem hex.")
+    return ih
+
+
+def is_idempotent(method: str, params: tuple) -> bool:
+    if method == "system.multicall":
+        return all(c["methodName"] in SAFE_METHODS for c in params[0])
+    return method in SAFE_METHODS
+
+
+def multicall_value(result: Any) -> Any:
+    """Value of one `system.multicall` element: `[value]`, or a fault dict raised as `xmlrpc.client.Fault`."""
+    if isinstance(result, dict) and "faultCode" in result:
+        raise xmlrpc.client.Fault(result["faultCode"], result.get("faultString", ""))
+    return result[0]
+
+
+class _SingleShot:
+    def request(self, host, handler, request_body, verbose=False):
+        # stdlib po zerwanym keep-alive wysyła żądanie jeszcze raz - dla zapisów to podwójne wykonanie
+        return self.single_request(host, handler, request_body, verbose)
+
+
+class SingleShotTransport(_SingleShot, xmlrpc.client.Transport):
+    pass
+
+
+class SingleShotSafeTransport(_SingleShot, xmlrpc.client.SafeTransport):
+    pass
+
+
+class RTorrentClient:
+    """
+    XML-RPC client for rTorrent with a pool of keep-alive connections and retries.
+
+    Every pooled `ServerProxy` keeps its HTTP connection open between calls, so a burst of
+    requests does not pay for a new TCP connection each time. Only reads (`SAFE_METHODS`) are
+    retried after a broken connection; requests with other calls use a fresh connection and are
+    retried only when it was refused.
+    """
+
+    def __init__(self, url: str = RPC_URL, pool_size: int = 4, retries: int = 3, backoff: float = 0.5) -> None:
+        self.url = url
+        self.retries = retries
+        self.backoff = backoff
+        self._pool: queue.LifoQueue[xmlrpc.client.ServerProxy] = queue.LifoQueue()
+        for _ in range(pool_size):
+            self._pool.put(xmlrpc.client.ServerProxy(url, allow_none=True))
+
+    def _request(self, method: str, *params: Any) -> Any:
+        calls = len(params[0]) if method == "system.multicall" else 1
+        with span("rpc", method=method, calls=calls):
+            return self._request_with_retries(method, *params)
+
+    def _one_shot_proxy(self) -> xmlrpc.client.ServerProxy:
+        transport = SingleShotSafeTransport() if self.url.startswith("https:") else SingleShotTransport()
+        return xmlrpc.client.ServerProxy(self.url, transport=transport, allow_none=True)
+
+    def _request_with_retries(self, method: str, *params: Any) -> Any:
+        delay = self.backoff
+        idempotent = is_idempotent(method, params)
+        for attempt in range(self.retries + 1):
+            # zapisy idą świeżym połączeniem - stare keep-alive mogło zostać zamknięte przez rTorrenta
+            proxy = self._pool.get() if idempotent else self._one_shot_proxy()
+            try:
+                return getattr(proxy, method)(*params)
+            except (OSError, http.client.HTTPException, xmlrpc.client.ProtocolError) as e:
+                if idempotent:
+                    # zerwane połączenie - nowy proxy zamiast starego, potem ponów z opóźnieniem
+                    proxy = xmlrpc.client.ServerProxy(self.url, allow_none=True)
+                # żądanie mogło już dotrzeć do rTorrenta - d.check_hash czy d.start ponawiamy tylko,
+                # gdy połączenie zostało odrzucone, zanim cokolwiek wysłaliśmy
+                if attempt == self.retries or not (idempotent or isinstance(e, ConnectionRefusedError)):
+                    raise
+            finally:
+                if idempotent:
+                    self._pool.put(proxy)
+                else:
+                    proxy("close")()
+            time.sleep(delay)
+            delay *= 2
+
+    def call(self, method: str, *params: Any) -> Any:
+        return self._request(method, *params)
+
+    def multicall(self, calls: list[Call]) -> list[Any]:
+        print("sending:", calls)
+        return self._request("system.multicall", calls)
+
+
+@dataclass
+class _Pending:
+    calls: list[Call]
+    future: Future = field(default_factory=Future)
+
+
+class BatchingClient:
+    """
+    Coalesces multicalls from many threads into one `system.multicall` per batch window.
+
+    `session.save` calls are dropped from the submitted batches and sent once at the end of
+    the combined multicall, so N finishing torrents cost one request and one session save.
+    Single reads (`SAFE_METHODS`, e.g. `d.hashing`) go straight to the wrapped client.
+    """
+
+    def __init__(self, client: RTorrentClient, window: float = 1.0) -> None:
+        self.client = client
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending: list[_Pending] = []
+        self._timer: threading.Timer | None = None
+
+    def call(self, method: str, *params: Any) -> Any:
+        if method in SAFE_METHODS:
+            # odczyt nie potrzebuje okna ani session.save
+            return self.client.call(method, *params)
+        return multicall_value(self.multicall([{"methodName": method, "params": list(params)}])[0])
+
+    def multicall(self, calls: list[Call]) -> list[Any]:
+        entry = _Pending([c for c in calls if c["methodName"] != "session.save"])
+        with self._lock:
+            self._pending.append(entry)
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        results, save_result = entry.future.result()
+
+        merged = iter(results)
+        return [save_result if c["methodName"] == "session.save" else next(merged) for c in calls]
+
+    def flush(self) -> None:
+        with self._lock:
+            batch, self._pending, self._timer = self._pending, [], None
+        if not batch:
+            return
+        calls = [c for entry in batch for c in entry.calls] + [SESSION_SAVE]
+        try:
+            results = self.client.multicall(calls)
+        except Exception as e:
+            for entry in batch:
+                entry.future.set_exception(e)
+            return
+        offset = 0
+        for entry in batch:
+            entry.future.set_result((results[offset:offset + len(entry.calls)], results[-1]))
+            offset += len(entry.calls)
+
+
+def unwrapped(client: RTorrentClient | BatchingClient) -> RTorrentClient:
+    """Client sending calls right away (no batch window, no added `session.save`)."""
+    return client.client if isinstance(client, BatchingClient) else client
+
+
+_default_client: RTorrentClient | None = None
+
+
+def get_client() -> RTorrentClient:
+    """Shared client for the whole process."""
+    global _default_client
+    if _default_client is None:
+        _default_client = RTorrentClient()
+    return _default_client
+
+
+class FakeRTorrent:
+    """Local XML-RPC server imitating rTorrent methods used by the scripts (for testing)."""
+
+    METHODS = (
+        "d.open", "d.close", "d.start", "d.stop", "d.check_hash", "d.directory.set", "d.session_file", "d.hashing",
+        "session.save",
+    )
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, verbose: bool = False) -> None:
+        self.verbose = verbose
+        handler = type("Handler", (SimpleXMLRPCRequestHandler,), {"rpc_paths": ("/RPC2",)})
+        self.server = SimpleXMLRPCServer((host, port), handler, allow_none=True, logRequests=False)
+        self.server.register_multicall_functions()
+        self.calls: list[tuple[str, tuple]] = []
+        for name in self.METHODS:
+            self.server.register_function(self._recorder(name), name)
+
+    def _recorder(self, name: str):
+        def method(*params: Any) -> int:
+            self.calls.append((name, params))
+            if self.verbose:
+                print(name, params)
+            return 0
+        return method
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/RPC2"
+
+    def start(self) -> "FakeRTorrent":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="rTorrent XML-RPC helper.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fake = sub.add_parser("fake-server", help="Run local fake rTorrent XML-RPC server and log received calls")
+    fake.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    if args.command == "fake-server":
+        server = FakeRTorrent(port=args.port, verbose=True)
+        print(f"Fake rTorrent listening on {server.url}")
+        server.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,27 @@
 from __future__ import annotations
 
 import sys
-import xmlrpc.client
 
-def update_directory_and_save(infohash: str):
+from rtorrent_client import BatchingClient, RTorrentClient, get_client, validate_infohash
+
+def update_directory_and_save(infohash: str, client: RTorrentClient | BatchingClient | None = None):
     """
     Ustaw katalog torrenta i zapisz całą sesję w jednym multicall.
     Zwraca listę odpowiedzi metod XML-RPC.
 
     :param infohash: 40-znakowy hash (hex)
     :param basedir:  docelowy katalog (istniejący lub do utworzenia przez rTorrent/Twoje procesy)
+    :param client:   klient XML-RPC (domyślnie współdzielony, z pulą połączeń)
     """
     if infohash == "noop":
         return None
-    ih = infohash.strip().lower()
-    if not (len(ih) == 40 and all(c in "0123456789abcdef" for c in ih)):
-        raise ValueError("infohash musi być 40-znakowym ciągiem hex.")
+    ih = validate_infohash(infohash)
 
-    server = xmlrpc.client.ServerProxy("http://127.0.0.1:8000/RPC2", allow_none=True)
     calls = [
         {"methodName": "d.stop",       "params": [ih]},
         {"methodName": "session.save",    "params": []},
     ]
-    print("sending:", calls)
-    return server.system.multicall(calls)
+    return (client or get_client()).multicall(calls)
 
 
 if __name__ == "__main__":
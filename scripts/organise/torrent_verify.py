@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import argparse
+import bisect
+import hashlib
+import os
+import random
+import time
+import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from rtorrent_client import BatchingClient, RTorrentClient, unwrapped
+
+# full - zawsze d.check_hash po przeniesieniu, sample - najpierw szybka weryfikacja w procesie
+HASH_CHECK = os.environ.get("RT_HASH_CHECK", "full")
+SESSION_DIR = os.environ.get("RT_SESSION_DIR")  # katalog sesji rTorrenta, gdy nie pytamy o d.session_file
+SAMPLE_PIECES = int(os.environ.get("RT_VERIFY_PIECES", "64"))
+VERIFY_WORKERS = int(os.environ.get("RT_VERIFY_WORKERS", "4"))
+
+
+def bdecode(data: bytes, pos: int = 0) -> tuple[Any, int]:
+    """Decode one bencoded value starting at `pos`; returns the value and position after it."""
+    kind = data[pos:pos + 1]
+    if kind == b"i":
+        end = data.index(b"e", pos)
+        return int(data[pos + 1:end]), end + 1
+    if kind in (b"l", b"d"):
+        items = []
+        pos += 1
+        while data[pos:pos + 1] != b"e":
+            value, pos = bdecode(data, pos)
+            items.append(value)
+        if kind == b"l":
+            return items, pos + 1
+        return dict(zip(items[::2], items[1::2])), pos + 1
+    if kind.isdigit():
+        colon = data.index(b":", pos)
+        start = colon + 1
+        end = start + int(data[pos:colon])
+        if end > len(data):
+            raise ValueError(f"Truncated string at offset {pos}")
+        return data[start:end], end
+    raise ValueError(f"Invalid bencode at offset {pos}")
+
+
+def info_span(data: bytes) -> tuple[int, int]:
+    """Byte range of the `info` dictionary (info hash is SHA-1 of exactly these bytes)."""
+    if data[:1] != b"d":
+        raise ValueError("Torrent file is not a dictionary")
+    pos = 1
+    while data[pos:pos + 1] != b"e":
+        key, pos = bdecode(data, pos)
+        start = pos
+        _, pos = bdecode(data, pos)
+        if key == b"info":
+            return start, pos
+    raise ValueError("Torrent file has no info dictionary")
+
+
+@dataclass(frozen=True)
+class TorrentFile:
+    path: tuple[str, ...]
+    length: int
+    offset: int       # początek pliku w ciągłym strumieniu danych torrenta
+    padding: bool     # plik wyrównujący (BEP 47) - same zera, nie ma go na dysku
+
+
+@dataclass(frozen=True)
+class TorrentMeta:
+    info_hash: str
+    name: str
+    piece_length: int
+    pieces: list[bytes]
+    files: list[TorrentFile]
+    multi_file: bool
+
+    @property
+    def total_size(self) -> int:
+        return sum(f.length for f in self.files)
+
+    @classmethod
+    def load(cls, path: Path) -> "TorrentMeta":
+        data = path.read_bytes()
+        start, end = info_span(data)
+        info, _ = bdecode(data, start)
+        if b"pieces" not in info:
+            raise ValueError("BitTorrent v2-only torrents are not supported")
+        pieces = info[b"pieces"]
+        name = info[b"name"].decode("utf-8", "surrogateescape")
+        files = []
+        offset = 0
+        for entry in info.get(b"files", [{b"length": info.get(b"length", 0), b"path": []}]):
+            parts = tuple(p.decode("utf-8", "surrogateescape") for p in entry[b"path"])
+            files.append(TorrentFile(parts, entry[b"length"], offset, b"p" in entry.get(b"attr", b"")))
+            offset += entry[b"length"]
+        return cls(
+            info_hash=hashlib.sha1(data[start:end]).hexdigest(),
+            name=name,
+            piece_length=info[b"piece length"],
+            pieces=[pieces[i:i + 20] for i in range(0, len(pieces), 20)],
+            files=files,
+            multi_file=b"files" in info,
+        )
+
+    def file_path(self, base: Path, file: TorrentFile) -> Path:
+        """Location of `file` when torrent data lives in `base` (like `d.directory.set`)."""
+        if not self.multi_file:
+            return base / self.name
+        return base.joinpath(self.name, *file.path)
+
+
+def resume_mtimes(resume_path: Path) -> list[int] | None:
+    """Per-file mtimes rTorrent remembers in `<hash>.torrent.libtorrent_resume` (None when not available)."""
+    try:
+        resume, _ = bdecode(resume_path.read_bytes())
+        return [entry.get(b"mtime", 0) for entry in resume[b"files"]]
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+@dataclass
+class VerifyResult:
+    ok: bool
+    reason: str
+    pieces_checked: int = 0
+    elapsed: float = 0.0
+
+
+class PieceReader:
+    """Reads pieces spanning file boundaries straight from the relocated files."""
+
+    def __init__(self, meta: TorrentMeta, base: Path) -> None:
+        self.meta = meta
+        self.base = base
+        self._starts = [f.offset for f in meta.files]
+
+    def read(self, index: int) -> bytes:
+        start = index * self.meta.piece_length
+        end = min(start + self.meta.piece_length, self.meta.total_size)
+        chunks = []
+        i = bisect.bisect_right(self._starts, start) - 1
+        while start < end:
+            file = self.meta.files[i]
+            file_end = file.offset + file.length
+            length = min(end, file_end) - start
+            if length > 0:
+                if file.padding:
+                    chunks.append(bytes(length))
+                else:
+                    fd = os.open(self.meta.file_path(self.base, file), os.O_RDONLY)
+                    try:
+                        chunk = os.pread(fd, length, start - file.offset)
+                    finally:
+                        os.close(fd)
+                    if len(chunk) != length:
+                        raise OSError(f"Short read in {file.path or self.meta.name}")
+                    chunks.append(chunk)
+                start += length
+            i += 1
+        return b"".join(chunks)
+
+    def check(self, index: int) -> bool:
+        return hashlib.sha1(self.read(index)).digest() == self.meta.pieces[index]
+
+
+def sample_pieces(meta: TorrentMeta, count: int) -> list[int]:
+    """First and last piece, the piece where each file starts, then random ones up to `count`."""
+    total = len(meta.pieces)
+    chosen = {0, total - 1}
+    for file in meta.files:
+        if len(chosen) >= count:
+            break
+        if not file.padding and file.length:
+            chosen.add(file.offset // meta.piece_length)
+    rest = [i for i in range(total) if i not in chosen]
+    chosen.update(random.sample(rest, min(max(count - len(chosen), 0), len(rest))))
+    return sorted(chosen)
+
+
+def verify_copy(
+    meta: TorrentMeta,
+    base: Path,
+    mtimes: list[int] | None = None,
+    samples: int = SAMPLE_PIECES,
+    workers: int = VERIFY_WORKERS,
+) -> VerifyResult:
+    """
+    Check relocated torrent data without a full rehash.
+
+    Every file must exist with the size from the torrent and (when `mtimes` from rTorrent resume data
+    are given) the same mtime - rTorrent itself rehashes files whose mtime changed. Then a sample
+    of pieces is read and hashed in parallel against the piece table.
+    """
+    start = time.monotonic()
+    if not meta.pieces:
+        return VerifyResult(False, "torrent has no pieces")
+    for i, file in enumerate(meta.files):
+        if file.padding:
+            continue
+        path = meta.file_path(base, file)
+        try:
+            st = path.stat()
+        except OSError as e:
+            return VerifyResult(False, f"{path}: {e.strerror}")
+        if st.st_size != file.length:
+            return VerifyResult(False, f"{path}: size {st.st_size}, expected {file.length}")
+        if mtimes is not None and i < len(mtimes) and mtimes[i] and int(st.st_mtime) != mtimes[i]:
+            return VerifyResult(False, f"{path}: mtime {int(st.st_mtime)}, rTorrent remembers {mtimes[i]}")
+
+    reader = PieceReader(meta, base)
+    indices = sample_pieces(meta, samples)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(reader.check, indices))
+    except OSError as e:
+        return VerifyResult(False, str(e), elapsed=time.monotonic() - start)
+    if not all(results):
+        bad = [i for i, ok in zip(indices, results) if not ok]
+        return VerifyResult(False, f"piece hash mismatch: {bad[:5]}", len(indices), time.monotonic() - start)
+    return VerifyResult(True, "ok", len(indices), time.monotonic() - start)
+
+
+def session_torrent(infohash: str, client: RTorrentClient | BatchingClient) -> Path | None:
+    if SESSION_DIR:
+        return Path(SESSION_DIR) / f"{infohash.upper()}.torrent"
+    # zwykłe wywołanie, nie element multicalla demona
+    path = unwrapped(client).call("d.session_file", infohash)
+    return Path(path) if isinstance(path, str) and path else None
+
+
+def relocation_verified(infohash: str, basedir: Path, client: RTorrentClient | BatchingClient) -> bool:
+    """
+    True when data of torrent `infohash` in `basedir` passed `verify_copy` and `d.check_hash` can be skipped.
+
+    Any problem (torrent file not found, unsupported torrent, failed check) returns False.
+    """
+    try:
+        torrent = session_torrent(infohash, client)
+        if torrent is None:
+            print("Verify: session torrent file unknown, full hash check")
+            return False
+        meta = TorrentMeta.load(torrent)
+        if meta.info_hash != infohash.lower():
+            print(f"Verify: {torrent} has info hash {meta.info_hash}, full hash check")
+            return False
+        result = verify_copy(meta, basedir, resume_mtimes(Path(f"{torrent}.libtorrent_resume")))
+    except (OSError, ValueError, KeyError, xmlrpc.client.Fault) as e:
+        print(f"Verify: {e}, full hash check")
+        return False
+    if not result.ok:
+        print(f"Verify failed ({result.reason}), full hash check")
+        return False
+    size_mib = meta.total_size / 1024 / 1024
+    print(f"Verify: {len(meta.files)} files ({size_mib:.0f} MiB) ok, "
+          f"{result.pieces_checked}/{len(meta.pieces)} pieces hashed in {result.elapsed:.2f}s, skipping hash check")
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check torrent data against its .torrent without full rehash.")
+    parser.add_argument("torrent", help="Path to .torrent file")
+    parser.add_argument("basedir", help="Folder containing torrent data (as passed to d.directory.set)")
+    parser.add_argument(
+        "--pieces", type=int, default=SAMPLE_PIECES, help=f"Number of pieces to hash (default: {SAMPLE_PIECES})"
+    )
+    parser.add_argument("--all", action="store_true", help="Hash all pieces")
+    parser.add_argument(
+        "--workers", type=int, default=VERIFY_WORKERS, help=f"Pieces hashed at once (default: {VERIFY_WORKERS})"
+    )
+    args = parser.parse_args()
+
+    torrent = Path(args.torrent)
+    meta = TorrentMeta.load(torrent)
+    result = verify_copy(
+        meta, Path(args.basedir), resume_mtimes(Path(f"{torrent}.libtorrent_resume")),
+        len(meta.pieces) if args.all else args.pieces, args.workers,
+    )
+    print(f"{meta.info_hash} {meta.name}: {result.reason}, "
+          f"{result.pieces_checked}/{len(meta.pieces)} pieces hashed in {result.elapsed:.2f}s")
+    raise SystemExit(0 if result.ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import numpy as np
+except ImportError:  # numpy jest potrzebny tylko dla --auto-sync
+    np = None
+
+SAMPLE_RATE = 4000          # Hz, wystarczające do korelacji i tanie w dekodowaniu
+WINDOW = 30                 # s, długość okna referencyjnego
+STEP = 60                   # s, co ile sekund liczymy przesunięcie
+MAX_OFFSET = 30             # s, maksymalne szukane przesunięcie w każdą stronę
+MIN_CONFIDENCE = 8.0        # minimalny stosunek piku korelacji do odchylenia standardowego
+CHANGE_TOLERANCE_MS = 80    # mniejsze zmiany przesunięcia traktujemy jako szum
+
+
+@dataclass(frozen=True)
+class OffsetSample:
+    time: float          # s, początek okna w osi czasu wideo
+    offset_ms: int       # o ile trzeba opóźnić nowe audio
+    confidence: float
+    change_at: float | None = None  # s, doprecyzowany moment zmiany przesunięcia względem poprzedniego okna
+
+
+@dataclass
+class SyncResult:
+    audio_offset: int                              # ms, przesunięcie na początku filmu
+    silence_gaps: list[tuple[int, float]]          # (punkt w s w osi czasu audio, długość w s)
+    samples: list[OffsetSample]
+
+
+def require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("--auto-sync requires numpy (pip install numpy)")
+
+
+def pcm_chunks(input_file: Path, track: int, chunk_samples: int) -> Iterator["np.ndarray"]:
+    """Decode audio track into mono, low sample rate PCM and yield it in fixed size chunks."""
+    cmd = [
+        "ffmpeg", "-v", "error", "-nostdin",
+        "-i", str(input_file),
+        "-map", f"0:a:{track}",
+        "-ac", "1", "-ar", str(SAMPLE_RATE),
+        "-f", "s16le", "pipe:1",
+    ]
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+        assert proc.stdout is not None
+        while data := proc.stdout.read(chunk_samples * 2):
+            yield np.frombuffer(data[:len(data) // 2 * 2], dtype="<i2").astype(np.float32)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to decode audio from {input_file}")
+
+
+class StreamBuffer:
+    """Window over a PCM stream addressed by absolute sample index, with bounded memory."""
+
+    def __init__(self, chunks: Iterator["np.ndarray"]) -> None:
+        self._chunks = chunks
+        self._data = np.zeros(0, dtype=np.float32)
+        self._start = 0  # absolutny indeks pierwszej próbki w buforze
+        self.eof = False
+
+    @property
+    def end(self) -> int:
+        return self._start + len(self._data)
+
+    def fill(self, end: int) -> bool:
+        """Read from stream until sample `end` is buffered, False on premature EOF."""
+        parts = [self._data]
+        available = self.end
+        while available < end and not self.eof:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self.eof = True
+                break
+            parts.append(chunk)
+            available += len(chunk)
+        self._data = np.concatenate(parts)
+        return self.end >= end
+
+    def slice(self, start: int, end: int) -> "np.ndarray":
+        """Return buffered samples of [start, end), zero-padded where before stream start."""
+        pad = max(0, min(end, 0) - start)
+        # obie granice przycięte do bufora - ujemne indeksy w numpy liczyłyby się od końca
+        low = min(max(start - self._start, 0), len(self._data))
+        high = min(max(end - self._start, low), len(self._data))
+        data = self._data[low:high]
+        return np.concatenate([np.zeros(pad, dtype=np.float32), data]) if pad else data
+
+    def drop_before(self, start: int) -> None:
+        if start > self._start:
+            self._data = self._data[start - self._start:]
+            self._start = start
+
+
+def correlate(reference: "np.ndarray", candidate: "np.ndarray", max_lag: int) -> tuple[int, float]:
+    """
+    Find where `reference` starts in `candidate` (GCC-PHAT over FFT).
+
+    Returns lag in samples (0..2*max_lag) and confidence (peak height in standard deviations).
+    """
+    size = 1 << int(np.ceil(np.log2(len(reference) + len(candidate))))
+    spectrum = np.fft.rfft(candidate, size) * np.conj(np.fft.rfft(reference, size))
+    spectrum /= np.maximum(np.abs(spectrum), 1e-12)
+    corr = np.fft.irfft(spectrum, size)[:2 * max_lag + 1]
+    lag = int(np.argmax(corr))
+    std = float(np.std(corr)) or 1e-12
+    return lag, float((corr[lag] - np.mean(corr)) / std)
+
+
+def locate_change(
+    reference: StreamBuffer, candidate: StreamBuffer, start: int, end: int, old_ms: int, new_ms: int
+) -> float:
+    """Scan short sub-windows between `start` and `end` and return time where `new_ms` starts to fit better."""
+    sub = 2 * SAMPLE_RATE
+    old, new = (round(ms * SAMPLE_RATE / 1000) for ms in (old_ms, new_ms))
+
+    def score(ref: "np.ndarray", offset: int, pos: int) -> float:
+        cand = candidate.slice(pos - offset, pos - offset + sub)
+        if len(cand) != len(ref):
+            return 0.0
+        return float(np.dot(ref, cand) / (np.linalg.norm(cand) or 1e-12))
+
+    for pos in range(start, end - sub, sub // 2):
+        ref = reference.slice(pos, pos + sub)
+        if score(ref, new, pos) > score(ref, old, pos):
+            return pos / SAMPLE_RATE
+    return end / SAMPLE_RATE
+
+
+def measure_offsets(
+    video_input: Path,
+    video_track: int,
+    audio_input: Path,
+    audio_track: int,
+    *,
+    window: int = WINDOW,
+    step: int = STEP,
+    max_offset: int = MAX_OFFSET,
+) -> list[OffsetSample]:
+    """Stream both tracks once and measure offset every `step` seconds."""
+    require_numpy()
+    chunk = step * SAMPLE_RATE
+    reference = StreamBuffer(pcm_chunks(video_input, video_track, chunk))
+    candidate = StreamBuffer(pcm_chunks(audio_input, audio_track, chunk))
+    win, lag_range = window * SAMPLE_RATE, max_offset * SAMPLE_RATE
+
+    samples: list[OffsetSample] = []
+    previous: OffsetSample | None = None
+    t = 0
+    while True:
+        start = t * SAMPLE_RATE
+        if not reference.fill(start + win):
+            break
+        candidate.fill(start + win + lag_range)
+        ref = reference.slice(start, start + win)
+        cand = candidate.slice(start - lag_range, start + win + lag_range)
+        if not np.any(ref) or len(cand) < win:
+            t += step
+            continue
+
+        lag, confidence = correlate(ref - ref.mean(), cand - cand.mean(), lag_range)
+        offset_ms = round((lag_range - lag) * 1000 / SAMPLE_RATE)
+        change_at = None
+        if (
+            previous is not None
+            and confidence >= MIN_CONFIDENCE
+            and abs(offset_ms - previous.offset_ms) >= CHANGE_TOLERANCE_MS
+        ):
+            change_at = locate_change(
+                reference, candidate, int(previous.time) * SAMPLE_RATE, start + win,
+                previous.offset_ms, offset_ms,
+            )
+        sample = OffsetSample(time=t, offset_ms=offset_ms, confidence=confidence, change_at=change_at)
+        samples.append(sample)
+        if confidence >= MIN_CONFIDENCE:
+            previous = sample
+        print(f"  {t // 60:3d}:{t % 60:02d}  offset {offset_ms:+6d} ms  (confidence {confidence:.1f})")
+
+        t += step
+        # poprzednie okno zostaje w buforze do ewentualnego doprecyzowania punktu zmiany
+        reference.drop_before((t - step) * SAMPLE_RATE)
+        candidate.drop_before((t - step - max_offset) * SAMPLE_RATE)
+    return samples
+
+
+def analyse(samples: list[OffsetSample], window: int = WINDOW) -> SyncResult:
+    """
+    Turn offset measurements into initial offset and silence gaps.
+
+    Change of offset is accepted only when confirmed by the next confident window. Point of
+    the gap (refined while streaming, or placed between the windows) is converted into audio
+    input timeline.
+    """
+    confident = [s for s in samples if s.confidence >= MIN_CONFIDENCE]
+    if not confident:
+        raise RuntimeError("Could not find reliable audio offset (tracks too different?)")
+
+    current = confident[0].offset_ms
+    gaps: list[tuple[int, float]] = []
+    for prev, cur, nxt in zip(confident, confident[1:], confident[2:] + [None]):
+        delta = cur.offset_ms - current
+        if abs(delta) < CHANGE_TOLERANCE_MS:
+            continue
+        if nxt is not None and abs(nxt.offset_ms - cur.offset_ms) >= CHANGE_TOLERANCE_MS:
+            continue  # pojedynczy pomiar, nie potwierdzony
+        if delta < 0:
+            print(f"  warning: audio has {-delta} ms extra around {cur.time}s, silence can't fix it")
+            current = cur.offset_ms
+            continue
+        video_time = cur.change_at if cur.change_at is not None else (prev.time + cur.time + window) / 2
+        point = max(0, round(video_time - current / 1000))
+        gaps.append((point, delta / 1000))
+        current = cur.offset_ms
+    return SyncResult(audio_offset=confident[0].offset_ms, silence_gaps=gaps, samples=samples)
+
+
+def detect_sync(
+    video_input: Path, video_track: int, audio_input: Path, audio_track: int, **kwargs: int
+) -> SyncResult:
+    """Measure offsets between reference (video) audio track and new audio track."""
+    print(f"Analysing sync of {audio_input} against {video_input}...")
+    return analyse(
+        measure_offsets(video_input, video_track, audio_input, audio_track, **kwargs),
+        kwargs.get("window", WINDOW),
+    )
@@ -0,0 +1,252 @@
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from dataclasses import dataclass
+from pathlib import Path
+
+import simple_remux
+from probe_cache import DEFAULT_CACHE_PATH, ProbeCache
+from simple_remux import RemuxInputs, parse_silence_gaps, probe_tracks, remux
+
+EPISODE_PATTERN = re.compile(r'[sS](\d{1,2})\s*[eE](\d{1,3})')
+VIDEO_EXTENSIONS = ('.mkv', '.mp4', '.m4v', '.avi', '.mov', '.ts')
+AUDIO_EXTENSIONS = VIDEO_EXTENSIONS + ('.mka', '.ac3', '.eac3', '.aac', '.mp3', '.dts', '.flac')
+SUB_EXTENSIONS = ('.srt', '.ass', '.ssa', '.sub', '.vtt')
+
+
+@dataclass
+class JobResult:
+    name: str  # plik wyjściowy, a dla wiersza, z którego nie dało się zbudować zadania - jego wideo
+    ok: bool
+    duration: float
+    error: str | None = None
+
+
+class DiskBudget:
+    """Limits number of concurrent jobs touching the same block device."""
+
+    def __init__(self, per_disk: int) -> None:
+        self.per_disk = per_disk
+        self._lock = threading.Lock()
+        self._semaphores: dict[int, threading.BoundedSemaphore] = {}
+
+    def _semaphore(self, device: int) -> threading.BoundedSemaphore:
+        with self._lock:
+            if device not in self._semaphores:
+                self._semaphores[device] = threading.BoundedSemaphore(self.per_disk)
+            return self._semaphores[device]
+
+    def acquire(self, stack: ExitStack, paths: list[Path]) -> None:
+        # zawsze w tej samej kolejności, żeby uniknąć zakleszczeń
+        for device in sorted({p.stat().st_dev for p in paths}):
+            semaphore = self._semaphore(device)
+            semaphore.acquire()
+            stack.callback(semaphore.release)
+
+
+def episode_key(path: Path) -> tuple[int, int] | None:
+    if (result := EPISODE_PATTERN.search(path.name)) is None:
+        return None
+    return int(result.group(1)), int(result.group(2))
+
+
+def index_by_episode(folder: Path, extensions: tuple[str, ...]) -> dict[tuple[int, int], Path]:
+    files: dict[tuple[int, int], Path] = {}
+    for path in sorted(folder.iterdir()):
+        if path.is_file() and path.suffix.lower() in extensions and (key := episode_key(path)) is not None:
+            files.setdefault(key, path)
+    return files
+
+
+def pair_directories(video_dir: Path, audio_dir: Path, sub_dir: Path | None) -> list[dict[str, str]]:
+    """Match video, audio and optional subtitle files by SxxEyy."""
+    videos = index_by_episode(video_dir, VIDEO_EXTENSIONS)
+    audios = index_by_episode(audio_dir, AUDIO_EXTENSIONS)
+    subs = index_by_episode(sub_dir, SUB_EXTENSIONS) if sub_dir else {}
+
+    rows: list[dict[str, str]] = []
+    for key, video in sorted(videos.items()):
+        if key not in audios:
+            print(f"Skipping S{key[0]:02d}E{key[1]:02d} (no matching audio): {video}")
+            continue
+        row = {"video_input": str(video), "audio_input": str(audios[key])}
+        if key in subs:
+            row["sub_input"] = str(subs[key])
+        rows.append(row)
+    return rows
+
+
+def read_manifest(manifest: Path) -> list[dict[str, str]]:
+    """Read jobs from CSV (with header) or JSON (list of objects) manifest."""
+    if manifest.suffix.lower() == ".json":
+        with open(manifest, encoding="utf-8") as f:
+            return [{k: str(v) for k, v in row.items() if v is not None} for row in json.load(f)]
+    with open(manifest, newline="", encoding="utf-8") as f:
+        return [{k: v for k, v in row.items() if v} for row in csv.DictReader(f)]
+
+
+def build_inputs(row: dict[str, str], args: argparse.Namespace) -> RemuxInputs:
+    def opt_int(name: str) -> int | None:
+        return int(row[name]) if row.get(name) else None
+
+    return RemuxInputs(
+        audio_input=Path(row["audio_input"]),
+        video_input=Path(row["video_input"]),
+        output_folder=Path(row.get("output_folder", args.output_folder)),
+        audio_track=opt_int("audio_track") or 0,
+        subtitle_input=Path(row["sub_input"]) if row.get("sub_input") else None,
+        subtitle_track=opt_int("sub_track") or 0,
+        audio_offset=opt_int("audio_offset") or 0,
+        sub_offset=opt_int("sub_offset") or 0,
+        audio_lang=row.get("audio_lang", args.audio_lang),
+        sub_lang=row.get("sub_lang", args.sub_lang),
+        audio_title=row.get("audio_title", args.audio_title),
+        sub_title=row.get("sub_title", args.sub_title),
+        scratch_folder=Path(args.scratch_folder) if args.scratch_folder else None,
+        silence_gaps=parse_silence_gaps(
+            [p for p in row.get("silence_points", "").split(";") if p], args.silence_duration
+        ),
+    )
+
+
+def build_jobs(rows: list[dict[str, str]], args: argparse.Namespace) -> tuple[list[RemuxInputs], list[JobResult]]:
+    """Build inputs row by row; a broken row becomes a failed result instead of stopping the batch."""
+    jobs: list[RemuxInputs] = []
+    failed: list[JobResult] = []
+    for row in rows:
+        try:
+            jobs.append(build_inputs(row, args))
+        except KeyError as e:
+            failed.append(JobResult(row.get("video_input", str(row)), ok=False, duration=0.0, error=f"missing {e}"))
+        except Exception as e:
+            failed.append(JobResult(row.get("video_input", str(row)), ok=False, duration=0.0, error=str(e)))
+    return jobs, failed
+
+
+def probe_all(jobs: list[RemuxInputs], workers: int) -> None:
+    """Probe every distinct input concurrently, so remux jobs hit the cache."""
+    files = {p for job in jobs for p in job.paths if p not in (job.output_folder, job.scratch_folder)}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(probe_tracks, f): f for f in files}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                # zadanie z tym plikiem i tak się wywali w run_job i trafi do podsumowania
+                print(f"Probing {futures[future]} failed: {e}", file=sys.stderr)
+
+
+def run_job(inputs: RemuxInputs, budget: DiskBudget) -> JobResult:
+    start = time.monotonic()
+    try:
+        inputs.output_folder.mkdir(parents=True, exist_ok=True)
+        if inputs.scratch_folder:
+            inputs.scratch_folder.mkdir(parents=True, exist_ok=True)
+        with ExitStack() as stack:
+            budget.acquire(stack, inputs.paths)
+            remux(inputs)
+    except Exception as e:
+        return JobResult(str(inputs.output_file), ok=False, duration=time.monotonic() - start, error=str(e))
+    return JobResult(str(inputs.output_file), ok=True, duration=time.monotonic() - start)
+
+
+def print_summary(results: list[JobResult], wall_time: float) -> None:
+    print()
+    print("Batch summary:")
+    for r in results:
+        status = "OK  " if r.ok else "FAIL"
+        line = f"  [{status}] {r.name} ({r.duration:.1f}s)"
+        if r.error:
+            line += f": {r.error}"
+        print(line)
+    failed = sum(not r.ok for r in results)
+    print(f"{len(results) - failed}/{len(results)} jobs succeeded in {wall_time:.1f}s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Remux many audio/video/subtitle sets in parallel."
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--manifest", help="CSV or JSON manifest with one job per row")
+    source.add_argument("--video-dir", help="Folder with video files (paired by SxxEyy)")
+    parser.add_argument("--audio-dir", help="Folder with audio files (required with --video-dir)")
+    parser.add_argument("--sub-dir", help="Folder with subtitle files (optional, with --video-dir)")
+    parser.add_argument(
+        "--output-folder", default="output", help="Output folder for remuxed files"
+    )
+    parser.add_argument(
+        "--scratch-folder",
+        help="Folder for in-progress outputs (e.g. on SSD), moved to output folder when complete"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=os.cpu_count() or 1,
+        help="Maximum number of concurrent ffmpeg/ffprobe processes (default: CPU count)"
+    )
+    parser.add_argument(
+        "--io-per-disk", type=int, default=2,
+        help="Maximum number of concurrent remux jobs per block device (default: 2)"
+    )
+    parser.add_argument(
+        "--audio-lang", type=str, default="pol", help="Audio language (default: pol)"
+    )
+    parser.add_argument(
+        "--sub-lang", type=str, default="pol", help="Subtitle language (default: pol)"
+    )
+    parser.add_argument(
+        "--audio-title", type=str, default="Polish", help="Audio title (default: Polish)"
+    )
+    parser.add_argument(
+        "--sub-title", type=str, default="Polish", help="Subtitle title (default: Polish)"
+    )
+    parser.add_argument(
+        "--silence-duration", type=float,
+        help="Default duration of silence for manifest `silence_points` without explicit duration"
+    )
+    parser.add_argument(
+        "--probe-cache", type=str, default=str(DEFAULT_CACHE_PATH),
+        help=f"Path to ffprobe cache database (default: {DEFAULT_CACHE_PATH})"
+    )
+
+    args = parser.parse_args()
+    simple_remux.PROBE_CACHE = ProbeCache(Path(args.probe_cache))
+
+    if args.manifest:
+        rows = read_manifest(Path(args.manifest))
+    else:
+        if not args.audio_dir:
+            parser.error("--audio-dir is required with --video-dir")
+        rows = pair_directories(
+            Path(args.video_dir), Path(args.audio_dir), Path(args.sub_dir) if args.sub_dir else None
+        )
+
+    start = time.monotonic()
+    jobs, results = build_jobs(rows, args)
+    if not jobs and not results:
+        print("No jobs to run.")
+        return
+
+    print(f"Probing inputs of {len(jobs)} jobs...")
+    probe_all(jobs, args.jobs)
+
+    budget = DiskBudget(args.io_per_disk)
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(run_job, job, budget) for job in jobs]
+        for future in as_completed(futures):
+            results.append(future.result())
+
+    results.sort(key=lambda r: r.name)
+    print_summary(results, time.monotonic() - start)
+    if not all(r.ok for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+import argparse
+import errno
+import itertools
+import json
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Iterator
+
+import requests
+
+import simple_remux
+from metrics import span
+from probe_cache import DEFAULT_CACHE_PATH, ProbeCache
+from simple_remux import (
+    RemuxInputs,
+    TrackInfo,
+    admitted,
+    build_ffmpeg_cmd,
+    ffprobe_cmd,
+    finalize_output,
+    parse_silence_gaps,
+    remux,
+    run_with_progress,
+    tracks_from_info,
+)
+
+try:
+    import vider
+except ImportError:
+    # w repozytorium vider.py leży w scripts/fetch
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "fetch"))
+    import vider
+from link_cache import DEFAULT_LINK_CACHE_PATH, DEFAULT_TTL, LinkCache, is_rejected
+from segmented_download import part_paths, promote
+
+STREAM_CHUNK = 1 << 16  # 64 KiB
+HEAD_LIMIT = 64 * 1024 * 1024  # tyle buforujemy, szukając `moov`, zanim uznamy, że plik nie jest faststart
+
+
+def read_head(chunks: Iterator[bytes], limit: int = HEAD_LIMIT) -> tuple[bytes, bool]:
+    """
+    Buffer the beginning of MP4 stream until its whole `moov` box is read.
+
+    Returns buffered bytes and whether `moov` comes before `mdat` (faststart file, which ffmpeg
+    can demux from a pipe). Top-level boxes are walked by their headers, nothing else is parsed.
+    """
+    head = bytearray()
+    offset = 0
+    for chunk in chunks:
+        head += chunk
+        while len(head) >= offset + 8:
+            size, box = struct.unpack(">I4s", head[offset:offset + 8])
+            if size == 1:
+                if len(head) < offset + 16:
+                    break
+                size = struct.unpack(">Q", head[offset + 8:offset + 16])[0]
+            if box == b"mdat" or size < 8:
+                # dane przed indeksem (albo box do końca pliku) - bez całego pliku się nie obejdzie
+                return bytes(head), False
+            if box == b"moov":
+                if len(head) >= offset + size:
+                    return bytes(head), True
+                break
+            offset += size
+        if len(head) >= limit:
+            break
+    return bytes(head), False
+
+
+def probe_head(head: bytes) -> dict[str, list[TrackInfo]]:
+    """Probe tracks from the buffered beginning of the stream (ffprobe reads it from stdin)."""
+    result = subprocess.run(
+        ffprobe_cmd("pipe:0"), input=head, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe error: {result.stderr.decode(errors='replace')}")
+    return tracks_from_info(json.loads(result.stdout))
+
+
+def write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+class StreamPump(threading.Thread):
+    """
+    Writes downloaded stream into the FIFO read by ffmpeg, optionally teeing it into `keep` file.
+
+    When ffmpeg stops reading early, the rest is still downloaded into `keep` (if given).
+    Any download error is stored in `error` - the FIFO is closed then and ffmpeg sees a premature EOF,
+    so the caller must check it before accepting ffmpeg output.
+    """
+
+    def __init__(
+        self, head: bytes, chunks: Iterator[bytes], fifo: Path, keep: Path | None, total: int | None
+    ) -> None:
+        super().__init__(daemon=True)
+        self.head = head
+        self.chunks = chunks
+        self.fifo = fifo
+        self.keep = keep
+        self.total = total
+        self.received = 0
+        self.error: BaseException | None = None
+        self.reader_exited = threading.Event()  # ffmpeg zakończył się (FIFO może nigdy nie zostać otwarte)
+        self.aborted = threading.Event()
+
+    def run(self) -> None:
+        try:
+            self._pump()
+        except BaseException as e:
+            self.error = e
+
+    def _open_fifo(self) -> int | None:
+        # otwarcie FIFO do zapisu blokuje do pojawienia się czytelnika - ffmpeg mógł paść wcześniej
+        while True:
+            try:
+                fd = os.open(self.fifo, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+                if self.reader_exited.wait(0.05):
+                    return None
+                continue
+            os.set_blocking(fd, True)
+            return fd
+
+    def _pump(self) -> None:
+        fd = self._open_fifo()
+        if fd is None:
+            return
+        part_path, state_path = part_paths(str(self.keep)) if self.keep else (None, None)
+        keep = open(part_path, "wb") if part_path else None
+        try:
+            for chunk in itertools.chain([self.head], self.chunks):
+                if self.aborted.is_set():
+                    return
+                if keep is not None:
+                    keep.write(chunk)
+                if fd is not None:
+                    try:
+                        write_all(fd, chunk)
+                    except BrokenPipeError:
+                        os.close(fd)
+                        fd = None
+                        if keep is None:
+                            return
+                self.received += len(chunk)
+            if self.total and self.received != self.total:
+                raise requests.ConnectionError(f"Received {self.received} of {self.total} bytes")
+            if keep is not None:
+                keep.flush()
+                os.fsync(keep.fileno())
+                keep.close()
+                keep = None
+                promote(part_path, state_path, str(self.keep))
+        finally:
+            if fd is not None:
+                os.close(fd)
+            if keep is not None:
+                keep.close()
+                # bez stanu pobierania .part nie da się wznowić
+                Path(part_path).unlink(missing_ok=True)
+
+
+def open_stream(sess: requests.Session, page_url: str) -> tuple[str, str, requests.Response]:
+    """Resolve direct link of the page (cached links are tried first) and open its download stream."""
+    use_cache = True
+    while True:
+        mp4, referer, cached = vider.resolve_link(sess, page_url, use_cache)
+        if not mp4:
+            raise LookupError(f"No MP4 link found on {page_url}")
+        response = sess.get(
+            mp4, headers={"User-Agent": vider.UA, "Accept": "*/*", "Referer": referer},
+            timeout=30, stream=True, allow_redirects=True,
+        )
+        try:
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            response.close()
+            if not (cached and is_rejected(e)):
+                raise
+            print(f"Cached link rejected (HTTP {e.response.status_code}), resolving again")
+            vider.LINK_CACHE.invalidate(page_url)
+            use_cache = False
+            continue
+        return mp4, referer, response
+
+
+def stream_remux(
+    inputs: RemuxInputs,
+    response: requests.Response,
+    head: bytes,
+    chunks: Iterator[bytes],
+    keep_mp4: Path | None,
+) -> None:
+    """Remux with `inputs.audio_input` being a FIFO fed by the download running at the same time."""
+    tracks = probe_head(head)
+    total = int(response.headers["Content-Length"]) if response.headers.get("Content-Length") else None
+    partial = inputs.partial_file
+    partial.parent.mkdir(parents=True, exist_ok=True)
+    cmd = build_ffmpeg_cmd(inputs, partial, audio_tracks=tracks)
+    pump = StreamPump(head, chunks, inputs.audio_input, keep_mp4, total)
+    try:
+        start = time.monotonic()
+        pump.start()
+        with span("ffmpeg", output=inputs.output_file.name, streamed=True) as ffmpeg_span:
+            try:
+                run_with_progress(cmd)
+            except BaseException:
+                pump.aborted.set()
+                raise
+            finally:
+                pump.reader_exited.set()
+                pump.join()
+            if pump.error is not None:
+                raise pump.error
+            ffmpeg_span.add_bytes(pump.received)
+        with span("finalize", output=inputs.output_file.name) as finalize_span:
+            finalize_span.add_bytes(partial.stat().st_size)
+            finalize_output(partial, inputs.output_file)
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+    elapsed = max(time.monotonic() - start, 1e-6)
+    print(f"Streamed {pump.received / 1024 / 1024:.0f} MiB at {pump.received / elapsed / 1e6:.1f} MB/s")
+    if keep_mp4 is not None:
+        print(f"Downloaded file saved to: {keep_mp4}")
+    print(f"Remuxed file saved to: {inputs.output_file}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Download vider video and remux its audio into video input while the download runs."
+    )
+    parser.add_argument("url", help="vider page or embed URL with the audio source")
+    parser.add_argument("--video-input", required=True, help="Path to video input file")
+    parser.add_argument(
+        "--keep-mp4", help="Also save downloaded MP4 under this path (by default it is not written to disk)"
+    )
+    parser.add_argument("--sub-input", help="Path to subtitles input file (optional)")
+    parser.add_argument(
+        "--output-folder", default="output", help="Output folder for remuxed file"
+    )
+    parser.add_argument(
+        "--scratch-folder",
+        help="Folder for in-progress output (e.g. on SSD), moved to output folder when complete"
+    )
+    parser.add_argument(
+        "--audio-track", type=int, default=0, help="Audio track index in downloaded video to use (default: 0)"
+    )
+    parser.add_argument(
+        "--sub-track", type=int, default=0, help="Subtitle track index to use (default: 0)"
+    )
+    parser.add_argument(
+        "--audio-offset", type=int, default=0, help="Audio offset in milliseconds"
+    )
+    parser.add_argument(
+        "--sub-offset", type=int, default=0, help="Subtitle offset in milliseconds"
+    )
+    parser.add_argument("--audio-lang", default="pol", help="Audio language (default: pol)")
+    parser.add_argument("--sub-lang", default="pol", help="Subtitle language (default: pol)")
+    parser.add_argument("--audio-title", default="Polish", help="Audio title (default: Polish)")
+    parser.add_argument("--sub-title", default="Polish", help="Subtitle title (default: Polish)")
+    parser.add_argument(
+        "--silence-point", action="append", default=[],
+        help="Point to insert silence (in MM:SS or MM:SS=SECONDS), can be given multiple times"
+    )
+    parser.add_argument(
+        "--silence-duration", type=float, help="Default duration of silence to insert (in seconds)"
+    )
+    parser.add_argument(
+        "--connections", type=int, default=4,
+        help="Connections used when the file has to be downloaded before remux (default: 4)"
+    )
+    parser.add_argument(
+        "--max-connections", type=int, default=16,
+        help="Maximum connections used when the file has to be downloaded before remux (default: 16)"
+    )
+    parser.add_argument(
+        "--link-cache", default=str(DEFAULT_LINK_CACHE_PATH),
+        help=f"Cache of resolved links (default: {DEFAULT_LINK_CACHE_PATH})"
+    )
+    parser.add_argument(
+        "--link-ttl", type=float, default=DEFAULT_TTL / 3600,
+        help=f"Hours a cached link is trusted (default: {DEFAULT_TTL / 3600:g})"
+    )
+    parser.add_argument("--no-link-cache", action="store_true", help="Always resolve links from pages")
+    parser.add_argument(
+        "--probe-cache", default=str(DEFAULT_CACHE_PATH),
+        help=f"Path to ffprobe cache database (default: {DEFAULT_CACHE_PATH})"
+    )
+    parser.add_argument(
+        "--no-probe-cache", action="store_true", help="Disable persistent ffprobe cache"
+    )
+    args = parser.parse_args()
+    try:
+        silence_gaps = parse_silence_gaps(args.silence_point, args.silence_duration)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    if not args.no_probe_cache:
+        simple_remux.PROBE_CACHE = ProbeCache(Path(args.probe_cache))
+    if not args.no_link_cache:
+        vider.LINK_CACHE = LinkCache(Path(args.link_cache), args.link_ttl * 3600)
+
+    output_folder = Path(args.output_folder)
+    output_folder.mkdir(parents=True, exist_ok=True)
+    scratch_folder = Path(args.scratch_folder) if args.scratch_folder else None
+    keep_mp4 = Path(args.keep_mp4) if args.keep_mp4 else None
+
+    def remux_inputs(audio_input: Path) -> RemuxInputs:
+        return RemuxInputs(
+            audio_input=audio_input,
+            video_input=Path(args.video_input),
+            output_folder=output_folder,
+            audio_track=args.audio_track,
+            subtitle_input=Path(args.sub_input) if args.sub_input else None,
+            subtitle_track=args.sub_track,
+            audio_offset=args.audio_offset,
+            sub_offset=args.sub_offset,
+            audio_lang=args.audio_lang,
+            sub_lang=args.sub_lang,
+            audio_title=args.audio_title,
+            sub_title=args.sub_title,
+            silence_gaps=silence_gaps,
+            scratch_folder=scratch_folder,
+        )
+
+    sess = requests.Session()
+    try:
+        # FIFO (albo, w razie potrzeby, pobrany plik) w katalogu roboczym - sprzątany na końcu
+        with tempfile.TemporaryDirectory(prefix=".fetch-remux-", dir=scratch_folder or output_folder) as work:
+            fifo = Path(work) / "audio.mp4"
+            os.mkfifo(fifo)
+            stream_inputs = remux_inputs(fifo)
+            # FIFO nie obciąża dysku - slot "remux" tylko na dyskach wideo, napisów i wyjścia
+            disk_paths = [p for p in stream_inputs.paths if p != fifo]
+            # slot przed otwarciem połączenia - czekające w kolejce io_scheduler.py zerwałby serwer
+            with admitted(disk_paths, "remux", stream_inputs.output_file.name):
+                mp4, referer, response = open_stream(sess, args.url)
+                print(f"Streaming {mp4}")
+                with response:
+                    chunks = response.iter_content(chunk_size=STREAM_CHUNK)
+                    head, faststart = read_head(chunks)
+                    if faststart:
+                        stream_remux(stream_inputs, response, head, chunks, keep_mp4)
+                        return
+
+            # indeks na końcu pliku - ffmpeg nie przeczyta go z potoku, więc najpierw pobieramy całość
+            # (poza slotem - to ruch sieciowy, remux() zajmie slot sam)
+            fifo.unlink()
+            print("MP4 index is not at the start of the file, downloading it before remux")
+            audio_path = keep_mp4 or Path(work) / "audio.mp4"
+            vider.download_with_session(
+                sess, mp4, str(audio_path), referer=referer,
+                connections=args.connections, max_connections=args.max_connections,
+            )
+            remux(remux_inputs(audio_path))
+    except (requests.RequestException, LookupError, RuntimeError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+from batch_remux import VIDEO_EXTENSIONS, episode_key
+from simple_remux import ParsedFile, parse_file
+
+CATALOGUE_PATH = Path(
+    os.environ.get("ARRRRRR_CATALOGUE", Path.home() / ".cache" / "arrrrrr" / "catalogue.sqlite")
+)
+LIBRARY_ROOTS = (Path("/media/movies"), Path("/media/series"))
+SEASON_PATTERN = re.compile(r'^Season (\d+)$')
+COMMIT_EVERY = 200  # wyników na transakcję - przerwana aktualizacja nie traci wszystkiego
+
+
+@dataclass(frozen=True)
+class LibraryFile:
+    path: Path          # link w bibliotece
+    target: str         # plik, na który wskazuje
+    kind: str           # movies / series
+    title: str
+    season: int | None
+    episode: int | None
+    size: int
+    mtime_ns: int
+
+
+def library_file(path: Path, root: Path) -> LibraryFile | None:
+    """Describe `path` from its place in the library (layout created by organise_by_filename.py)."""
+    try:
+        st = path.stat()
+        target = os.path.realpath(path)
+    except OSError:
+        return None  # link wskazuje na usunięty plik
+    parts = path.relative_to(root).parts
+    season = episode = None
+    if (key := episode_key(path)) is not None:
+        season, episode = key
+    elif len(parts) > 2 and (m := SEASON_PATTERN.match(parts[1])):
+        season = int(m.group(1))
+    return LibraryFile(path, target, root.name, parts[0], season, episode, st.st_size, st.st_mtime_ns)
+
+
+def walk_library(root: Path) -> Iterator[LibraryFile]:
+    """Video files (links) under `root`, in a single `os.scandir` walk without following directory links."""
+    if not root.is_dir():
+        return
+    stack = [root.as_posix()]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue  # m.in. .library.sqlite indeksu organisera
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in VIDEO_EXTENSIONS:
+                    if (file := library_file(Path(entry.path), root)) is not None:
+                        yield file
+
+
+class MediaCatalogue:
+    """
+    Tracks of every video in the Jellyfin library, kept in SQLite.
+
+    Files are probed again only when the file behind the link changed (target, size or mtime),
+    so keeping the catalogue current after new downloads takes a directory walk and a few probes.
+    """
+
+    def __init__(self, db_path: Path = CATALOGUE_PATH) -> None:
+        self.db_path = db_path
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(db_path, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY,"
+            " target TEXT NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " title TEXT NOT NULL,"
+            " season INTEGER,"
+            " episode INTEGER,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " probed_at REAL NOT NULL,"
+            " error TEXT)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS tracks ("
+            " path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,"
+            " type TEXT NOT NULL,"
+            " track INTEGER NOT NULL,"  # numer w obrębie typu, jak --audio-track/--sub-track
+            " idx INTEGER NOT NULL,"
+            " codec TEXT,"
+            " language TEXT NOT NULL,"
+            " channels INTEGER)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS tracks_lookup ON tracks(path, type, language)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_title ON files(kind, title)")
+        self.db.commit()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> "MediaCatalogue":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def known(self) -> dict[str, tuple[str, int, int, bool]]:
+        """path -> (target, size, mtime_ns, failed) of every catalogued file."""
+        rows = self.db.execute("SELECT path, target, size, mtime_ns, error IS NOT NULL FROM files")
+        return {r[0]: (r[1], r[2], r[3], bool(r[4])) for r in rows}
+
+    def store(self, file: LibraryFile, parsed: ParsedFile | None, error: str | None = None) -> None:
+        """Replace catalogue entry of `file` (without commit)."""
+        self.db.execute("DELETE FROM files WHERE path = ?", (str(file.path),))
+        self.db.execute(
+            "INSERT INTO files (path, target, kind, title, season, episode, size, mtime_ns, probed_at, error)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (str(file.path), file.target, file.kind, file.title, file.season, file.episode, file.size,
+             file.mtime_ns, time.time(), error),
+        )
+        if parsed is None:
+            return
+        rows = []
+        for track_type, tracks in (
+            ("video", parsed.video_tracks), ("audio", parsed.audio_tracks), ("subtitle", parsed.subtitle_tracks)
+        ):
+            for position, t in enumerate(tracks):
+                rows.append((str(file.path), track_type, position, t.index, t.codec_name, t.language.lower(), t.channels))
+        self.db.executemany(
+            "INSERT INTO tracks (path, type, track, idx, codec, language, channels) VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+        )
+
+    def forget(self, paths: list[str]) -> None:
+        self.db.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in paths])
+
+    def commit(self) -> None:
+        self.db.commit()
+
+    def missing(
+        self,
+        language: str,
+        track_types: tuple[str, ...] = ("audio", "subtitle"),
+        kind: str | None = None,
+        title: str | None = None,
+    ) -> list[tuple]:
+        """
+        Files without a `language` track of any of `track_types`.
+
+        Rows are (path, kind, title, season, episode, has_audio, has_subtitles), sorted by title and episode.
+        """
+        # typy pochodzą z tej listy, nie od użytkownika - można je wstawić wprost
+        has = "EXISTS (SELECT 1 FROM tracks t WHERE t.path = f.path AND t.type = '{}' AND t.language = :language)"
+        conditions = ["f.error IS NULL", "(" + " OR ".join(f"NOT {has.format(t)}" for t in track_types) + ")"]
+        if kind is not None:
+            conditions.append("f.kind = :kind")
+        if title is not None:
+            conditions.append("f.title LIKE '%' || :title || '%'")
+        return self.db.execute(
+            f"SELECT f.path, f.kind, f.title, f.season, f.episode, {has.format('audio')}, {has.format('subtitle')}"
+            f" FROM files f WHERE {' AND '.join(conditions)}"
+            " ORDER BY f.kind, f.title, f.season, f.episode, f.path",
+            {"language": language, "kind": kind, "title": title},
+        ).fetchall()
+
+    def stats(self) -> dict:
+        files, failed = self.db.execute("SELECT COUNT(*), COUNT(error) FROM files").fetchone()
+        languages = self.db.execute(
+            "SELECT type, language, COUNT(DISTINCT path) FROM tracks WHERE type != 'video'"
+            " GROUP BY type, language ORDER BY type, COUNT(DISTINCT path) DESC"
+        ).fetchall()
+        return {
+            "files": files,
+            "failed": failed,
+            "languages": {f"{track_type}:{language}": count for track_type, language, count in languages},
+        }
+
+
+def probe(file: LibraryFile) -> ParsedFile:
+    return parse_file(Path(file.target), 0)
+
+
+def update(catalogue: MediaCatalogue, roots: list[Path], workers: int, full: bool = False) -> None:
+    """Walk `roots`, probe new and changed files on a pool of `workers` ffprobe processes, drop removed ones."""
+    start = time.monotonic()
+    known = catalogue.known()
+    seen: set[str] = set()
+    changed: list[LibraryFile] = []
+    for root in roots:
+        for file in walk_library(root):
+            seen.add(str(file.path))
+            previous = known.get(str(file.path))
+            # nieudane próby powtarzamy przy każdej aktualizacji (np. plik był jeszcze kopiowany)
+            if full or previous is None or previous != (file.target, file.size, file.mtime_ns, False):
+                changed.append(file)
+    removed = [path for path in known if path not in seen and any(Path(path).is_relative_to(r) for r in roots)]
+    catalogue.forget(removed)
+    catalogue.commit()
+    print(f"{len(seen)} files in library, {len(changed)} to probe, {len(removed)} removed "
+          f"({time.monotonic() - start:.1f}s)")
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(probe, file): file for file in changed}
+        for done, future in enumerate(as_completed(futures), start=1):
+            file = futures[future]
+            try:
+                catalogue.store(file, future.result())
+            except Exception as e:
+                failed += 1
+                catalogue.store(file, None, str(e).strip() or type(e).__name__)
+            if done % COMMIT_EVERY == 0:
+                catalogue.commit()
+                elapsed = max(time.monotonic() - start, 1e-6)
+                print(f"\rProbed {done}/{len(changed)} ({done / elapsed:.1f} files/s)", end="", file=sys.stderr)
+    catalogue.commit()
+    if len(changed) >= COMMIT_EVERY:
+        print(file=sys.stderr)
+    print(f"Catalogue updated in {time.monotonic() - start:.1f}s" + (f", {failed} files failed to probe" if failed else ""))
+
+
+def print_missing(rows: list[tuple], language: str) -> None:
+    for path, kind, title, season, episode, has_audio, has_subs in rows:
+        lacking = "/".join(name for name, has in (("audio", has_audio), ("subs", has_subs)) if not has)
+        label = title
+        if season is not None and episode is not None:
+            label += f" S{season:02d}E{episode:02d}"
+        print(f"{label:<50} no {language} {lacking:<10} {path}")
+    print(f"{len(rows)} files")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Catalogue of audio and subtitle tracks of the whole media library.")
+    parser.add_argument(
+        "--db", default=str(CATALOGUE_PATH), help=f"Catalogue database (default: {CATALOGUE_PATH})"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    upd = sub.add_parser("update", help="Probe new and changed files in the library")
+    upd.add_argument(
+        "--root", action="append",
+        help=f"Library folder (can be repeated, default: {', '.join(map(str, LIBRARY_ROOTS))})"
+    )
+    upd.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1,
+        help="Maximum number of concurrent ffprobe processes (default: CPU count)"
+    )
+    upd.add_argument("--full", action="store_true", help="Probe every file again")
+    miss = sub.add_parser("missing", help="Files without an audio and/or subtitle track in given language")
+    miss.add_argument("--lang", default="pol", help="Language code (default: pol)")
+    tracks = miss.add_mutually_exclusive_group()
+    tracks.add_argument("--audio", action="store_true", help="Only files without audio in the language")
+    tracks.add_argument("--subs", action="store_true", help="Only files without subtitles in the language")
+    miss.add_argument("--kind", choices=[r.name for r in LIBRARY_ROOTS], help="Only movies or only series")
+    miss.add_argument("--title", help="Only titles containing this text")
+    miss.add_argument("--paths", action="store_true", help="Print only paths (e.g. to build a batch_remux manifest)")
+    miss.add_argument("--json", action="store_true", help="Print results as JSON")
+    sub.add_parser("stats", help="Number of files and of files with each audio/subtitle language")
+    sql = sub.add_parser("sql", help="Run a read-only query, e.g. over tables files and tracks")
+    sql.add_argument("query")
+    args = parser.parse_args()
+
+    with MediaCatalogue(Path(args.db)) as catalogue:
+        if args.command == "update":
+            roots = [Path(r) for r in args.root] if args.root else list(LIBRARY_ROOTS)
+            update(catalogue, roots, args.workers, args.full)
+        elif args.command == "missing":
+            track_types = ("audio",) if args.audio else ("subtitle",) if args.subs else ("audio", "subtitle")
+            rows = catalogue.missing(args.lang.lower(), track_types, args.kind, args.title)
+            if args.paths:
+                for row in rows:
+                    print(row[0])
+            elif args.json:
+                keys = ("path", "kind", "title", "season", "episode", "has_audio", "has_subtitles")
+                print(json.dumps([dict(zip(keys, row)) for row in rows], indent=2))
+            else:
+                print_missing(rows, args.lang)
+        elif args.command == "stats":
+            stats = catalogue.stats()
+            print(f"{stats['files']} files, {stats['failed']} failed to probe")
+            for key, count in stats["languages"].items():
+                print(f"  {key:<16} {count}")
+        elif args.command == "sql":
+            readonly = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+            try:
+                cursor = readonly.execute(args.query)
+                print("\t".join(d[0] for d in cursor.description or ()))
+                for row in cursor:
+                    print("\t".join("" if v is None else str(v) for v in row))
+            except sqlite3.Error as e:
+                print(f"Query failed: {e}")
+                sys.exit(1)
+            finally:
+                readonly.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Iterator
+
+DEFAULT_CACHE_PATH = Path(
+    os.environ.get("SIMPLE_REMUX_CACHE", Path.home() / ".cache" / "arrrrrr" / "ffprobe.sqlite")
+)
+DEFAULT_MAX_ENTRIES = 20000
+
+
+class ProbeCache:
+    """
+    Persistent ffprobe result cache.
+
+    Entries are keyed by (path, size, mtime, inode), so a replaced or rewritten
+    file is probed again. Least recently used entries are evicted once the cache
+    grows above `max_entries`.
+    """
+
+    def __init__(self, db_path: Path = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS probes ("
+                " path TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " mtime_ns INTEGER NOT NULL,"
+                " inode INTEGER NOT NULL,"
+                " data TEXT NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS probes_last_used ON probes(last_used)")
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # osobne połączenie na operację - bezpieczne przy wielu wątkach/procesach;
+        # samo "with conn" tylko commituje, więc zamykamy je jawnie
+        db = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def _key(input_file: Path) -> tuple[str, int, int, int]:
+        st = input_file.stat()
+        return str(input_file.resolve()), st.st_size, st.st_mtime_ns, st.st_ino
+
+    def get(self, input_file: Path) -> dict[str, Any] | None:
+        """Return cached ffprobe output, or None when missing or stale."""
+        path, size, mtime_ns, inode = self._key(input_file)
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT data FROM probes WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+                (path, size, mtime_ns, inode),
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE probes SET last_used = ? WHERE path = ?", (time.time(), path))
+        return json.loads(row[0])
+
+    def put(self, input_file: Path, data: dict[str, Any]) -> None:
+        """Store ffprobe output and evict least recently used entries."""
+        path, size, mtime_ns, inode = self._key(input_file)
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO probes (path, size, mtime_ns, inode, data, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, inode, json.dumps(data), time.time()),
+            )
+            db.execute(
+                "DELETE FROM probes WHERE path IN ("
+                " SELECT path FROM probes ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
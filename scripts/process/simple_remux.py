@@ -1,10 +1,34 @@
 import argparse
+import contextlib
+import os
+import shutil
 import subprocess
 import json
-from typing import Any, Literal
-from dataclasses import dataclass
+import sys
+import time
+from typing import Any, Iterator, Literal
+from dataclasses import dataclass, field
 from pathlib import Path
 
+from metrics import span
+from probe_cache import DEFAULT_CACHE_PATH, ProbeCache
+
+try:
+    from io_scheduler import admitted
+except ImportError:
+    # w repozytorium io_scheduler.py leży w scripts/organise
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "organise"))
+    try:
+        from io_scheduler import admitted
+    except ImportError:
+        # skrypt skopiowany sam (np. do /user-scripts) - bez kolejki, ffmpeg startuje od razu
+        @contextlib.contextmanager
+        def admitted(paths: list[Path], kind: str, label: str = "") -> Iterator[None]:
+            yield None
+
+# Globalny cache wyników ffprobe (None = wyłączony), ustawiany w main()
+PROBE_CACHE: ProbeCache | None = None
+
 # Update RemuxInputs dataclass to include offsets
 @dataclass
 class RemuxInputs:
@@ -20,6 +44,8 @@ class RemuxInputs:
     subtitle_track: int | None = None
     audio_offset: int | None = None  # in ms
     sub_offset: int | None = None    # in ms
+    silence_gaps: list["SilenceGap"] = field(default_factory=list)
+    scratch_folder: Path | None = None  # gdzie ffmpeg pisze plik tymczasowy (np. SSD)
 
     def __post_init__(self):
         path_to_validate: list[tuple[Path, str]] = [
@@ -38,6 +64,29 @@ class RemuxInputs:
     def output_file(self) -> Path:
         return self.output_folder / f"{self.video_input.stem}.mkv"
 
+    @property
+    def partial_file(self) -> Path:
+        return (self.scratch_folder or self.output_folder) / f".{self.output_file.name}.part"
+
+    @property
+    def paths(self) -> list[Path]:
+        """Every location remux reads or writes (for per-disk limits)."""
+        paths = [self.video_input, self.audio_input, self.output_folder]
+        if self.subtitle_input:
+            paths.append(self.subtitle_input)
+        if self.scratch_folder:
+            paths.append(self.scratch_folder)
+        return paths
+
+@dataclass(frozen=True)
+class SilenceGap:
+    point: int       # in seconds, audio input timeline
+    duration: float  # in seconds
+
+    def __lt__(self, other: "SilenceGap") -> bool:
+        return self.point < other.point
+
+
 @dataclass(frozen=True)
 class TrackInfo:
     index: int
@@ -83,65 +132,79 @@ def parse_mmss(time_str: str) -> int:
         raise argparse.ArgumentTypeError(f"Invalid time format '{time_str}', expected MM:SS")
 
 
-def insert_silence(audio_file: Path, insert_point: str, silence_duration: float, tmp_dir: Path) -> Path:
-    """Insert silence into an audio file at the given point, return new audio file path."""
-
-    # Wykryj kodek audio
-    info = run_ffprobe(audio_file)
-    codec_name = next(
-        (s.get("codec_name") for s in info.get("streams", []) if s.get("codec_type") == "audio"),
-        "aac"
-    )
-
-    # Domyślne parametry ciszy
-    codec_map = {
-        "aac":  ("aac", 48000, "stereo"),
-        "ac3":  ("ac3", 48000, "stereo"),
-        "mp3":  ("mp3", 44100, "stereo"),
-    }
-    acodec, rate, channels = codec_map.get(codec_name, ("aac", 48000, "stereo"))
-
-    # Pliki tymczasowe
-    part1 = tmp_dir / "audio_part1.mka"
-    part2 = tmp_dir / "audio_part2.mka"
-    silence = tmp_dir / "silence.mka"
-    concat_list = tmp_dir / "concat.txt"
-    out_file = tmp_dir / f"{audio_file.stem}_with_silence.mka"
-
-    # Wytnij audio przed punktem
-    subprocess.run([
-        "ffmpeg", "-y", "-i", str(audio_file), "-t", str(insert_point), "-c", "copy", str(part1)
-    ], check=True)
-
-    # Wytnij audio po punkcie
-    subprocess.run([
-        "ffmpeg", "-y", "-i", str(audio_file), "-ss", str(insert_point), "-c", "copy", str(part2)
-    ], check=True)
-
-    # Wygeneruj ciszę
-    subprocess.run([
-        "ffmpeg", "-y", "-f", "lavfi", "-t", str(silence_duration),
-        "-i", f"anullsrc=r={rate}:cl={channels}", "-c:a", acodec, str(silence)
-    ], check=True)
-
-    # Stwórz plik concat.txt
-    with open(concat_list, "w", encoding="utf-8") as f:
-        f.write(f"file '{part1}'\n")
-        f.write(f"file '{silence}'\n")
-        f.write(f"file '{part2}'\n")
-
-    # Sklej
-    subprocess.run([
-        "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(concat_list), "-c", "copy", str(out_file)
-    ], check=True)
-
-    return out_file
-
-
-
-def run_ffprobe(input_file: Path) -> dict[str, Any]:
-    """Run ffprobe on the input file and return parsed JSON output."""
-    cmd = [
+def parse_silence_gaps(points: list[str], default_duration: float | None) -> list[SilenceGap]:
+    """Convert `MM:SS` or `MM:SS=SECONDS` strings into sorted list of silence gaps."""
+    gaps: list[SilenceGap] = []
+    for point in points:
+        time_str, _, duration_str = point.partition("=")
+        if duration_str:
+            try:
+                duration = float(duration_str)
+            except ValueError:
+                raise argparse.ArgumentTypeError(f"Invalid silence duration in '{point}'")
+        elif default_duration is not None:
+            duration = default_duration
+        else:
+            raise argparse.ArgumentTypeError(
+                f"No duration for silence point '{point}', use MM:SS=SECONDS or --silence-duration"
+            )
+        gaps.append(SilenceGap(point=parse_mmss(time_str), duration=duration))
+    return sorted(gaps)
+
+
+# Kodek i bitrate dla ścieżki audio przepuszczanej przez filtr (stream copy nie jest wtedy możliwy)
+SILENCE_CODEC_MAP: dict[str, tuple[str, str]] = {
+    "aac":  ("aac", "256k"),
+    "ac3":  ("ac3", "448k"),
+    "eac3": ("eac3", "448k"),
+    "mp3":  ("mp3", "192k"),
+}
+
+
+def build_silence_filter(
+    audio: tuple[ParsedFile, TrackMapping],
+    gaps: list[SilenceGap],
+    audio_offset: int | None,
+    out_label: str,
+) -> str:
+    """
+    Build filter graph inserting all silence gaps into the audio track in one pass.
+
+    Track is split at every gap point, each part (except the last) is padded with
+    silence of gap duration and parts are concatenated again. Audio offset is applied
+    after concatenation, so gap points stay in audio input timeline.
+    """
+    parsed, mapping = audio
+    count = len(gaps) + 1
+    splits = "".join(f"[sil{i}]" for i in range(count))
+    graph = [f"[{parsed.id}:a:{mapping.track_index}]asetpts=PTS-STARTPTS,asplit={count}{splits}"]
+
+    start: int | None = None
+    for i in range(count):
+        trim = []
+        if start is not None:
+            trim.append(f"start={start}")
+        if i < len(gaps):
+            trim.append(f"end={gaps[i].point}")
+        part = f"[sil{i}]atrim={':'.join(trim)},asetpts=PTS-STARTPTS"
+        if i < len(gaps):
+            part += f",apad=pad_dur={gaps[i].duration}"
+            start = gaps[i].point
+        graph.append(f"{part}[part{i}]")
+
+    parts = "".join(f"[part{i}]" for i in range(count))
+    concat = f"{parts}concat=n={count}:v=0:a=1"
+    if audio_offset and audio_offset > 0:
+        concat += f",adelay=delays={audio_offset}:all=1"
+    elif audio_offset and audio_offset < 0:
+        concat += f",atrim=start={-audio_offset / 1000},asetpts=PTS-STARTPTS"
+    graph.append(f"{concat}[{out_label}]")
+    return ";".join(graph)
+
+
+def ffprobe_cmd(target: str) -> list[str]:
+    """ffprobe command printing stream info of `target` (path, or `pipe:0` for stdin) as JSON."""
+    return [
         "ffprobe",
         "-v",
         "error",
@@ -149,33 +212,52 @@ def run_ffprobe(input_file: Path) -> dict[str, Any]:
         "stream=index,codec_type,codec_name,channels:stream_tags=language:format=filename",
         "-of",
         "json",
-        str(input_file),
+        target,
     ]
-    result = subprocess.run(
-        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-    )
+
+
+def run_ffprobe(input_file: Path) -> dict[str, Any]:
+    """Run ffprobe on the input file and return parsed JSON output."""
+    if PROBE_CACHE is not None and (cached := PROBE_CACHE.get(input_file)) is not None:
+        return cached
+
+    with span("probe", file=input_file.name):
+        result = subprocess.run(
+            ffprobe_cmd(str(input_file)), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
     if result.returncode != 0:
         raise RuntimeError(f"ffprobe error: {result.stderr}")
-    return json.loads(result.stdout)
+    info = json.loads(result.stdout)
+    if PROBE_CACHE is not None:
+        PROBE_CACHE.put(input_file, info)
+    return info
 
 
-def list_tracks(input_file: Path, track_type: str) -> list[TrackInfo]:
-    """List tracks of a given type (audio or subtitle) in the input file."""
-    info = run_ffprobe(input_file)
-    tracks: list[TrackInfo] = []
+def probe_tracks(input_file: Path) -> dict[str, list[TrackInfo]]:
+    """Probe the input file once and return its tracks grouped by codec type."""
+    return tracks_from_info(run_ffprobe(input_file))
+
+
+def tracks_from_info(info: dict[str, Any]) -> dict[str, list[TrackInfo]]:
+    """Group streams from ffprobe JSON output by codec type."""
+    tracks: dict[str, list[TrackInfo]] = {"video": [], "audio": [], "subtitle": []}
     for s in info.get("streams", []):
-        if s.get("codec_type") == track_type:
-            tracks.append(
-                TrackInfo(
-                    index=int(s.get("index")) - 1,
-                    codec_name=s.get("codec_name"),
-                    codec_type=s.get("codec_type"),
-                    channels=s.get("channels"),
-                    language=s.get("tags", {}).get("language", "und"),
-                    tags=s.get("tags", {}),
-                )
+        tracks.setdefault(s.get("codec_type"), []).append(
+            TrackInfo(
+                index=int(s.get("index")) - 1,
+                codec_name=s.get("codec_name"),
+                codec_type=s.get("codec_type"),
+                channels=s.get("channels"),
+                language=s.get("tags", {}).get("language", "und"),
+                tags=s.get("tags", {}),
             )
-    return list(sorted(tracks))
+        )
+    return {k: list(sorted(v)) for k, v in tracks.items()}
+
+
+def list_tracks(input_file: Path, track_type: str) -> list[TrackInfo]:
+    """List tracks of a given type (audio or subtitle) in the input file."""
+    return probe_tracks(input_file).get(track_type, [])
 
 
 def print_tracks(tracks: list[TrackInfo], track_type: str, input_file: Path) -> None:
@@ -190,14 +272,16 @@ def print_tracks(tracks: list[TrackInfo], track_type: str, input_file: Path) ->
             extra = f", channels: {t.channels if t.channels is not None else '?'}"
         print(f"  Track {idx}: codec={codec}, lang={lang}{extra}")
 
-def parse_file(input_file: Path, file_id: int) -> ParsedFile:
-    """Parse input file and return ParsedFile with track info."""
+def parse_file(input_file: Path, file_id: int, tracks: dict[str, list[TrackInfo]] | None = None) -> ParsedFile:
+    """Parse input file (unless its `tracks` are already known) and return ParsedFile with track info."""
+    if tracks is None:
+        tracks = probe_tracks(input_file)
     return ParsedFile(
         path=input_file,
         id=file_id,
-        video_tracks=list_tracks(input_file, "video"),
-        audio_tracks=list_tracks(input_file, "audio"),
-        subtitle_tracks=list_tracks(input_file, "subtitle"),
+        video_tracks=tracks["video"],
+        audio_tracks=tracks["audio"],
+        subtitle_tracks=tracks["subtitle"],
     )
 
 def prepare_lang_metadata(
@@ -227,8 +311,16 @@ def prepare_lang_metadata(
     return args
 
 
-def build_ffmpeg_cmd(inputs: RemuxInputs) -> list[str]:
-    """Build ffmpeg command for remuxing."""
+def build_ffmpeg_cmd(
+    inputs: RemuxInputs,
+    output_path: Path | None = None,
+    audio_tracks: dict[str, list[TrackInfo]] | None = None,
+) -> list[str]:
+    """
+    Build ffmpeg command for remuxing (into `output_path`, by default `inputs.output_file`).
+
+    `audio_tracks` skips probing of audio input - needed when it is a pipe that can be read only once.
+    """
 
     # Parse all input files
     file_id = 0
@@ -237,7 +329,7 @@ def build_ffmpeg_cmd(inputs: RemuxInputs) -> list[str]:
 
     file_id += 1
     # Add audio input if different
-    audio_file = parse_file(inputs.audio_input, file_id)
+    audio_file = parse_file(inputs.audio_input, file_id, audio_tracks)
 
     file_id += 1
     # Add subtitle input if present
@@ -261,41 +353,143 @@ def build_ffmpeg_cmd(inputs: RemuxInputs) -> list[str]:
     files: list[tuple[ParsedFile | None, TrackMapping | None]] = [(video_file, out_video_track), (audio_file, out_audio_track), (sub_file, out_sub_track)]
     includes: list[str] = []
     mappings: list[str] = []
+    filters: list[str] = []
     for f, m in files:
         if f is not None:
-            if inputs.audio_offset is not None and f == audio_file:
+            if inputs.audio_offset is not None and f == audio_file and not inputs.silence_gaps:
                 includes.extend(["-itsoffset", str(inputs.audio_offset / 1000)])
             includes.extend(["-i", str(f.path)])
         if m is not None:
-            mappings.extend(["-map", str(m)])
+            if m is out_audio_track and inputs.silence_gaps:
+                # cisza wstawiana filtrem w tym samym przebiegu - bez plików tymczasowych
+                filters.extend([
+                    "-filter_complex",
+                    build_silence_filter((audio_file, m), inputs.silence_gaps, inputs.audio_offset, "asil"),
+                ])
+                mappings.extend(["-map", "[asil]"])
+            else:
+                mappings.extend(["-map", str(m)])
+
+    codecs: list[str] = ["-c", "copy"]
+    if inputs.silence_gaps:
+        source_codec = "aac"
+        if 0 <= inputs.audio_track < len(audio_file.audio_tracks):
+            source_codec = audio_file.audio_tracks[inputs.audio_track].codec_name
+        acodec, bitrate = SILENCE_CODEC_MAP.get(source_codec, SILENCE_CODEC_MAP["aac"])
+        new_audio_id = len(video_file.audio_tracks)
+        codecs.extend([f"-c:a:{new_audio_id}", acodec, f"-b:a:{new_audio_id}", bitrate])
 
     cmd: list[str] = [
         "ffmpeg", 
         "-y", 
         *includes, 
+        *filters,
         *mappings, 
         "-map_metadata", str(video_file.id), 
         "-map_chapters", str(video_file.id),
-        "-c", "copy", 
+        *codecs,
         *prepare_lang_metadata(options=inputs, video=(video_file, out_video_track), handle_subs=(sub_file is not None)),
-        str(inputs.output_file)
+        *(["-f", "matroska"] if output_path is not None else []),
+        str(output_path or inputs.output_file)
     ]
 
     print("FFmpeg command built successfully:", "`" + " ".join(cmd) + "`")
     print()
     return cmd
 
+COPY_BUFFER_SIZE = 16 * 1024 * 1024  # duże, sekwencyjne zapisy na HDD
+
+
+def fsync_dir(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def run_with_progress(cmd: list[str]) -> None:
+    """Run ffmpeg with `-progress pipe:1` and report written size and throughput."""
+    cmd = [cmd[0], "-nostats", "-progress", "pipe:1", *cmd[1:]]
+    start = time.monotonic()
+    total_size = 0
+    out_time = "00:00:00"
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True) as proc:
+        assert proc.stdout is not None
+        for line in proc.stdout:
+            key, _, value = line.strip().partition("=")
+            if key == "total_size" and value.isdigit():
+                total_size = int(value)
+            elif key == "out_time":
+                out_time = value.split(".")[0]
+            elif key == "progress":
+                elapsed = max(time.monotonic() - start, 1e-6)
+                print(
+                    f"\rProgress: {out_time}, {total_size / 1024 / 1024:.0f} MiB, "
+                    f"{total_size / elapsed / 1e6:.1f} MB/s",
+                    end="", file=sys.stderr
+                )
+    print(file=sys.stderr)
+    if proc.returncode != 0:
+        raise RuntimeError("ffmpeg remuxing failed.")
+
+
+def finalize_output(partial: Path, destination: Path) -> None:
+    """
+    Make finished file visible under `destination` atomically.
+
+    On the same filesystem it is fsync + rename. Otherwise file is copied once, sequentially,
+    with large buffers into hidden file next to destination and then renamed.
+    """
+    with open(partial, "rb") as f:
+        os.fsync(f.fileno())
+
+    if partial.stat().st_dev == destination.parent.stat().st_dev:
+        os.replace(partial, destination)
+        fsync_dir(destination.parent)
+        return
+
+    staged = destination.parent / partial.name
+    size = partial.stat().st_size
+    start = time.monotonic()
+    try:
+        with open(partial, "rb") as src, open(staged, "wb") as dst:
+            shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(staged, destination)
+        fsync_dir(destination.parent)
+    except BaseException:
+        staged.unlink(missing_ok=True)
+        raise
+    partial.unlink()
+    elapsed = max(time.monotonic() - start, 1e-6)
+    print(f"Copied {size / 1024 / 1024:.0f} MiB to {destination.parent} at {size / elapsed / 1e6:.1f} MB/s")
+
+
 def remux(
         inputs: RemuxInputs
 ) -> None:
     """Perform remuxing using ffmpeg."""
 
-    cmd = build_ffmpeg_cmd(inputs)
+    partial = inputs.partial_file
+    partial.parent.mkdir(parents=True, exist_ok=True)
+    cmd = build_ffmpeg_cmd(inputs, partial)
     print("Running ffmpeg command:")
     print(" ".join(cmd))
-    result = subprocess.run(cmd)
-    if result.returncode != 0:
-        raise RuntimeError("ffmpeg remuxing failed.")
+    try:
+        # czeka w kolejce io_scheduler.py, jeśli działa - nie walczy o dysk z kopiowaniem torrentów
+        with admitted(inputs.paths, "remux", inputs.output_file.name):
+            with span("ffmpeg", output=inputs.output_file.name) as ffmpeg_span:
+                run_with_progress(cmd)
+                ffmpeg_span.add_bytes(partial.stat().st_size)
+            with span("finalize", output=inputs.output_file.name) as finalize_span:
+                finalize_span.add_bytes(partial.stat().st_size)
+                finalize_output(partial, inputs.output_file)
+    except BaseException:
+        # niedokończony plik nigdy nie trafia do docelowego katalogu
+        partial.unlink(missing_ok=True)
+        raise
     print(f"Remuxed file saved to: {inputs.output_file}")
 
 def main() -> None:
@@ -310,6 +504,10 @@ def main() -> None:
     parser.add_argument(
         "--output-folder", default="output", help="Output folder for remuxed file"
     )
+    parser.add_argument(
+        "--scratch-folder",
+        help="Folder for in-progress output (e.g. on SSD), moved to output folder when complete"
+    )
     parser.add_argument(
         "--list-tracks",
         action="store_true",
@@ -340,13 +538,37 @@ def main() -> None:
         "--sub-title", type=str, default="Polish", help="Subtitle title (default: Polish)"
     )
     parser.add_argument(
-        "--silence-point", type=str, help="Point to insert silence (in MM:SS)"
+        "--silence-point", type=str, action="append", default=[],
+        help="Point to insert silence (in MM:SS or MM:SS=SECONDS), can be given multiple times"
+    )
+    parser.add_argument(
+        "--silence-duration", type=float, help="Default duration of silence to insert (in seconds)"
     )
     parser.add_argument(
-        "--silence-duration", type=float, help="Duration of silence to insert (in seconds)"
+        "--auto-sync", action="store_true",
+        help="Detect audio offset and silence points automatically (requires numpy)"
+    )
+    parser.add_argument(
+        "--sync-reference-track", type=int, default=0,
+        help="Audio track index in video input used as sync reference (default: 0)"
+    )
+    parser.add_argument(
+        "--probe-cache", type=str, default=str(DEFAULT_CACHE_PATH),
+        help=f"Path to ffprobe cache database (default: {DEFAULT_CACHE_PATH})"
+    )
+    parser.add_argument(
+        "--no-probe-cache", action="store_true", help="Disable persistent ffprobe cache"
     )
 
     args = parser.parse_args()
+    try:
+        silence_gaps = parse_silence_gaps(args.silence_point, args.silence_duration)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    global PROBE_CACHE
+    if not args.no_probe_cache:
+        PROBE_CACHE = ProbeCache(Path(args.probe_cache))
 
     inputs = RemuxInputs(
         audio_input=Path(args.audio_input),
@@ -361,30 +583,37 @@ def main() -> None:
         sub_lang=args.sub_lang if args.sub_lang else "pol",
         audio_title=args.audio_title if args.audio_title else "Polish",
         sub_title=args.sub_title if args.sub_title else "Polish",
+        silence_gaps=silence_gaps,
+        scratch_folder=Path(args.scratch_folder) if args.scratch_folder else None,
     )
 
     inputs.output_folder.mkdir(parents=True, exist_ok=True)
 
-    if args.silence_point and args.silence_duration:
-        silence_seconds = parse_mmss(args.silence_point)
-        tmp_dir = inputs.output_folder / "tmp"
-        tmp_dir.mkdir(parents=True, exist_ok=True)
-        new_audio = insert_silence(inputs.audio_input, str(silence_seconds), args.silence_duration, tmp_dir)
-        inputs.audio_input = new_audio
+    if args.auto_sync:
+        from auto_sync import detect_sync
+
+        sync = detect_sync(inputs.video_input, args.sync_reference_track, inputs.audio_input, inputs.audio_track)
+        inputs.audio_offset = sync.audio_offset
+        inputs.silence_gaps = [SilenceGap(point=p, duration=d) for p, d in sync.silence_gaps]
+        print(f"Detected audio offset: {inputs.audio_offset} ms")
+        for gap in inputs.silence_gaps:
+            print(f"Detected silence point: {gap.point // 60:02d}:{gap.point % 60:02d}={gap.duration}")
 
     if args.list_tracks:
-        print_tracks(list_tracks(inputs.audio_input, "audio"), "audio", inputs.audio_input)
-        print_tracks(list_tracks(inputs.video_input, "audio"), "audio", inputs.video_input)
+        audio_tracks = probe_tracks(inputs.audio_input)
+        video_tracks = probe_tracks(inputs.video_input)
+        print_tracks(audio_tracks["audio"], "audio", inputs.audio_input)
+        print_tracks(video_tracks["audio"], "audio", inputs.video_input)
         if inputs.subtitle_input:
             print_tracks(
                 list_tracks(inputs.subtitle_input, "subtitle"), "subtitle", inputs.subtitle_input
             )
 
         print_tracks(
-            list_tracks(inputs.video_input, "subtitle"), "Video::subtitle", inputs.video_input
+            video_tracks["subtitle"], "Video::subtitle", inputs.video_input
         )
         print_tracks(
-            list_tracks(inputs.audio_input, "subtitle"), "Audio::subtitle", inputs.audio_input
+            audio_tracks["subtitle"], "Audio::subtitle", inputs.audio_input
         )
         return
 